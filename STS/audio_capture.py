@@ -0,0 +1,212 @@
+import asyncio
+import time
+import wave
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+FRAME_SIZE = int(SAMPLE_RATE * 30 / 1000)
+RING_SECONDS = 2  # audio the ring buffer can hold before the callback drops frames
+QUEUE_FRAMES = 32  # frames waiting for the consumer before the pump blocks
+
+
+class RingBuffer:
+    """
+    Single-producer / single-consumer ring buffer of int16 samples.
+
+    The audio callback is the only writer of `_write_pos` and the consumer the
+    only writer of `_read_pos`, so no lock is needed. When the consumer falls
+    behind, new samples are dropped and counted in `overflow_samples`.
+    """
+
+    def __init__(self, capacity: int):
+        self._data = np.zeros(capacity, dtype=np.int16)
+        self._capacity = capacity
+        self._write_pos = 0
+        self._read_pos = 0
+        self.overflow_samples = 0
+
+    def available(self) -> int:
+        return self._write_pos - self._read_pos
+
+    def write(self, samples: np.ndarray) -> int:
+        free = self._capacity - self.available()
+        n = min(len(samples), free)
+        if n < len(samples):
+            self.overflow_samples += len(samples) - n
+        if n == 0:
+            return 0
+        start = self._write_pos % self._capacity
+        first = min(n, self._capacity - start)
+        self._data[start:start + first] = samples[:first]
+        if first < n:
+            self._data[:n - first] = samples[first:n]
+        self._write_pos += n
+        return n
+
+    def read(self, n: int):
+        if self.available() < n:
+            return None
+        start = self._read_pos % self._capacity
+        first = min(n, self._capacity - start)
+        if first == n:
+            out = self._data[start:start + n].copy()
+        else:
+            out = np.concatenate((self._data[start:], self._data[:n - first]))
+        self._read_pos += n
+        return out
+
+
+class CaptureStats:
+    __slots__ = ('frames', 'ring_overflow_samples', 'queue_waits', 'device_overflows')
+
+    def __init__(self):
+        self.frames = 0
+        self.ring_overflow_samples = 0
+        self.queue_waits = 0
+        self.device_overflows = 0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class AudioSource:
+    """
+    Base class of the capture layer: `frames()` is an async iterator of int16
+    NumPy frames of `frame_size` samples, fed through a bounded asyncio.Queue.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, frame_size=FRAME_SIZE,
+                 queue_frames=QUEUE_FRAMES):
+        self.sample_rate = sample_rate
+        self.frame_size = frame_size
+        self.queue = asyncio.Queue(maxsize=queue_frames)
+        self.stats = CaptureStats()
+        self._closed = False
+
+    async def _put(self, frame):
+        if self.queue.full():
+            self.stats.queue_waits += 1
+        await self.queue.put(frame)
+        self.stats.frames += 1
+
+    async def _produce(self):
+        raise NotImplementedError
+
+    def close(self):
+        self._closed = True
+
+    async def frames(self):
+        producer = asyncio.create_task(self._produce())
+        try:
+            while True:
+                frame = await self.queue.get()
+                if frame is None:
+                    break
+                yield frame
+        finally:
+            self.close()
+            producer.cancel()
+            try:
+                await producer
+            except asyncio.CancelledError:
+                pass
+
+    async def batches(self, max_frames=QUEUE_FRAMES):
+        """
+        Like frames(), but yields (n, frame_size) arrays holding every frame
+        already queued (at least one), so consumers can process them in bulk.
+        """
+        batch = []
+        async for frame in self.frames():
+            batch.append(frame)
+            while len(batch) < max_frames and not self.queue.empty():
+                frame = self.queue.get_nowait()
+                if frame is None:
+                    # End of stream: put the marker back for frames()
+                    self.queue.put_nowait(None)
+                    break
+                batch.append(frame)
+            yield np.stack(batch)
+            batch = []
+
+
+class MicrophoneSource(AudioSource):
+    """Fills a ring buffer from the sounddevice callback thread."""
+
+    def __init__(self, ring_seconds=RING_SECONDS, **kwargs):
+        super().__init__(**kwargs)
+        self.ring = RingBuffer(int(self.sample_rate * ring_seconds))
+
+    async def _produce(self):
+        import sounddevice as sd
+
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+
+        def callback(indata, frames, time_info, status):
+            if status.input_overflow:
+                self.stats.device_overflows += 1
+            self.ring.write(indata[:, 0])
+            loop.call_soon_threadsafe(ready.set)
+
+        with sd.InputStream(samplerate=self.sample_rate, channels=1, dtype='int16',
+                            blocksize=self.frame_size, callback=callback):
+            while not self._closed:
+                await ready.wait()
+                ready.clear()
+                while True:
+                    frame = self.ring.read(self.frame_size)
+                    if frame is None:
+                        break
+                    await self._put(frame)
+                self.stats.ring_overflow_samples = self.ring.overflow_samples
+        await self.queue.put(None)
+
+
+def read_pcm(path: str, sample_rate=SAMPLE_RATE) -> np.ndarray:
+    """Reads a 16-bit mono WAV file, or raw little-endian PCM for other suffixes."""
+    if path.lower().endswith('.wav'):
+        with wave.open(path, 'rb') as wav_file:
+            if wav_file.getsampwidth() != 2 or wav_file.getnchannels() != 1:
+                raise ValueError(f"{path}: expected 16-bit mono audio")
+            if wav_file.getframerate() != sample_rate:
+                raise ValueError(f"{path}: expected {sample_rate} Hz, "
+                                 f"got {wav_file.getframerate()} Hz")
+            return np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype='<i2')
+    with open(path, 'rb') as f:
+        return np.frombuffer(f.read(), dtype='<i2')
+
+
+class FileSource(AudioSource):
+    """
+    Replays a WAV/PCM file (or an int16 array) as if it came from the
+    microphone. With `realtime=False` frames are produced as fast as the
+    consumer accepts them, which is what offline benchmarks want.
+    """
+
+    def __init__(self, path_or_samples, realtime=False, **kwargs):
+        super().__init__(**kwargs)
+        if isinstance(path_or_samples, np.ndarray):
+            self.samples = path_or_samples.astype(np.int16, copy=False)
+        else:
+            self.samples = read_pcm(path_or_samples, self.sample_rate)
+        self.realtime = realtime
+
+    async def _produce(self):
+        frame_seconds = self.frame_size / self.sample_rate
+        started = time.monotonic()
+        usable = len(self.samples) - len(self.samples) % self.frame_size
+        for index, start in enumerate(range(0, usable, self.frame_size)):
+            if self._closed:
+                break
+            if self.realtime:
+                delay = started + index * frame_seconds - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await self._put(self.samples[start:start + self.frame_size])
+        await self.queue.put(None)
+
+
+def open_source(path=None, **kwargs) -> AudioSource:
+    return FileSource(path, **kwargs) if path else MicrophoneSource(**kwargs)
@@ -0,0 +1,47 @@
+"""
+Offline throughput of the capture layer: replays a WAV/PCM file (or synthetic
+noise) through FileSource and a VAD consumer, without the microphone.
+
+Usage:
+    python bench_capture.py [file.wav] [seconds]
+"""
+import asyncio
+import sys
+import time
+
+import numpy as np
+import webrtcvad
+
+import audio_capture
+
+SAMPLE_RATE = audio_capture.SAMPLE_RATE
+
+
+async def run(source):
+    vad = webrtcvad.Vad(0)
+    frames = 0
+    speech = 0
+    async for frame in source.frames():
+        frames += 1
+        speech += vad.is_speech(frame.tobytes(), SAMPLE_RATE)
+    return frames, speech
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else None
+    if path:
+        samples = audio_capture.read_pcm(path)
+    else:
+        seconds = int(sys.argv[2]) if len(sys.argv) > 2 else 600
+        rng = np.random.default_rng(0)
+        samples = rng.integers(-3000, 3000, SAMPLE_RATE * seconds, dtype=np.int16)
+
+    source = audio_capture.FileSource(samples)
+    started = time.perf_counter()
+    frames, speech = asyncio.run(run(source))
+    elapsed = time.perf_counter() - started
+    audio_seconds = len(samples) / SAMPLE_RATE
+    print(f"audio={audio_seconds:.1f}s frames={frames} speech_frames={speech}")
+    print(f"elapsed={elapsed:.3f}s realtime_factor={audio_seconds / elapsed:.1f}x "
+          f"per_frame={elapsed / max(frames, 1) * 1e6:.1f}us")
+    print(f"stats={source.stats.as_dict()}")
@@ -0,0 +1,75 @@
+"""
+Compares the old per-frame VAD gating with vad_gate.VadGate on a WAV/PCM
+recording (or a synthetic speech/silence pattern): bytes sent versus captured,
+speech segments and CPU time per second of audio.
+
+Usage:
+    python bench_vad_gate.py [file.wav]
+"""
+import sys
+import time
+
+import numpy as np
+import webrtcvad
+
+import audio_capture
+import vad_gate
+
+SAMPLE_RATE = 16000
+FRAME_SIZE = int(SAMPLE_RATE * 30 / 1000)
+BATCH_FRAMES = 32
+
+
+def synthetic_session(seconds=120, seed=0):
+    # Voiced bursts (harmonics + noise, 0.3-2 s) separated by 0.2-1.5 s of
+    # low-level background noise
+    rng = np.random.default_rng(seed)
+    parts = []
+    total = 0
+    while total < seconds * SAMPLE_RATE:
+        n = int(rng.uniform(0.2, 1.5) * SAMPLE_RATE)
+        parts.append(rng.normal(0, 30, n))
+        n_speech = int(rng.uniform(0.3, 2.0) * SAMPLE_RATE)
+        t = np.arange(n_speech) / SAMPLE_RATE
+        f0 = rng.uniform(110, 240)
+        voiced = sum(np.sin(2 * np.pi * f0 * k * t) / k for k in range(1, 8))
+        parts.append(voiced * 3000 + rng.normal(0, 300, n_speech))
+        total += n + n_speech
+    return np.clip(np.concatenate(parts), -32768, 32767).astype(np.int16)
+
+
+def per_frame(frames):
+    vad = webrtcvad.Vad(vad_gate.VAD_MODE)
+    sent = 0
+    started = time.process_time()
+    for frame in frames:
+        if vad.is_speech(frame.tobytes(), SAMPLE_RATE):
+            sent += 1
+    return sent, time.process_time() - started
+
+
+def gated(frames):
+    gate = vad_gate.VadGate(sample_rate=SAMPLE_RATE)
+    sent = 0
+    for start in range(0, len(frames), BATCH_FRAMES):
+        sent += len(gate.process_batch(frames[start:start + BATCH_FRAMES]))
+    return sent, gate.stats
+
+
+if __name__ == "__main__":
+    samples = audio_capture.read_pcm(sys.argv[1]) if len(sys.argv) > 1 else synthetic_session()
+    usable = len(samples) - len(samples) % FRAME_SIZE
+    frames = samples[:usable].reshape(-1, FRAME_SIZE)
+    audio_seconds = usable / SAMPLE_RATE
+    captured = usable * 2
+
+    sent, cpu = per_frame(frames)
+    print(f"per-frame: sent={sent * FRAME_SIZE * 2}/{captured} bytes "
+          f"({sent / len(frames):.1%}) cpu={cpu * 1000 / audio_seconds:.3f}ms per audio second")
+
+    sent, stats = gated(frames)
+    report = stats.as_dict(SAMPLE_RATE)
+    print(f"gated:     sent={report['bytes_sent']}/{report['bytes_captured']} bytes "
+          f"({report['sent_ratio']:.1%}) segments={report['segments']} "
+          f"vad_calls={report['vad_calls']}/{report['frames']} "
+          f"cpu={report['cpu_ms_per_audio_second']:.3f}ms per audio second")
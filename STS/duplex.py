@@ -0,0 +1,333 @@
+"""
+Full-duplex voice session: the microphone, VAD and endpointing keep running
+while Luna speaks, and speech from the customer stops playback (插話).
+
+Usage:
+    python duplex.py
+"""
+import asyncio
+import statistics
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from amazon_transcribe.handlers import TranscriptResultStreamHandler
+
+import audio_capture
+import endpointing
+import stt
+import tts
+import vad_gate
+
+PLAYBACK_BLOCK = 320  # 20 ms output blocks bound how long a stop takes to be heard
+# Onset frames needed to barge in while playing; higher than the gate default so
+# speaker echo picked up by the microphone does not stop playback
+BARGE_IN_ONSET_FRAMES = 4
+# Echo suppression without AEC (Geigel double-talk test): while playing, a
+# microphone frame whose peak is below ECHO_RATIO of the loudest output of the
+# last ECHO_TAIL_BLOCKS blocks is taken as echo and cannot count as speech
+ECHO_RATIO = 0.5
+ECHO_TAIL_BLOCKS = 25  # 500 ms of room and device delay
+# One Transcribe stream serves the whole session. Transcribe closes a stream
+# that gets no audio for 15 s and the gate sends nothing on an idle line, so a
+# frame of silence is sent after KEEPALIVE_SECONDS without speech
+KEEPALIVE_SECONDS = 5
+# After an endpoint, how long to wait for the final result of a partial that
+# was still open; past that the partial is taken as the turn's text
+FINAL_WAIT_SECONDS = 1.0
+
+
+class Player:
+    """
+    Non-blocking playback of int16 audio. `stop()` silences the output from the
+    next callback block and returns the number of samples that were played.
+    """
+
+    def __init__(self, sample_rate=tts.SAMPLE_RATE, blocksize=PLAYBACK_BLOCK):
+        self.sample_rate = sample_rate
+        self.blocksize = blocksize
+        self._audio = np.zeros(0, dtype=np.int16)
+        self._position = 0
+        self._stop = threading.Event()
+        self._stream = None
+        self._done = None
+        self._peaks = deque(maxlen=ECHO_TAIL_BLOCKS)
+
+    @property
+    def active(self) -> bool:
+        return self._stream is not None and not self._done.is_set()
+
+    @property
+    def echo_level(self) -> int:
+        """Peak of the audio played in the last ECHO_TAIL_BLOCKS blocks."""
+        return max(self._peaks, default=0)
+
+    @property
+    def played_fraction(self) -> float:
+        return self._position / len(self._audio) if len(self._audio) else 1.0
+
+    def start(self, audio):
+        import sounddevice as sd
+
+        loop = asyncio.get_running_loop()
+        self._audio = audio
+        self._position = 0
+        self._stop.clear()
+        self._peaks.clear()
+        self._done = asyncio.Event()
+
+        def callback(outdata, frames, time_info, status):
+            if self._stop.is_set():
+                outdata.fill(0)
+                raise sd.CallbackStop
+            chunk = self._audio[self._position:self._position + frames]
+            outdata[:len(chunk), 0] = chunk
+            outdata[len(chunk):, 0] = 0
+            self._position += len(chunk)
+            self._peaks.append(int(np.abs(chunk.astype(np.int32)).max()) if len(chunk) else 0)
+            if len(chunk) < frames:
+                raise sd.CallbackStop
+
+        def finished():
+            loop.call_soon_threadsafe(self._done.set)
+
+        self._stream = sd.OutputStream(samplerate=self.sample_rate, channels=1, dtype='int16',
+                                       blocksize=self.blocksize, callback=callback,
+                                       finished_callback=finished)
+        self._stream.start()
+
+    async def wait(self):
+        if self._done is not None:
+            await self._done.wait()
+
+    def stop(self) -> int:
+        self._stop.set()
+        if self._stream is not None:
+            # abort() drops whatever is still queued in the device buffer
+            self._stream.abort()
+            self._stream.close()
+            self._stream = None
+        if self._done is not None:
+            self._done.set()
+        return self._position
+
+
+class BargeInStats:
+    __slots__ = ('count', 'reaction_ms')
+
+    def __init__(self):
+        self.count = 0
+        self.reaction_ms = []
+
+    def as_dict(self):
+        result = {'count': self.count}
+        if self.reaction_ms:
+            result['reaction_ms_p50'] = statistics.median(self.reaction_ms)
+            result['reaction_ms_max'] = max(self.reaction_ms)
+        return result
+
+
+class TurnHandler(TranscriptResultStreamHandler):
+    """
+    Feeds the results of the session's stream to the current turn's endpointer.
+
+    A turn may end on a partial result whose final arrives later; `stale` then
+    drops that result (and its partials) so it is not counted again in the next
+    turn.
+    """
+
+    def __init__(self, output_stream, endpointer):
+        super().__init__(output_stream)
+        self.endpointer = endpointer
+        self.stale = False
+
+    async def handle_transcript_event(self, transcript_event):
+        for result in transcript_event.transcript.results:
+            if not result.alternatives:
+                continue
+            if self.stale:
+                if not result.is_partial:
+                    self.stale = False
+                continue
+            self.endpointer.on_transcript(result.alternatives[0].transcript, result.is_partial)
+
+
+class DuplexSession:
+    """
+    Runs listen → respond → speak turns while capture never stops.
+
+    `respond(text, interrupted)` returns Luna's answer; `interrupted` is None or
+    a dict with the part of the previous answer that was said before the
+    customer cut in and the part that was not. Synthesis, the respond call and
+    playback of a turn form one task that a barge-in cancels; the barge-in also
+    sets a stop event that the Polly read and the playback callback check, since
+    cancelling the task does not stop its worker threads.
+
+    A single Transcribe stream is opened for the session and the endpointer
+    splits turns inside it, so an idle line does not restart (and pay for) a
+    stream every time the no-speech timeout expires.
+    """
+
+    def __init__(self, respond, source=None):
+        self.respond = respond
+        self.source = source or audio_capture.MicrophoneSource(sample_rate=stt.SAMPLE_RATE,
+                                                               frame_size=stt.FRAME_SIZE)
+        self.gate = stt.create_gate()
+        self.player = Player()
+        self.stats = BargeInStats()
+        self.interrupted = None
+        self._listener = None
+        self._endpointer = None
+        self._handler = None
+        self._transcription = None
+        self._speaking = None
+        self._speaking_text = ''
+        self._stop_speaking = threading.Event()
+
+    async def _capture(self):
+        frame_seconds = self.source.frame_size / self.source.sample_rate
+        async for batch in self.source.batches():
+            received = time.monotonic()
+            playing = self._speaking is not None and not self._speaking.done()
+            self.gate.onset_frames = BARGE_IN_ONSET_FRAMES if playing else vad_gate.ONSET_FRAMES
+            echo = None
+            if self.player.active:
+                peaks = np.abs(batch.astype(np.int32)).max(axis=1)
+                echo = peaks < ECHO_RATIO * self.player.echo_level
+            frames = self.gate.process_batch(batch, suppress=echo)
+            if playing and self.gate.in_speech:
+                # The batch ends about when it is received; go back to the
+                # first voiced frame of the onset
+                onset = received - (self.gate.position - self.gate.onset_position) * frame_seconds
+                self._barge_in(onset)
+            if self._endpointer is not None:
+                self._endpointer.on_frames(self.gate.last_voiced)
+            if self._listener is not None:
+                for frame in frames:
+                    self._listener.put_nowait(frame)
+
+    def _barge_in(self, onset):
+        played = self.player.played_fraction if self.player.active else 0.0
+        self._stop_speaking.set()
+        self.player.stop()
+        self._speaking.cancel()
+        self._speaking = None
+        reaction_ms = (time.monotonic() - onset) * 1000
+        self.stats.count += 1
+        self.stats.reaction_ms.append(reaction_ms)
+        cut = int(len(self._speaking_text) * played)
+        self.interrupted = {
+            'said': self._speaking_text[:cut],
+            'unsaid': self._speaking_text[cut:],
+        }
+        print(f"✋ Barge-in after {played:.0%} of the answer, "
+              f"playback stopped {reaction_ms:.1f} ms after the customer started speaking")
+
+    async def _transcribe(self):
+        stream = await stt.transcribe_client.start_stream_transcription(
+            language_code=stt.LANGUAGE_CODE,
+            media_sample_rate_hz=stt.SAMPLE_RATE,
+            media_encoding='pcm'
+        )
+        self._handler = TurnHandler(stream.output_stream, self._endpointer)
+        silence = np.zeros(stt.FRAME_SIZE, dtype=np.int16)
+
+        async def send_audio():
+            while True:
+                try:
+                    frame = await asyncio.wait_for(self._listener.get(), timeout=KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    frame = silence
+                if frame is None:
+                    break
+                await stream.input_stream.send_audio_event(audio_chunk=frame.tobytes())
+            await stream.input_stream.end_stream()
+
+        await asyncio.gather(send_audio(), self._handler.handle_events())
+
+    async def _listen_turn(self):
+        # The stream stays open across turns; only the endpointer starts over
+        endpointer = self._endpointer
+        while endpointer.decision is None:
+            if self._transcription.done():
+                self._transcription.result()
+                raise RuntimeError("Transcribe stream closed")
+            await asyncio.sleep(0.05)
+        waited = 0.0
+        while endpointer.partial and waited < FINAL_WAIT_SECONDS:
+            await asyncio.sleep(0.05)
+            waited += 0.05
+        text = endpointer.final + endpointer.partial
+        if endpointer.partial and self._handler is not None:
+            self._handler.stale = True
+        endpointer.reset()
+        return text
+
+    async def _speak(self, text):
+        # A barge-in before this answer exists must not cut the previous one
+        self._speaking_text = ''
+        stop = self._stop_speaking = threading.Event()
+        interrupted, self.interrupted = self.interrupted, None
+        answer = await asyncio.to_thread(self.respond, text, interrupted)
+        if not answer:
+            return
+        self._speaking_text = answer
+        audio = await asyncio.to_thread(tts.synthesize, answer, stop)
+        if audio is None or stop.is_set():
+            return
+        self.player.start(audio)
+        try:
+            await self.player.wait()
+        finally:
+            self.player.stop()
+
+    async def run(self, turns=None):
+        frame_ms = stt.FRAME_SIZE * 1000 // stt.SAMPLE_RATE
+        self._endpointer = endpointing.Endpointer(aggressiveness=stt.ENDPOINT_AGGRESSIVENESS,
+                                                  frame_ms=frame_ms,
+                                                  max_silence_ms=stt.SILENT_COUNT * frame_ms,
+                                                  log=None)
+        self._listener = asyncio.Queue()
+        transcription = self._transcription = asyncio.create_task(self._transcribe())
+        capture = asyncio.create_task(self._capture())
+        try:
+            turn = 0
+            while turns is None or turn < turns:
+                text = await self._listen_turn()
+                if not text:
+                    continue
+                print("Recognized:", text)
+                turn += 1
+                # Keep listening while Luna answers; a barge-in cancels this task
+                self._speaking = asyncio.create_task(self._speak(text))
+            if self._speaking is not None:
+                try:
+                    await self._speaking
+                except asyncio.CancelledError:
+                    pass
+        finally:
+            capture.cancel()
+            self._listener.put_nowait(None)
+            try:
+                await asyncio.wait_for(transcription, timeout=FINAL_WAIT_SECONDS)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+            print(f"Barge-in stats: {self.stats.as_dict()}")
+
+
+def sales_flow_respond():
+    invoke = stt.load_sales_flow()
+
+    def respond(text, interrupted):
+        if interrupted:
+            # Tell the flow what the customer actually heard before cutting in
+            text = (f"(上一個回答在「{interrupted['said']}」之後被客戶打斷，"
+                    f"未說出的部分：「{interrupted['unsaid']}」)\n{text}")
+        return invoke(text)
+
+    return respond
+
+
+if __name__ == "__main__":
+    asyncio.run(DuplexSession(sales_flow_respond()).run())
@@ -0,0 +1,155 @@
+import json
+import re
+
+FRAME_MS = 30
+# Fixed timeout used before adaptive endpointing: SILENT_COUNT frames of silence
+MAX_SILENCE_MS = 1500
+STABLE_PARTIALS = 3  # identical partial results in a row count as stable
+SENTENCE_FINAL = re.compile(r'[。？！?!.]\s*$')
+# Question particles and polite closers that usually end a turn in Mandarin
+FINAL_PARTICLES = ('嗎', '吗', '呢', '吧', '謝謝', '谢谢', '好了', '就這樣', '就这样')
+
+# Silence (ms) required per cue, indexed by aggressiveness 0 (cautious) .. 3
+THRESHOLDS = {
+    'final_punctuated': (700, 500, 350, 250),
+    'final': (1000, 800, 600, 450),
+    'stable_partial': (1200, 1000, 800, 600),
+    'speech': (MAX_SILENCE_MS, MAX_SILENCE_MS, 1300, 1100),
+}
+
+
+class EndpointDecision:
+    __slots__ = ('reason', 'at_ms', 'silence_ms', 'transcript')
+
+    def __init__(self, reason, at_ms, silence_ms, transcript):
+        self.reason = reason
+        self.at_ms = at_ms
+        self.silence_ms = silence_ms
+        self.transcript = transcript
+
+    def __repr__(self):
+        return (f"EndpointDecision(reason={self.reason!r}, at_ms={self.at_ms}, "
+                f"silence_ms={self.silence_ms}, transcript={self.transcript!r})")
+
+
+class Endpointer:
+    """
+    Decides when the user has finished a turn.
+
+    Combines the length of the current VAD silence with what Transcribe has
+    returned so far: a final result ending in sentence-final punctuation (or a
+    closing particle) ends the turn after a short pause, an unpunctuated final
+    or a partial result that stopped changing needs a longer one, and plain
+    speech falls back to the old fixed timeout (`max_silence_ms`). `aggressiveness` (0-3) selects
+    the thresholds.
+
+    Time is counted in frames so recorded sessions replay deterministically.
+    """
+
+    def __init__(self, aggressiveness=0, frame_ms=FRAME_MS, stable_partials=STABLE_PARTIALS,
+                 max_silence_ms=MAX_SILENCE_MS, log=print):
+        self.level = max(0, min(3, aggressiveness))
+        self.frame_ms = frame_ms
+        self.max_silence_ms = max_silence_ms
+        self.stable_partials = stable_partials
+        self.log = log
+        self.reset()
+
+    def reset(self):
+        self.now_ms = 0
+        self.silence_ms = 0
+        self.heard_speech = False
+        self.partial = ''
+        self.partial_repeats = 0
+        self.final = ''
+        self.final_at_ms = None
+        self.decision = None
+
+    def threshold(self, cue) -> int:
+        return min(THRESHOLDS[cue][self.level], self.max_silence_ms)
+
+    def on_frames(self, voiced_flags):
+        """Advances the clock by one frame per VAD flag and returns a decision or None."""
+        for voiced in voiced_flags:
+            self.now_ms += self.frame_ms
+            if voiced:
+                self.silence_ms = 0
+                self.heard_speech = True
+            else:
+                self.silence_ms += self.frame_ms
+            decision = self.check()
+            if decision is not None:
+                return decision
+        return None
+
+    def on_transcript(self, text, is_partial):
+        text = text.strip()
+        if is_partial:
+            if text and text == self.partial:
+                self.partial_repeats += 1
+            else:
+                self.partial = text
+                self.partial_repeats = 1
+        else:
+            if text:
+                self.final = (self.final + text) if self.final else text
+                self.final_at_ms = self.now_ms
+            self.partial = ''
+            self.partial_repeats = 0
+        return self.check()
+
+    def _cue(self):
+        if self.final and not self.partial:
+            if SENTENCE_FINAL.search(self.final) or self.final.endswith(FINAL_PARTICLES):
+                return 'final_punctuated'
+            return 'final'
+        if self.partial and self.partial_repeats >= self.stable_partials:
+            return 'stable_partial'
+        return 'speech'
+
+    def check(self):
+        if self.decision is not None:
+            return self.decision
+        if not self.heard_speech:
+            # Nothing said yet: keep the old timeout so an idle line still closes
+            if self.silence_ms > self.max_silence_ms:
+                return self._decide('no_speech')
+            return None
+        cue = self._cue()
+        if self.silence_ms >= self.threshold(cue):
+            return self._decide(cue)
+        return None
+
+    def _decide(self, reason):
+        transcript = self.final + (self.partial if self.partial else '')
+        self.decision = EndpointDecision(reason, self.now_ms, self.silence_ms, transcript)
+        if self.log is not None:
+            self.log(f"Endpoint: {self.decision}")
+        return self.decision
+
+
+class SessionRecorder:
+    """
+    Writes the VAD flags and transcript events of a live session as JSON lines,
+    for offline evaluation with eval_endpointing.py.
+    """
+
+    def __init__(self, path, frame_ms=FRAME_MS):
+        self.file = open(path, 'w', encoding='utf-8')
+        self.frame_ms = frame_ms
+        self.now_ms = 0
+
+    def frames(self, voiced_flags):
+        for voiced in voiced_flags:
+            self.now_ms += self.frame_ms
+            self._write({"t": self.now_ms, "type": "vad", "speech": bool(voiced)})
+
+    def transcript(self, text, is_partial):
+        self._write({"t": self.now_ms, "type": "transcript", "text": text,
+                     "partial": bool(is_partial)})
+
+    def _write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,143 @@
+"""
+Offline evaluation of adaptive endpointing against the fixed 1.5 s timeout.
+
+Replays recorded sessions (JSONL written by `stt.py --record`) or synthetic
+ones, and reports per aggressiveness level the end-of-turn latency, the
+latency saved against the fixed timeout and the share of false cut-offs
+(turns ended before the user had finished).
+
+A session may contain {"type": "label", "end_ms": ...} with the true end of the
+user's turn; otherwise the last voiced frame is used.
+
+Usage:
+    python eval_endpointing.py [session.jsonl ...]
+"""
+import json
+import random
+import statistics
+import sys
+
+import endpointing
+
+FRAME_MS = endpointing.FRAME_MS
+SILENT_COUNT = 50
+
+
+def load_session(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def synthetic_session(rng):
+    """
+    One user turn: 1-4 phrases separated by 200-900 ms pauses, partial results
+    every ~300 ms of speech, a final after every phrase and punctuation on the
+    last one 70% of the time, followed by 3 s of silence.
+    """
+    events = []
+    now = 0
+    phrases = rng.randint(1, 4)
+    words = ['我想', '了解', '葉黃素', '的', '價格', '有沒有', '優惠', '我', '眼睛', '很乾']
+    text = ''
+    for index in range(phrases):
+        speech_ms = rng.randint(8, 60) * FRAME_MS
+        phrase = ''
+        for t in range(0, speech_ms, FRAME_MS):
+            now += FRAME_MS
+            events.append({"t": now, "type": "vad", "speech": rng.random() > 0.08})
+            if t % 300 == 0:
+                phrase += rng.choice(words)
+                events.append({"t": now, "type": "transcript", "text": text + phrase,
+                               "partial": True})
+        end_of_phrase = now
+        last = index == phrases - 1
+        if last and rng.random() < 0.7:
+            phrase += rng.choice(['。', '？', '嗎'])
+        pause_ms = 3000 if last else rng.randint(7, 30) * FRAME_MS
+        final_delay = rng.randint(5, 12) * FRAME_MS  # Transcribe finalizes after a short lag
+        for t in range(0, pause_ms, FRAME_MS):
+            now += FRAME_MS
+            events.append({"t": now, "type": "vad", "speech": rng.random() < 0.02})
+            if t == final_delay:
+                events.append({"t": now, "type": "transcript", "text": phrase,
+                               "partial": False})
+        text += phrase
+        if last:
+            events.append({"t": end_of_phrase, "type": "label", "end_ms": end_of_phrase})
+    return events
+
+
+def true_end(events):
+    for event in events:
+        if event['type'] == 'label':
+            return event['end_ms']
+    voiced = [event['t'] for event in events if event['type'] == 'vad' and event['speech']]
+    return voiced[-1] if voiced else 0
+
+
+def fixed_timeout(events):
+    silent_count = 0
+    for event in events:
+        if event['type'] != 'vad':
+            continue
+        silent_count = 0 if event['speech'] else silent_count + 1
+        if silent_count > SILENT_COUNT:
+            return event['t']
+    return None
+
+
+def adaptive(events, aggressiveness):
+    endpointer = endpointing.Endpointer(aggressiveness=aggressiveness, frame_ms=FRAME_MS,
+                                        max_silence_ms=SILENT_COUNT * FRAME_MS, log=None)
+    for event in events:
+        if event['type'] == 'vad':
+            decision = endpointer.on_frames([event['speech']])
+        elif event['type'] == 'transcript':
+            decision = endpointer.on_transcript(event['text'], event['partial'])
+        else:
+            continue
+        if decision is not None:
+            return decision
+    return None
+
+
+def evaluate(sessions):
+    baseline = []
+    for events in sessions:
+        at = fixed_timeout(events)
+        baseline.append(None if at is None else at - true_end(events))
+    done = [latency for latency in baseline if latency is not None]
+    print(f"fixed 1.5s   sessions={len(sessions)} "
+          f"latency p50={statistics.median(done):.0f}ms mean={statistics.mean(done):.0f}ms")
+
+    for level in range(4):
+        latencies = []
+        saved = []
+        cut_offs = 0
+        reasons = {}
+        for events, base in zip(sessions, baseline):
+            decision = adaptive(events, level)
+            if decision is None:
+                continue
+            reasons[decision.reason] = reasons.get(decision.reason, 0) + 1
+            latency = decision.at_ms - true_end(events)
+            if latency < 0:
+                cut_offs += 1
+                continue
+            latencies.append(latency)
+            if base is not None:
+                saved.append(base - latency)
+        print(f"adaptive {level}   latency p50={statistics.median(latencies):.0f}ms "
+              f"mean={statistics.mean(latencies):.0f}ms "
+              f"saved mean={statistics.mean(saved):.0f}ms "
+              f"false_cutoffs={cut_offs}/{len(sessions)} ({cut_offs / len(sessions):.1%}) "
+              f"reasons={reasons}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sessions = [load_session(path) for path in sys.argv[1:]]
+    else:
+        rng = random.Random(0)
+        sessions = [synthetic_session(rng) for _ in range(500)]
+    evaluate(sessions)
@@ -0,0 +1,126 @@
+import asyncio
+import difflib
+import re
+import time
+
+STABLE_EVENTS = 3  # identical partial results before speculating
+TOLERANCE = 0.1  # max normalized difference between speculated and final text
+
+_IGNORED = re.compile(r'[\s，。？！、,.?!:：;；"“”\'‘’]+')
+
+
+def normalize(text: str) -> str:
+    # Transcribe adds punctuation to finals that partials do not have yet
+    return _IGNORED.sub('', text)
+
+
+def similar(a: str, b: str, tolerance=TOLERANCE) -> bool:
+    a, b = normalize(a), normalize(b)
+    if a == b:
+        return True
+    return difflib.SequenceMatcher(None, a, b).ratio() >= 1 - tolerance
+
+
+class SpeculationStats:
+    __slots__ = ('finals', 'started', 'hits', 'misses', 'cancelled', 'latency_saved_ms')
+
+    def __init__(self):
+        self.finals = 0
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+        self.latency_saved_ms = 0.0
+
+    def as_dict(self):
+        result = {name: getattr(self, name) for name in self.__slots__}
+        result['hit_rate'] = self.hits / self.finals if self.finals else 0.0
+        result['mean_saved_ms'] = self.latency_saved_ms / self.hits if self.hits else 0.0
+        return result
+
+
+class Speculator:
+    """
+    Starts the downstream call on a partial transcript once it has stayed the
+    same for `stable_events` events, instead of waiting for the final result.
+
+    When the final arrives, the speculative call is committed if the texts
+    match within `tolerance`; otherwise it is cancelled and the call is
+    reissued with the final text. `invoke(text)` may be a coroutine function or
+    a blocking function, which then runs in a worker thread (a cancelled
+    thread cannot be stopped, its result is just discarded).
+    """
+
+    def __init__(self, invoke, stable_events=STABLE_EVENTS, tolerance=TOLERANCE):
+        self.invoke = invoke
+        self.stable_events = stable_events
+        self.tolerance = tolerance
+        self.stats = SpeculationStats()
+        self._partial = ''
+        self._repeats = 0
+        self._task = None
+        self._task_text = ''
+        self._task_started = 0.0
+
+    async def _run(self, text):
+        if asyncio.iscoroutinefunction(self.invoke):
+            result = await self.invoke(text)
+        else:
+            result = await asyncio.to_thread(self.invoke, text)
+        return result, time.monotonic()
+
+    def _start(self, text):
+        return asyncio.create_task(self._run(text))
+
+    def _cancel(self):
+        if self._task is not None:
+            if not self._task.done():
+                self._task.cancel()
+            self.stats.cancelled += 1
+        self._task = None
+        self._task_text = ''
+
+    def on_partial(self, text):
+        text = normalize(text)
+        if not text:
+            return
+        if text == self._partial:
+            self._repeats += 1
+        else:
+            self._partial = text
+            self._repeats = 1
+        if self._repeats < self.stable_events or text == self._task_text:
+            return
+        # The user kept talking after the last speculation: it is stale
+        self._cancel()
+        print(f"Speculating on: {text}")
+        self._task = self._start(text)
+        self._task_text = text
+        self._task_started = time.monotonic()
+        self.stats.started += 1
+
+    async def on_final(self, text):
+        """Returns the downstream result for the final transcript."""
+        task, task_text, started = self._task, self._task_text, self._task_started
+        self._task = None
+        self._task_text = ''
+        self._partial = ''
+        self._repeats = 0
+        self.stats.finals += 1
+
+        if task is not None and similar(task_text, text, self.tolerance):
+            final_at = time.monotonic()
+            result, finished_at = await task
+            self.stats.hits += 1
+            # Time the call had already been running when the final arrived,
+            # capped by how long the call took
+            self.stats.latency_saved_ms += (min(final_at, finished_at) - started) * 1000
+            return result
+
+        if task is not None:
+            self.stats.misses += 1
+            if not task.done():
+                task.cancel()
+            self.stats.cancelled += 1
+        result, _ = await self._start(text)
+        return result
@@ -1,65 +1,132 @@
-import webrtcvad
-import sounddevice as sd
+import argparse
 import asyncio
+import os
+import sys
 from amazon_transcribe.client import TranscribeStreamingClient
 from amazon_transcribe.handlers import TranscriptResultStreamHandler
 from amazon_transcribe.model import TranscriptEvent
 
+import audio_capture
+import endpointing
+import speculation
+import vad_gate
+
 # Settings
 REGION = 'us-west-2'
 LANGUAGE_CODE = 'zh-CN'
 SAMPLE_RATE = 16000
 FRAME_SIZE = int(SAMPLE_RATE * 30 / 1000)
 VAD_MODE = 0  # 0-3, higher = more aggressive in detecting silence
-SILENT_COUNT = 50
+SILENT_COUNT = 50  # fallback when endpointing has no better cue
+ENDPOINT_AGGRESSIVENESS = 0  # 0-3, higher = end the turn sooner
+SPECULATE_STABLE_EVENTS = 3  # unchanged partial results before calling the flow early
+PRE_ROLL_FRAMES = 10  # 300 ms sent ahead of the detected onset
+HANGOVER_FRAMES = 8  # 240 ms dips inside a word keep streaming
 
 # Create AWS Transcribe client
 transcribe_client = TranscribeStreamingClient(region=REGION)
 
+
 # Initialize VAD
-vad = webrtcvad.Vad(VAD_MODE)
+def create_gate():
+    return vad_gate.VadGate(sample_rate=SAMPLE_RATE, mode=VAD_MODE,
+                            pre_roll_frames=PRE_ROLL_FRAMES,
+                            hangover_frames=HANGOVER_FRAMES)
+
+
+def load_sales_flow():
+    # The sales flow lives in ../flow, which is not a package
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'flow'))
+    import sales_agent
+    return lambda text: sales_agent.invoke_rag_flow(text, sales_agent.session_id)
 
-def audio_stream():
-    with sd.InputStream(samplerate=SAMPLE_RATE, channels=1, dtype='int16') as stream:
-        while True:
-            data, overflowed = stream.read(FRAME_SIZE)  # Small frames (10ms ~ 160 samples at 16kHz)
-            is_speech = vad.is_speech(data.tobytes(), SAMPLE_RATE)
-            yield data, is_speech
 
 class MyEventHandler(TranscriptResultStreamHandler):
+    def __init__(self, output_stream, endpointer=None, recorder=None, speculator=None):
+        super().__init__(output_stream)
+        self.endpointer = endpointer
+        self.recorder = recorder
+        self.speculator = speculator
+        self.responses = []
+
+    async def respond(self, text):
+        answer = await self.speculator.on_final(text)
+        print("Flow answer:", answer)
+        print(f"Speculation stats: {self.speculator.stats.as_dict()}")
+
     async def handle_transcript_event(self, transcript_event: TranscriptEvent):
         results = transcript_event.transcript.results
         for result in results:
+            if result.alternatives:
+                text = result.alternatives[0].transcript
+                if self.endpointer is not None:
+                    self.endpointer.on_transcript(text, result.is_partial)
+                if self.recorder is not None:
+                    self.recorder.transcript(text, result.is_partial)
+                if self.speculator is not None:
+                    if result.is_partial:
+                        self.speculator.on_partial(text)
+                    else:
+                        self.responses.append(asyncio.create_task(self.respond(text)))
             if result.is_partial:
                 continue
             for alt in result.alternatives:
                 print("Recognized:", alt.transcript)
-                # 🚀 Here you can call your Bedrock Flow with alt.transcript
 
-async def basic_transcribe():
+async def basic_transcribe(path=None, record=None, speculate=False):
+    # `path` replays a WAV/PCM file instead of the microphone; `record` saves the
+    # VAD and transcript events for eval_endpointing.py. With `speculate` the
+    # sales flow is started on stable partial transcripts.
+    source = audio_capture.open_source(path, sample_rate=SAMPLE_RATE, frame_size=FRAME_SIZE)
     stream = await transcribe_client.start_stream_transcription(
         language_code=LANGUAGE_CODE,
         media_sample_rate_hz=SAMPLE_RATE,
         media_encoding='pcm'
     )
 
+    gate = create_gate()
+    frame_ms = FRAME_SIZE * 1000 // SAMPLE_RATE
+    endpointer = endpointing.Endpointer(aggressiveness=ENDPOINT_AGGRESSIVENESS,
+                                        frame_ms=frame_ms,
+                                        max_silence_ms=SILENT_COUNT * frame_ms)
+    recorder = endpointing.SessionRecorder(record) if record else None
+
     async def send_audio():
-        silent_count = 0
-        for data, is_speech in audio_stream():
-            print(is_speech)
-            if is_speech:
-                silent_count = 0
-                await stream.input_stream.send_audio_event(audio_chunk=data.tobytes())
-            else:
-                silent_count += 1
-                if silent_count > SILENT_COUNT:  # No speech for 1500 s
-                    print("🛑 User stopped speaking.")
-                    await stream.input_stream.end_stream()
-                    break
-
-    handler = MyEventHandler(stream.output_stream)
+        # Frames come from the capture layer's queue, so waiting for the
+        # microphone never blocks the event loop. Only speech segments (with
+        # pre-roll and hangover) are streamed to Transcribe.
+        async for batch in source.batches():
+            for frame in gate.process_batch(batch):
+                await stream.input_stream.send_audio_event(audio_chunk=frame.tobytes())
+            if recorder is not None:
+                recorder.frames(gate.last_voiced)
+            decision = endpointer.on_frames(gate.last_voiced)
+            if decision is not None:
+                print(f"🛑 User stopped speaking ({decision.reason}).")
+                await stream.input_stream.end_stream()
+                break
+        if recorder is not None:
+            recorder.close()
+        print(f"Capture stats: {source.stats.as_dict()}")
+        print(f"VAD gate stats: {gate.stats.as_dict(SAMPLE_RATE)}")
+
+    speculator = None
+    if speculate:
+        speculator = speculation.Speculator(load_sales_flow(),
+                                            stable_events=SPECULATE_STABLE_EVENTS)
+    handler = MyEventHandler(stream.output_stream, endpointer=endpointer, recorder=recorder,
+                             speculator=speculator)
 
     await asyncio.gather(send_audio(), handler.handle_events())
+    if handler.responses:
+        await asyncio.gather(*handler.responses)
 
 # Run
-asyncio.run(basic_transcribe())
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", nargs="?", help="WAV/PCM file to use instead of the microphone")
+    parser.add_argument("--record", help="write VAD and transcript events to this JSONL file")
+    parser.add_argument("--speculate", action="store_true",
+                        help="call the sales flow on stable partial transcripts")
+    args = parser.parse_args()
+    asyncio.run(basic_transcribe(args.path, record=args.record, speculate=args.speculate))
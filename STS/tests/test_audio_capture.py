@@ -0,0 +1,107 @@
+import asyncio
+import os
+import tempfile
+import unittest
+import wave
+
+import numpy as np
+
+import audio_capture
+from audio_capture import FileSource, RingBuffer, read_pcm
+
+
+async def collect(aiter):
+    return [item async for item in aiter]
+
+
+class RingBufferTest(unittest.TestCase):
+
+    def test_read_returns_none_until_enough_samples(self):
+        ring = RingBuffer(8)
+        ring.write(np.arange(3, dtype=np.int16))
+        self.assertIsNone(ring.read(4))
+        np.testing.assert_array_equal(ring.read(3), [0, 1, 2])
+        self.assertEqual(ring.available(), 0)
+
+    def test_wraps_around_the_end(self):
+        ring = RingBuffer(8)
+        ring.write(np.arange(6, dtype=np.int16))
+        ring.read(6)
+        self.assertEqual(ring.write(np.arange(10, 16, dtype=np.int16)), 6)
+        np.testing.assert_array_equal(ring.read(6), np.arange(10, 16))
+
+    def test_drops_and_counts_overflow(self):
+        ring = RingBuffer(4)
+        self.assertEqual(ring.write(np.arange(6, dtype=np.int16)), 4)
+        self.assertEqual(ring.overflow_samples, 2)
+        self.assertEqual(ring.write(np.arange(2, dtype=np.int16)), 0)
+        self.assertEqual(ring.overflow_samples, 4)
+        np.testing.assert_array_equal(ring.read(4), [0, 1, 2, 3])
+
+
+class ReadPcmTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write_wav(self, name, samples, rate=audio_capture.SAMPLE_RATE, channels=1):
+        path = os.path.join(self.tmp.name, name)
+        with wave.open(path, 'wb') as wav_file:
+            wav_file.setnchannels(channels)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(rate)
+            wav_file.writeframes(samples.astype('<i2').tobytes())
+        return path
+
+    def test_reads_wav_and_raw_pcm(self):
+        samples = np.array([1, -2, 300, -32768], dtype=np.int16)
+        np.testing.assert_array_equal(read_pcm(self.write_wav('a.wav', samples)), samples)
+        raw = os.path.join(self.tmp.name, 'a.pcm')
+        with open(raw, 'wb') as f:
+            f.write(samples.astype('<i2').tobytes())
+        np.testing.assert_array_equal(read_pcm(raw), samples)
+
+    def test_rejects_wrong_rate_and_channels(self):
+        samples = np.zeros(4, dtype=np.int16)
+        with self.assertRaisesRegex(ValueError, 'expected 16000 Hz'):
+            read_pcm(self.write_wav('8k.wav', samples, rate=8000))
+        with self.assertRaisesRegex(ValueError, '16-bit mono'):
+            read_pcm(self.write_wav('stereo.wav', samples, channels=2))
+
+
+class FileSourceTest(unittest.TestCase):
+
+    def test_frames_drop_the_partial_tail(self):
+        samples = np.arange(10, dtype=np.int16)
+        source = FileSource(samples, frame_size=4)
+        frames = asyncio.run(collect(source.frames()))
+        self.assertEqual(len(frames), 2)
+        np.testing.assert_array_equal(frames[1], [4, 5, 6, 7])
+        self.assertEqual(source.stats.frames, 2)
+
+    def test_batches_cover_every_frame_in_order(self):
+        samples = np.arange(4 * 10, dtype=np.int16)
+        source = FileSource(samples, frame_size=4, queue_frames=4)
+        batches = asyncio.run(collect(source.batches(max_frames=3)))
+        self.assertTrue(all(1 <= len(batch) <= 3 for batch in batches))
+        np.testing.assert_array_equal(np.concatenate(batches).ravel(), samples)
+
+    def test_stopping_early_cancels_the_producer(self):
+        source = FileSource(np.zeros(4 * 100, dtype=np.int16), frame_size=4, queue_frames=2)
+
+        async def first_two():
+            frames = []
+            async for frame in source.frames():
+                frames.append(frame)
+                if len(frames) == 2:
+                    break
+            return frames
+
+        self.assertEqual(len(asyncio.run(first_two())), 2)
+        self.assertTrue(source._closed)
+        self.assertLess(source.stats.frames, 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+from amazon_transcribe.model import Alternative, Result, Transcript, TranscriptEvent
+
+import audio_capture
+import duplex
+import endpointing
+import stt
+
+
+def event(text, is_partial):
+    alternative = Alternative(transcript=text, items=[], entities=[])
+    return TranscriptEvent(transcript=Transcript(
+        results=[Result(is_partial=is_partial, alternatives=[alternative])]))
+
+
+class FakeInputStream:
+
+    def __init__(self):
+        self.chunks = 0
+        self.ended = asyncio.Event()
+
+    async def send_audio_event(self, audio_chunk):
+        self.chunks += 1
+
+    async def end_stream(self):
+        self.ended.set()
+
+
+class FakeOutputStream:
+    """
+    Yields `events` at monotonic time `at` unless the input has ended by then,
+    and closes once the input ends.
+    """
+
+    def __init__(self, input_stream, events, at):
+        self.input_stream = input_stream
+        self.events = events
+        self.at = at
+
+    async def __aiter__(self):
+        try:
+            await asyncio.wait_for(self.input_stream.ended.wait(),
+                                   timeout=max(0.0, self.at - time.monotonic()))
+            return
+        except asyncio.TimeoutError:
+            pass
+        for item in self.events:
+            yield item
+        await self.input_stream.ended.wait()
+
+
+class FakeStream:
+
+    def __init__(self, events, at):
+        self.input_stream = FakeInputStream()
+        self.output_stream = FakeOutputStream(self.input_stream, events, at)
+
+
+class FakeTranscribeClient:
+    """The customer's words arrive `delay` seconds after the client is created."""
+
+    def __init__(self, events, delay=0.0):
+        self.events = events
+        self.at = time.monotonic() + delay
+        self.streams = []
+
+    async def start_stream_transcription(self, **kwargs):
+        stream = FakeStream(self.events, self.at)
+        self.streams.append(stream)
+        return stream
+
+
+class TurnHandlerTest(unittest.TestCase):
+
+    def test_stale_result_is_dropped_once(self):
+        endpointer = endpointing.Endpointer(log=None)
+        handler = duplex.TurnHandler(None, endpointer)
+        handler.stale = True
+
+        async def feed():
+            await handler.handle_transcript_event(event("我想", True))
+            await handler.handle_transcript_event(event("我想買。", False))
+            await handler.handle_transcript_event(event("多少錢？", False))
+
+        asyncio.run(feed())
+        self.assertFalse(handler.stale)
+        self.assertEqual(endpointer.final, "多少錢？")
+
+
+class DuplexSessionTest(unittest.TestCase):
+
+    def session(self, seconds, respond):
+        silence = np.zeros(int(stt.SAMPLE_RATE * seconds), dtype=np.int16)
+        source = audio_capture.FileSource(silence, realtime=True, sample_rate=stt.SAMPLE_RATE,
+                                          frame_size=stt.FRAME_SIZE)
+        return duplex.DuplexSession(respond, source=source)
+
+    def test_idle_turns_share_one_stream(self):
+        # A 150 ms no-speech timeout expires several times before the
+        # customer's words arrive; none of them may open another stream
+        client = FakeTranscribeClient([event("你好。", False)], delay=0.6)
+        heard = []
+
+        def respond(text, interrupted):
+            heard.append(text)
+            return ''
+
+        session = self.session(2.0, respond)
+        with mock.patch.object(stt, 'transcribe_client', client), \
+                mock.patch.object(stt, 'SILENT_COUNT', 5):
+            asyncio.run(session.run(turns=1))
+
+        self.assertEqual(heard, ["你好。"])
+        self.assertEqual(len(client.streams), 1)
+        self.assertTrue(client.streams[0].input_stream.ended.is_set())
+
+    def test_barge_in_records_what_was_not_said(self):
+        session = self.session(0.1, lambda text, interrupted: '')
+
+        async def barge_in():
+            session._speaking = asyncio.create_task(asyncio.sleep(10))
+            session._speaking_text = "這款手機現在有優惠。"
+            session._barge_in(time.monotonic() - 0.05)
+            await asyncio.sleep(0)
+
+        asyncio.run(barge_in())
+        self.assertTrue(session._stop_speaking.is_set())
+        self.assertIsNone(session._speaking)
+        self.assertEqual(session.interrupted, {'said': '', 'unsaid': "這款手機現在有優惠。"})
+        self.assertEqual(session.stats.count, 1)
+        self.assertGreaterEqual(session.stats.reaction_ms[0], 50)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import json
+import os
+import tempfile
+import unittest
+
+from endpointing import MAX_SILENCE_MS, THRESHOLDS, Endpointer, SessionRecorder
+
+
+def silence(ms, frame_ms=30):
+    return [False] * (ms // frame_ms)
+
+
+class EndpointerTest(unittest.TestCase):
+
+    def endpointer(self, **kwargs):
+        kwargs.setdefault('log', None)
+        e = Endpointer(**kwargs)
+        self.assertIsNone(e.on_frames([True] * 10))
+        return e
+
+    def wait_for(self, e, cue):
+        """Silence until the decision; asserts it lands on the first frame past the threshold."""
+        threshold = e.threshold(cue)
+        frames = -(-threshold // e.frame_ms)
+        self.assertIsNone(e.on_frames([False] * (frames - 1)))
+        decision = e.on_frames([False])
+        self.assertIsNotNone(decision)
+        self.assertEqual(decision.reason, cue)
+        self.assertEqual(decision.silence_ms, frames * e.frame_ms)
+        return decision
+
+    def test_punctuated_final_ends_fastest(self):
+        e = self.endpointer(aggressiveness=1)
+        e.on_transcript('我想查訂單。', is_partial=False)
+        decision = self.wait_for(e, 'final_punctuated')
+        self.assertEqual(e.threshold('final_punctuated'), THRESHOLDS['final_punctuated'][1])
+        self.assertLess(decision.silence_ms, e.threshold('final'))
+        self.assertEqual(decision.transcript, '我想查訂單。')
+
+    def test_closing_particle_counts_as_punctuated(self):
+        e = self.endpointer()
+        e.on_transcript('可以退貨嗎', is_partial=False)
+        self.wait_for(e, 'final_punctuated')
+
+    def test_unpunctuated_final(self):
+        e = self.endpointer()
+        e.on_transcript('我想查', is_partial=False)
+        self.wait_for(e, 'final')
+
+    def test_stable_partial_needs_repeats(self):
+        e = self.endpointer(stable_partials=3)
+        for _ in range(2):
+            e.on_transcript('我想', is_partial=True)
+        self.assertEqual(e._cue(), 'speech')
+        e.on_transcript('我想', is_partial=True)
+        decision = self.wait_for(e, 'stable_partial')
+        self.assertEqual(decision.transcript, '我想')
+
+    def test_new_partial_after_final_reverts_to_speech(self):
+        e = self.endpointer()
+        e.on_transcript('好。', is_partial=False)
+        e.on_transcript('還有', is_partial=True)
+        self.assertEqual(e._cue(), 'speech')
+        decision = self.wait_for(e, 'speech')
+        self.assertEqual(decision.transcript, '好。還有')
+
+    def test_finals_accumulate(self):
+        e = self.endpointer()
+        e.on_transcript('我想查', is_partial=False)
+        e.on_transcript('訂單', is_partial=False)
+        e.on_transcript('  ', is_partial=False)
+        self.assertEqual(e.final, '我想查訂單')
+
+    def test_speech_falls_back_to_max_silence(self):
+        e = self.endpointer(aggressiveness=0)
+        self.assertEqual(e.threshold('speech'), MAX_SILENCE_MS)
+        self.wait_for(e, 'speech')
+
+    def test_max_silence_caps_thresholds(self):
+        e = Endpointer(aggressiveness=0, max_silence_ms=500, log=None)
+        self.assertEqual(e.threshold('final'), 500)
+        self.assertEqual(e.threshold('final_punctuated'), 500)
+
+    def test_aggressiveness_is_clamped(self):
+        self.assertEqual(Endpointer(aggressiveness=9, log=None).level, 3)
+        self.assertEqual(Endpointer(aggressiveness=-1, log=None).level, 0)
+
+    def test_idle_line_decides_no_speech(self):
+        e = Endpointer(log=None)
+        self.assertIsNone(e.on_frames(silence(MAX_SILENCE_MS)))
+        decision = e.on_frames([False])
+        self.assertEqual(decision.reason, 'no_speech')
+        self.assertEqual(decision.transcript, '')
+
+    def test_decision_sticks_until_reset(self):
+        logged = []
+        e = self.endpointer(log=logged.append)
+        e.on_transcript('好。', is_partial=False)
+        decision = e.on_frames(silence(2000))
+        self.assertIs(e.on_frames([True]), decision)
+        self.assertIs(e.on_transcript('再見', is_partial=True), decision)
+        self.assertEqual(len(logged), 1)
+        e.reset()
+        self.assertIsNone(e.decision)
+        self.assertEqual((e.now_ms, e.final, e.heard_speech), (0, '', False))
+
+    def test_voice_resets_silence(self):
+        e = self.endpointer()
+        e.on_transcript('好。', is_partial=False)
+        e.on_frames(silence(300))
+        e.on_frames([True])
+        self.assertEqual(e.silence_ms, 0)
+        self.assertIsNone(e.on_frames(silence(300)))
+
+
+class SessionRecorderTest(unittest.TestCase):
+
+    def test_writes_timed_json_lines(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'session.jsonl')
+            recorder = SessionRecorder(path, frame_ms=20)
+            recorder.frames([True, False])
+            recorder.transcript('你好', is_partial=1)
+            recorder.close()
+            with open(path, encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        self.assertIn('你好', lines[2])
+        self.assertEqual([json.loads(line) for line in lines], [
+            {"t": 20, "type": "vad", "speech": True},
+            {"t": 40, "type": "vad", "speech": False},
+            {"t": 40, "type": "transcript", "text": "你好", "partial": True},
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+import asyncio
+import contextlib
+import io
+import unittest
+
+from speculation import Speculator, normalize, similar
+
+
+class RecordingFlow:
+    """Async downstream call that records its inputs and can be held open."""
+
+    def __init__(self):
+        self.calls = []
+        self.cancelled = []
+        self.release = asyncio.Event()
+
+    async def invoke(self, text):
+        self.calls.append(text)
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled.append(text)
+            raise
+        return f"answer:{text}"
+
+
+def run(coro):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return asyncio.run(coro)
+
+
+async def settle():
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+class NormalizeTest(unittest.TestCase):
+
+    def test_ignores_punctuation_and_spaces(self):
+        self.assertEqual(normalize('我想 查，訂單。'), '我想查訂單')
+        self.assertTrue(similar('我想查訂單', '我想查訂單？'))
+
+    def test_tolerance(self):
+        self.assertTrue(similar('abcdefghij', 'abcdefghik', tolerance=0.1))
+        self.assertFalse(similar('我想查訂單', '我想退貨', tolerance=0.1))
+
+
+class SpeculatorTest(unittest.TestCase):
+
+    def test_no_speculation_before_stable(self):
+        async def scenario():
+            flow = RecordingFlow()
+            s = Speculator(flow.invoke, stable_events=3)
+            s.on_partial('我想')
+            s.on_partial('我想查')
+            s.on_partial('我想查')
+            await settle()
+            self.assertEqual(flow.calls, [])
+            flow.release.set()
+            self.assertEqual(await s.on_final('我想查'), 'answer:我想查')
+            return s
+
+        s = run(scenario())
+        self.assertEqual((s.stats.started, s.stats.hits, s.stats.finals), (0, 0, 1))
+
+    def test_stable_partial_is_committed_on_matching_final(self):
+        async def scenario():
+            flow = RecordingFlow()
+            s = Speculator(flow.invoke, stable_events=3)
+            for _ in range(5):
+                s.on_partial('我想查訂單')
+            await settle()
+            # Repeats past the threshold do not start a second call
+            self.assertEqual(flow.calls, ['我想查訂單'])
+            flow.release.set()
+            result = await s.on_final('我想查訂單。')
+            self.assertEqual(flow.calls, ['我想查訂單'])
+            return s, result
+
+        s, result = run(scenario())
+        self.assertEqual(result, 'answer:我想查訂單')
+        self.assertEqual((s.stats.started, s.stats.hits, s.stats.misses), (1, 1, 0))
+        self.assertGreaterEqual(s.stats.latency_saved_ms, 0.0)
+
+    def test_stale_speculation_is_cancelled_when_user_keeps_talking(self):
+        async def scenario():
+            flow = RecordingFlow()
+            s = Speculator(flow.invoke, stable_events=2)
+            s.on_partial('我想')
+            s.on_partial('我想')
+            await settle()
+            s.on_partial('我想查訂單')
+            s.on_partial('我想查訂單')
+            await settle()
+            flow.release.set()
+            return flow, s, await s.on_final('我想查訂單')
+
+        flow, s, result = run(scenario())
+        self.assertEqual(flow.cancelled, ['我想'])
+        self.assertEqual(flow.calls, ['我想', '我想查訂單'])
+        self.assertEqual(result, 'answer:我想查訂單')
+        self.assertEqual((s.stats.started, s.stats.cancelled, s.stats.hits), (2, 1, 1))
+
+    def test_mismatched_final_reissues_the_call(self):
+        async def scenario():
+            flow = RecordingFlow()
+            s = Speculator(flow.invoke, stable_events=2)
+            s.on_partial('我想查訂單')
+            s.on_partial('我想查訂單')
+            await settle()
+            flow.release.set()
+            return flow, s, await s.on_final('我想退貨')
+
+        flow, s, result = run(scenario())
+        self.assertEqual(result, 'answer:我想退貨')
+        self.assertEqual(flow.calls, ['我想查訂單', '我想退貨'])
+        self.assertEqual((s.stats.misses, s.stats.cancelled, s.stats.hits), (1, 1, 0))
+
+    def test_blocking_invoke_runs_in_a_thread(self):
+        calls = []
+
+        def invoke(text):
+            calls.append(text)
+            return text.upper()
+
+        async def scenario():
+            s = Speculator(invoke, stable_events=1)
+            s.on_partial('hello')
+            return await s.on_final('hello.')
+
+        self.assertEqual(run(scenario()), 'HELLO')
+        self.assertEqual(calls, ['hello'])
+
+    def test_state_resets_after_final(self):
+        async def scenario():
+            flow = RecordingFlow()
+            flow.release.set()
+            s = Speculator(flow.invoke, stable_events=2)
+            s.on_partial('好')
+            await s.on_final('好')
+            # One repeat after the final is a fresh count, not the third event
+            s.on_partial('好')
+            await settle()
+            return flow, s
+
+        flow, s = run(scenario())
+        self.assertEqual(flow.calls, ['好'])
+        self.assertEqual(s.stats.as_dict()['hit_rate'], 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
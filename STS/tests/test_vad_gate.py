@@ -0,0 +1,98 @@
+import unittest
+
+import numpy as np
+
+from vad_gate import VadGate
+
+FRAME = 480
+
+
+class AlwaysSpeech:
+    """Stands in for webrtcvad: every frame above the energy floor is speech."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def is_speech(self, frame, sample_rate):
+        self.calls += 1
+        assert len(frame) == FRAME * 2
+        return True
+
+
+def frames(pattern):
+    """'S' is a loud frame, '.' a silent one; each frame holds its index."""
+    batch = np.zeros((len(pattern), FRAME), dtype=np.int16)
+    for i, kind in enumerate(pattern):
+        if kind == 'S':
+            batch[i] = 1000 + i
+        else:
+            batch[i, 0] = i  # tag silent frames too, well below the floor
+    return batch
+
+
+def tags(out):
+    return [int(frame[0]) - (1000 if frame[0] >= 1000 else 0) for frame in out]
+
+
+def gate(**kwargs):
+    result = VadGate(**kwargs)
+    result.vad = AlwaysSpeech()
+    return result
+
+
+class VadGateTest(unittest.TestCase):
+
+    def test_silence_never_reaches_webrtcvad(self):
+        g = gate()
+        self.assertEqual(g.process_batch(frames('.' * 20)), [])
+        self.assertEqual(g.vad.calls, 0)
+        self.assertEqual(g.stats.bytes_sent, 0)
+        self.assertEqual(g.silence_frames, 20)
+
+    def test_onset_flushes_pre_roll(self):
+        g = gate(pre_roll_frames=4, onset_window=5, onset_frames=3)
+        out = g.process_batch(frames('......SSS'))
+        # Pre-roll keeps the last 4 frames before the onset frame
+        self.assertEqual(tags(out), [4, 5, 6, 7, 8])
+        self.assertTrue(g.in_speech)
+        self.assertEqual(g.stats.segments, 1)
+
+    def test_onset_needs_enough_votes(self):
+        g = gate(onset_window=5, onset_frames=3)
+        self.assertEqual(g.process_batch(frames('S..S..S..S')), [])
+        self.assertFalse(g.in_speech)
+
+    def test_hangover_bridges_short_dips_then_ends(self):
+        g = gate(pre_roll_frames=0, hangover_frames=2, onset_frames=1)
+        out = g.process_batch(frames('S..S...S'))
+        # Two-frame dip is streamed, the third silent frame ends the segment
+        self.assertEqual(tags(out), [0, 1, 2, 3, 4, 5, 7])
+        self.assertEqual(g.stats.segments, 2)
+
+    def test_position_and_onset_position(self):
+        g = gate(onset_window=5, onset_frames=3)
+        g.process_batch(frames('....'))
+        g.process_batch(frames('S.SS'))
+        self.assertEqual(g.position, 8)
+        # The onset is dated to the first voiced frame in the vote window
+        self.assertEqual(g.onset_position, 4)
+
+    def test_suppressed_frames_count_as_unvoiced(self):
+        g = gate(pre_roll_frames=3, onset_frames=1)
+        batch = frames('SSS')
+        out = g.process_batch(batch, suppress=[True, True, False])
+        self.assertEqual(g.last_voiced.tolist(), [False, False, True])
+        # Suppressed frames are still buffered as pre-roll
+        self.assertEqual(tags(out), [0, 1, 2])
+        self.assertEqual(g.onset_position, 2)
+
+    def test_single_frame_input(self):
+        g = gate(onset_frames=1)
+        out = g.process_batch(frames('S')[0])
+        self.assertEqual(len(out), 1)
+        self.assertEqual(g.stats.frames, 1)
+        self.assertEqual(g.stats.bytes_captured, FRAME * 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
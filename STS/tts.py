@@ -1,5 +1,4 @@
 import boto3
-import sounddevice as sd
 import numpy as np
 import io
 import wave
@@ -10,26 +9,43 @@ TEXT = "你好，欢迎使用语音合成服务。"
 VOICE_ID = 'Zhiyu'  # Mandarin Chinese female voice
 OUTPUT_FORMAT = 'pcm'  # raw audio format
 SAMPLE_RATE = 16000  # 16kHz
+READ_CHUNK = 3200  # 100 ms of audio per read, so a stop is noticed quickly
 
 # ---- INIT CLIENT ----
 polly = boto3.client('polly', region_name=REGION)
 
-# ---- CALL POLLY ----
-response = polly.synthesize_speech(
-    Text=TEXT,
-    OutputFormat=OUTPUT_FORMAT,
-    VoiceId=VOICE_ID,
-    SampleRate=str(SAMPLE_RATE)
-)
 
-# ---- READ AUDIO ----
-audio_stream = response['AudioStream'].read()
+def synthesize(text, stop=None):
+    """PCM of `text`, or None when `stop` (a threading.Event) is set mid-read."""
+    # ---- CALL POLLY ----
+    response = polly.synthesize_speech(
+        Text=text,
+        OutputFormat=OUTPUT_FORMAT,
+        VoiceId=VOICE_ID,
+        SampleRate=str(SAMPLE_RATE)
+    )
 
-# Convert raw bytes into numpy array
-audio_data = np.frombuffer(audio_stream, dtype=np.int16)
+    # ---- READ AUDIO ----
+    audio_stream = response['AudioStream']
+    parts = []
+    for chunk in audio_stream.iter_chunks(READ_CHUNK):
+        if stop is not None and stop.is_set():
+            audio_stream.close()
+            return None
+        parts.append(chunk)
 
-# ---- PLAY AUDIO ----
-sd.play(audio_data, samplerate=SAMPLE_RATE)
-sd.wait()  # wait until playback is finished
+    # Convert raw bytes into numpy array
+    return np.frombuffer(b''.join(parts), dtype=np.int16)
 
-print("✅ Playback finished!")
+
+def play(audio_data):
+    import sounddevice as sd
+
+    # ---- PLAY AUDIO ----
+    sd.play(audio_data, samplerate=SAMPLE_RATE)
+    sd.wait()  # wait until playback is finished
+
+
+if __name__ == "__main__":
+    play(synthesize(TEXT))
+    print("✅ Playback finished!")
@@ -0,0 +1,137 @@
+import time
+from collections import deque
+
+import numpy as np
+import webrtcvad
+
+SAMPLE_RATE = 16000
+VAD_MODE = 0
+PRE_ROLL_FRAMES = 10  # 300 ms of audio sent ahead of the detected onset
+HANGOVER_FRAMES = 8  # keep streaming through 240 ms dips inside a word
+ONSET_WINDOW = 5
+ONSET_FRAMES = 3  # speech frames out of the last ONSET_WINDOW to enter speech
+# Frames quieter than this RMS are silence without asking webrtcvad.
+ENERGY_FLOOR = 120.0
+
+
+class GateStats:
+    __slots__ = ('frames', 'speech_frames', 'vad_calls', 'bytes_captured',
+                 'bytes_sent', 'segments', 'cpu_seconds')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def as_dict(self, sample_rate=SAMPLE_RATE):
+        result = {name: getattr(self, name) for name in self.__slots__}
+        audio_seconds = self.bytes_captured / 2 / sample_rate
+        result['sent_ratio'] = self.bytes_sent / self.bytes_captured if self.bytes_captured else 0.0
+        result['cpu_ms_per_audio_second'] = (self.cpu_seconds * 1000 / audio_seconds
+                                             if audio_seconds else 0.0)
+        return result
+
+
+class VadGate:
+    """
+    Speech gate in front of Transcribe.
+
+    A smoothed state machine decides whether the user is speaking: speech starts
+    once ONSET_FRAMES of the last ONSET_WINDOW frames are voiced and ends after
+    HANGOVER_FRAMES unvoiced frames in a row. On onset the pre-roll buffer is
+    flushed so the start of the first word is not clipped.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, mode=VAD_MODE,
+                 pre_roll_frames=PRE_ROLL_FRAMES, hangover_frames=HANGOVER_FRAMES,
+                 onset_window=ONSET_WINDOW, onset_frames=ONSET_FRAMES,
+                 energy_floor=ENERGY_FLOOR):
+        self.sample_rate = sample_rate
+        self.vad = webrtcvad.Vad(mode)
+        self.hangover_frames = hangover_frames
+        self.onset_frames = onset_frames
+        self.energy_floor = energy_floor
+        self.pre_roll = deque(maxlen=pre_roll_frames)
+        self.votes = deque(maxlen=onset_window)
+        self.in_speech = False
+        self.hangover = 0
+        # Consecutive unvoiced frames, used by the caller for endpointing
+        self.silence_frames = 0
+        self.last_voiced = np.zeros(0, dtype=bool)
+        # Frames processed so far, and the index of the first voiced frame of
+        # the last onset, so callers can date when speech really started
+        self.position = 0
+        self.onset_position = 0
+        self.stats = GateStats()
+
+    def classify(self, batch: np.ndarray) -> np.ndarray:
+        """
+        Voice decisions for a (n_frames, frame_size) int16 batch. The energy
+        check is vectorized; webrtcvad only sees frames above the floor.
+        """
+        started = time.process_time()
+        rms = np.sqrt(np.mean(np.square(batch, dtype=np.float32), axis=1))
+        voiced = rms >= self.energy_floor
+        if voiced.any():
+            raw = np.ascontiguousarray(batch).tobytes()
+            view = memoryview(raw)
+            frame_bytes = batch.shape[1] * 2
+            for i in np.flatnonzero(voiced):
+                voiced[i] = self.vad.is_speech(view[i * frame_bytes:(i + 1) * frame_bytes],
+                                               self.sample_rate)
+                self.stats.vad_calls += 1
+        self.stats.cpu_seconds += time.process_time() - started
+        return voiced
+
+    def process_batch(self, batch: np.ndarray, suppress=None):
+        """
+        Runs the state machine over a batch of frames and returns the frames that
+        should be streamed, in order. Frames flagged in the boolean `suppress`
+        mask count as unvoiced (e.g. speaker echo) but are still buffered.
+        """
+        batch = np.asarray(batch)
+        if batch.ndim == 1:
+            batch = batch.reshape(1, -1)
+        out = []
+        # Per-frame decisions of the last batch, for endpointing
+        self.last_voiced = self.classify(batch)
+        if suppress is not None:
+            self.last_voiced &= ~np.asarray(suppress, dtype=bool)
+        for frame, voiced in zip(batch, self.last_voiced):
+            self._step(frame, bool(voiced), out)
+        frame_bytes = batch.shape[1] * 2
+        self.stats.frames += len(batch)
+        self.stats.bytes_captured += len(batch) * frame_bytes
+        self.stats.bytes_sent += len(out) * frame_bytes
+        return out
+
+    def _step(self, frame, voiced, out):
+        self.votes.append(voiced)
+        self.silence_frames = 0 if voiced else self.silence_frames + 1
+        if voiced:
+            self.stats.speech_frames += 1
+
+        self.position += 1
+        if not self.in_speech:
+            if sum(self.votes) >= self.onset_frames:
+                self.in_speech = True
+                first = next(i for i, vote in enumerate(self.votes) if vote)
+                self.onset_position = self.position - (len(self.votes) - first)
+                self.hangover = self.hangover_frames
+                self.stats.segments += 1
+                out.extend(self.pre_roll)
+                self.pre_roll.clear()
+                out.append(frame)
+            else:
+                self.pre_roll.append(frame)
+            return
+
+        if voiced:
+            self.hangover = self.hangover_frames
+            out.append(frame)
+        elif self.hangover > 0:
+            self.hangover -= 1
+            out.append(frame)
+        else:
+            self.in_speech = False
+            self.votes.clear()
+            self.pre_roll.append(frame)
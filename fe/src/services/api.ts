@@ -31,6 +31,42 @@ export interface MessagesResponse {
   stage:number
 }
 
+/**
+ * 列表 API 的分頁回應：資料超過上限時，API 改回傳這個格式
+ */
+interface ListPage<T> {
+  items: T[]
+  nextCursor: string | null
+  truncated?: boolean
+}
+
+/**
+ * 讀取完整列表，超過上限時依 nextCursor 讀取其餘分頁
+ * @param url 列表 API 路徑
+ * @returns Promise 包含所有資料的陣列
+ */
+const fetchList = async <T>(url: string): Promise<T[]> => {
+  const items: T[] = []
+  let next: string | null = url
+  while (next) {
+    const response = await fetch(next)
+
+    if (!response.ok) {
+      throw new Error(`API 請求失敗: ${response.status}`)
+    }
+
+    const data: T[] | ListPage<T> = await response.json()
+    if (Array.isArray(data)) {
+      return data
+    }
+    items.push(...data.items)
+    next = data.nextCursor
+      ? `${url}?limit=500&cursor=${encodeURIComponent(data.nextCursor)}`
+      : null
+  }
+  return items
+}
+
 export const createNewConversation = async (): Promise<MessageResponse> => {
   try {
     const response = await fetch(
@@ -93,16 +129,9 @@ export const getConversationList = async (): Promise<
   ConversationResponse[]
 > => {
   try {
-    const response = await fetch(
+    return await fetchList<ConversationResponse>(
       `${import.meta.env.VITE_API_PATH}/conversations`
     )
-
-    if (!response.ok) {
-      throw new Error(`API 請求失敗: ${response.status}`)
-    }
-
-    const data = await response.json()
-    return data
   } catch (error) {
     throw error
   }
@@ -117,16 +146,9 @@ export const getMessageList = async (
   conversationId: number
 ): Promise<MessageResponse[]> => {
   try {
-    const response = await fetch(
+    return await fetchList<MessageResponse>(
       `${import.meta.env.VITE_API_PATH}/messages/${conversationId}`
     )
-
-    if (!response.ok) {
-      throw new Error(`API 請求失敗: ${response.status}`)
-    }
-
-    const data = await response.json()
-    return data
   } catch (error) {
     throw error
   }
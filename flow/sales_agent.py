@@ -1,8 +1,12 @@
-import boto3    
+import os
 import uuid
 import sys
 import json
 
+# The Bedrock flow client shared with the message handler
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+import flow_client  # noqa: E402
+
 # --- Configuration ---
 # Replace with your specific details
 AWS_REGION = "us-west-2"  # e.g., 'us-east-1', 'us-west-2', etc.
@@ -10,84 +14,45 @@ AGENT_ID = "H4I1KUGNCW"  # Replace with your Agent's ID
 AGENT_ALIAS_ID = "XJ83BFUVST" # Replace with your Agent's Alias ID (often TSTALIASID for draft)
 # --- End Configuration ---
 
-# Initialize the Bedrock Agent Runtime client
-try:
-    bedrock_agent_runtime_client = boto3.client(
-        'bedrock-agent-runtime',
-        region_name=AWS_REGION
-    )
-except Exception as e:
-    print(f"Error initializing Bedrock Agent Runtime client: {e}")
-    sys.exit(1)
-
-# Generate a unique session ID for the conversation
+# Deadline, retries and the concurrency cap come from the FLOW_* variables
+# of flow_client; FLOW_ENDPOINT_URL points it at flow_fake_server.py
+client = flow_client.FlowClient()
+
+# Generate a unique session ID for the conversation; one per run, see
+# lambda/sessions.py for many concurrent conversations in one process
 session_id = str(uuid.uuid4())
 
+def print_event(event):
+    if event.kind == flow_client.CHUNK:
+        print(event.text, end="")  # Print chunks as they arrive
+    elif event.kind == flow_client.OUTPUT:
+        document = event.document
+        if not isinstance(document, str):
+            document = json.dumps(document, ensure_ascii=False)
+        print(f"[{event.node_name}] {document}")
+    elif event.kind == flow_client.UNKNOWN:
+        print(f"\nWarning: Received unknown event type: {event.raw}")
+
 def invoke_rag_flow(prompt: str, current_session_id: str):
     """
-    Invokes the Bedrock Agent (RAG flow) with the given prompt.
+    Invokes the Bedrock flow with the given prompt.
 
     Args:
         prompt: The user's input/question for the RAG flow.
         current_session_id: The unique ID for the current session.
 
     Returns:
-        The generated response text from the agent, or None if an error occurs.
+        The generated response text from the flow, or None if an error occurs.
     """
     try:
         print(f"\nInvoking Agent (Session: {current_session_id})...")
-        # Invoke the agent
-        response = bedrock_agent_runtime_client.invoke_flow(
-            flowIdentifier=AGENT_ID,
-            flowAliasIdentifier=AGENT_ALIAS_ID,
-            inputs=[
-                {
-                    'content': {
-                        'document': prompt
-                    },
-                    "nodeName": "FlowInputNode",
-                    "nodeOutputName": "document"
-                },
-            ],
-            enableTrace=False # Set to True to get detailed trace information (optional)
-        )
-
-        # Handle the streaming response
-        completion = ""
-        response_stream = response.get('responseStream')
-
-        if not response_stream:
-            print("Error: No completion stream found in the response.")
-            return None
-
         print("Agent Response:")
-        for event in response_stream:
-            if 'chunk' in event:
-                data = event['chunk']['bytes']
-                chunk_text = data.decode('utf-8')
-                print(chunk_text, end="") # Print chunks as they arrive
-                completion += chunk_text
-            elif 'trace' in event:
-                 # You can process trace information here if enableTrace=True
-                 # print(json.dumps(event['trace'], indent=2))
-                 pass
-            elif 'attribution' in event:
-                 # You can process citation/attribution information here if available
-                 # print("\n\n-----Attribution-----")
-                 # print(json.dumps(event['attribution'], indent=2))
-                 pass
-            else:
-                print(f"\nWarning: Received unknown event type: {event}")
-
-
+        result = client.invoke(AGENT_ID, AGENT_ALIAS_ID, prompt, on_event=print_event)
         print("\n--- End of Agent Response ---")
-        return completion # Return the full concatenated response
+        return result.text  # Return the full concatenated response
 
-    except boto3.exceptions.Boto3Error as e:
-        print(f"AWS API Error: {e}")
-        return None
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
+    except flow_client.FlowError as e:
+        print(f"Flow Error: {e}")
         return None
 
 # --- Main Execution ---
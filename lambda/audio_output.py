@@ -0,0 +1,164 @@
+"""
+Audio output formats for the synthesized answers.
+
+AUDIO_FORMAT selects what is uploaded for the frontend. `mp3` and `ogg_vorbis`
+are encoded by Polly and streamed straight to S3. `wav` keeps the original
+uncompressed 16-bit PCM with a RIFF header, which is about 32 KB per second of
+speech at 16 kHz. With AUDIO_SEGMENTED=1 an answer is uploaded sentence by
+sentence as independently playable files, and a small JSON playlist lists them
+in order, so playback can start once the first sentence is uploaded.
+
+A turn that carries a `turnId` also gets a live playlist at a URL the client
+can work out before sending the turn (`live_playlist_key`). It is rewritten as
+each segment becomes ready and marked complete at the end of the turn, so a
+client that polls it starts playing while the answer is still being
+generated, long before the handler returns.
+"""
+import hashlib
+import io
+import json
+import os
+import re
+import struct
+
+AUDIO_FORMAT = os.environ.get('AUDIO_FORMAT', 'mp3')
+AUDIO_SEGMENTED = os.environ.get('AUDIO_SEGMENTED', '0') != '0'
+PLAYLIST_PREFIX = os.environ.get('AUDIO_PLAYLIST_PREFIX', 'playlists/')
+# Client-chosen turn ids become part of an S3 key
+TURN_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# name -> (Polly OutputFormat, file extension, Content-Type)
+FORMATS = {
+    'wav': ('pcm', 'wav', 'audio/wav'),
+    'mp3': ('mp3', 'mp3', 'audio/mpeg'),
+    'ogg_vorbis': ('ogg_vorbis', 'ogg', 'audio/ogg'),
+}
+
+if AUDIO_FORMAT not in FORMATS:
+    raise ValueError(f"AUDIO_FORMAT must be one of {sorted(FORMATS)}, not {AUDIO_FORMAT!r}")
+
+POLLY_FORMAT, EXTENSION, CONTENT_TYPE = FORMATS[AUDIO_FORMAT]
+# Whether the audio of several synthesis requests can be joined into one file.
+# Back-to-back Ogg streams make a chained Ogg file, which browsers' <audio>
+# stops playing after the first link, so Ogg answers take a single request.
+CONCATENABLE = POLLY_FORMAT in ('mp3', 'pcm')
+
+
+def wav_header(data_bytes: int, sample_rate: int, channels: int = 1,
+               sample_width: int = 2) -> bytes:
+    """The 44-byte RIFF/WAVE header of `data_bytes` bytes of PCM."""
+    block_align = channels * sample_width
+    return struct.pack('<4sI4s4sIHHIIHH4sI',
+                       b'RIFF', 36 + data_bytes, b'WAVE',
+                       b'fmt ', 16, 1, channels, sample_rate, sample_rate * block_align,
+                       block_align, sample_width * 8,
+                       b'data', data_bytes)
+
+
+class ChainedReader(io.RawIOBase):
+    """Reads several buffers back to back without joining them into one."""
+
+    def __init__(self, *buffers):
+        self._buffers = [memoryview(buffer) for buffer in buffers]
+        self._index = 0
+        self._offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        written = 0
+        size = len(target)
+        while written < size and self._index < len(self._buffers):
+            buffer = self._buffers[self._index]
+            n = min(size - written, len(buffer) - self._offset)
+            target[written:written + n] = buffer[self._offset:self._offset + n]
+            written += n
+            self._offset += n
+            if self._offset == len(buffer):
+                self._index += 1
+                self._offset = 0
+        return written
+
+
+def upload_body(parts, sample_rate: int, channels: int = 1):
+    """
+    File object to upload for the audio of consecutive synthesis requests,
+    given as Polly AudioStreams or bytes in order. A single compressed stream
+    is passed through as it is. Otherwise the parts are read back to back
+    without being joined: MP3 frames play as one file, and PCM gets a single
+    WAV header for the total length. Ogg cannot be joined (see CONCATENABLE).
+    """
+    if POLLY_FORMAT != 'pcm' and len(parts) == 1 and hasattr(parts[0], 'read'):
+        return parts[0]
+    if not CONCATENABLE:
+        raise ValueError(f"{AUDIO_FORMAT} audio of {len(parts)} requests cannot be one file")
+    buffers = [part.read() if hasattr(part, 'read') else part for part in parts]
+    if POLLY_FORMAT == 'pcm':
+        buffers.insert(0, wav_header(sum(map(len, buffers)), sample_rate, channels))
+    return io.BufferedReader(ChainedReader(*buffers))
+
+
+def playlist_key(segment_keys) -> str:
+    digest = hashlib.sha256('\n'.join(segment_keys).encode('utf-8')).hexdigest()
+    return f"{PLAYLIST_PREFIX}{digest}.json"
+
+
+def playlist(urls, texts, complete=None, failed=False) -> bytes:
+    document = {
+        'format': AUDIO_FORMAT,
+        'contentType': CONTENT_TYPE,
+        'segments': [{'url': url, 'text': text} for url, text in zip(urls, texts)],
+    }
+    if complete is not None:
+        document['complete'] = complete
+    if failed:
+        document['failed'] = True
+    return json.dumps(document, ensure_ascii=False).encode('utf-8')
+
+
+def upload_playlist(s3, bucket: str, cdn_url: str, urls, texts) -> str:
+    """Uploads the playlist of the segment URLs and returns its URL."""
+    key = playlist_key([url.rsplit('/', 1)[-1] for url in urls])
+    s3.put_object(Bucket=bucket, Key=key, Body=playlist(urls, texts),
+                  ContentType='application/json')
+    return f"{cdn_url}/{key}"
+
+
+def live_playlist_key(conversation_id, turn_id: str) -> str:
+    if not TURN_ID.match(str(turn_id)):
+        raise ValueError(f"turnId must match {TURN_ID.pattern}, not {turn_id!r}")
+    return f"{PLAYLIST_PREFIX}live/{int(conversation_id)}/{turn_id}.json"
+
+
+class LivePlaylist:
+    """
+    Playlist of one turn that is uploaded again every time a segment is added.
+
+    `add` is meant as the `on_segment` callback of a SentenceSynthesizer, which
+    calls it in order. Nothing is uploaded before the first segment, so a poll
+    gets a 404 until then. The object is sent with `no-cache` so CloudFront and
+    the browser revalidate each poll. `close()` marks the playlist complete;
+    with `failed=True` it tells the client that no more segments will come.
+    """
+
+    def __init__(self, s3, bucket: str, cdn_url: str, conversation_id, turn_id: str):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = live_playlist_key(conversation_id, turn_id)
+        self.url = f"{cdn_url}/{self.key}"
+        self.urls = []
+        self.texts = []
+
+    def _upload(self, complete, failed=False):
+        self.s3.put_object(Bucket=self.bucket, Key=self.key,
+                           Body=playlist(self.urls, self.texts, complete, failed),
+                           ContentType='application/json', CacheControl='no-cache')
+
+    def add(self, index: int, text: str, url: str):
+        self.urls.append(url)
+        self.texts.append(text)
+        self._upload(complete=False)
+
+    def close(self, failed=False):
+        self._upload(complete=True, failed=failed)
@@ -0,0 +1,67 @@
+"""
+boto3 clients created on first use and shared for the life of the container.
+
+Creating a client loads its service model and endpoint rules, tens of
+milliseconds each. A handler that creates all its clients at import time pays
+that on every cold start, even for turns that never call those services.
+`lazy(service)` returns a stand-in that creates the real client the first time
+one of its methods is used.
+"""
+import os
+import threading
+
+AWS_REGION = os.environ.get('AWS_REGION', 'us-west-2')
+
+_clients = {}
+# boto3's default session is not thread-safe while it creates clients
+_lock = threading.Lock()
+
+
+def client(service: str, region_name: str = AWS_REGION, endpoint_url: str = None, **config):
+    """
+    The shared client of `service`. Keyword arguments other than endpoint_url
+    are botocore Config options; each distinct set gets its own client.
+    """
+    key = (service, region_name, endpoint_url, repr(sorted(config.items())))
+    found = _clients.get(key)
+    if found is None:
+        with _lock:
+            found = _clients.get(key)
+            if found is None:
+                import boto3
+                from botocore.config import Config
+
+                found = _clients[key] = boto3.client(
+                    service, region_name=region_name, endpoint_url=endpoint_url,
+                    config=Config(**config) if config else None)
+    return found
+
+
+class LazyClient:
+    __slots__ = ('service', 'region_name', 'endpoint_url', 'config')
+
+    def __init__(self, service: str, region_name: str = AWS_REGION, endpoint_url: str = None,
+                 **config):
+        self.service = service
+        self.region_name = region_name
+        self.endpoint_url = endpoint_url
+        self.config = config
+
+    def resolve(self):
+        return client(self.service, self.region_name, self.endpoint_url, **self.config)
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __repr__(self):
+        return f"LazyClient({self.service!r}, {self.region_name!r})"
+
+
+def lazy(service: str, region_name: str = AWS_REGION, endpoint_url: str = None,
+         **config) -> LazyClient:
+    return LazyClient(service, region_name, endpoint_url, **config)
+
+
+def created():
+    """Services whose client exists, e.g. for cold-start reports."""
+    return sorted(key[0] for key in _clients)
@@ -0,0 +1,141 @@
+"""
+Bytes per answer and time to the first playable audio for the output modes
+of audio_output.py: one WAV per answer (the original output), one compressed
+file per answer, compressed sentence segments with a playlist in the
+response, and the same segments on a live playlist that the client polls
+during the turn. Polly and S3 are the fakes of replay_fakes.py.
+
+The server time runs until the handler could return, i.e. after every segment
+and the playlist are uploaded. Without a live playlist the client learns no
+URL before that, so playback starts after the server time plus the download
+of the first file over a `--link-mbps` connection. With a live playlist it
+starts once the first segment is listed, half a `--poll-ms` interval later on
+average, plus that download. The answer is generated two characters per
+`--token-ms`, as in a streamed model call, before and while it is synthesized.
+
+Usage:
+    python bench_audio_output.py [--scale 1.0] [--link-mbps 4] [--poll-ms 250] [--token-ms 25]
+"""
+import argparse
+import time
+
+import numpy as np
+
+import audio_output
+import message_creation_handler as handler
+import replay_fakes
+import tts_stream
+from replay_fakes import Latency
+
+ANSWERS = [
+    replay_fakes.scripted_answer("你好"),
+    replay_fakes.scripted_answer("我今年六十五歲，膝蓋常常痠痛"),
+    "您好，我是 Luna。根據您提到的膝蓋痠痛，我推薦東森鴕鳥龜鹿精，它含有龜鹿二仙膠配方，"
+    "可以幫助關節保養。現在買三送三，平均一盒只要990元。另外，葉黃素滋養倍效膠囊也很適合"
+    "常看手機的長輩，能舒緩眼睛乾澀。請問您比較想先了解哪一項呢？",
+    "謝謝您的購買！我們會盡快為您安排出貨，預計三到五個工作天送達。祝您身體健康，有任何問題"
+    "都歡迎隨時與我們聯繫。",
+]
+
+MODES = [
+    # (label, AUDIO_FORMAT, output)
+    ('wav', 'wav', 'single'),
+    ('mp3', 'mp3', 'single'),
+    ('ogg_vorbis', 'ogg_vorbis', 'single'),
+    ('mp3 segmented', 'mp3', 'segmented'),
+    ('mp3 live', 'mp3', 'live'),
+]
+
+
+def use_format(name, scale):
+    audio_output.AUDIO_FORMAT = name
+    audio_output.POLLY_FORMAT, audio_output.EXTENSION, audio_output.CONTENT_TYPE = \
+        audio_output.FORMATS[name]
+    handler.OUTPUT_FORMAT = audio_output.POLLY_FORMAT
+    handler.polly = replay_fakes.FakePolly(Latency(150, 50, 2.0, seed=1, scale=scale))
+    handler.s3 = replay_fakes.FakeS3(Latency(40, 10, 5.0, seed=2, scale=scale))
+    # Fresh cache every run, so every answer is synthesized
+    handler.voice_cache = handler.tts_cache.AudioCache(handler.s3, handler.BUCKET_NAME,
+                                                       extension=audio_output.EXTENSION)
+
+
+def object_size(url):
+    key = url[len(handler.CDN_URL) + 1:]
+    return len(handler.s3.objects[f"{handler.BUCKET_NAME}/{key}"])
+
+
+def generate(answer, token_seconds):
+    for start in range(0, len(answer), 2):
+        time.sleep(token_seconds)
+        yield answer[start:start + 2]
+
+
+def run(answer, output, poll_seconds, token_seconds):
+    """
+    (bytes uploaded, server seconds until the response, seconds until the
+    client knows the first segment's URL, size of the first file)
+    """
+    started = time.perf_counter()
+    if output == 'single':
+        url = handler.gen_voice(''.join(generate(answer, token_seconds)))
+        size = object_size(url)
+        seconds = time.perf_counter() - started
+        return size, seconds, seconds, size
+
+    # As the handler does it: the response waits for every segment and the playlist
+    live = None
+    listed = []
+    on_segment = None
+    if output == 'live':
+        live = audio_output.LivePlaylist(handler.s3, handler.BUCKET_NAME, handler.CDN_URL,
+                                         1, 'bench')
+
+        def on_segment(index, text, url):
+            live.add(index, text, url)
+            listed.append(time.perf_counter() - started)
+
+    synthesizer = tts_stream.SentenceSynthesizer(handler.gen_voice, on_segment)
+    for delta in generate(answer, token_seconds):
+        synthesizer.feed(delta)
+    urls = synthesizer.finish()
+    if live is not None:
+        live.close()
+        playlist = live.url
+    else:
+        playlist = audio_output.upload_playlist(handler.s3, handler.BUCKET_NAME,
+                                                handler.CDN_URL, urls, synthesizer.texts)
+    seconds = time.perf_counter() - started
+    known = listed[0] + poll_seconds / 2 if listed else seconds
+    total = sum(object_size(url) for url in urls) + object_size(playlist)
+    return total, seconds, known, object_size(urls[0])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="multiplier for the fake Polly and S3 latencies")
+    parser.add_argument('--link-mbps', type=float, default=4.0,
+                        help="client download speed for the first playable file")
+    parser.add_argument('--poll-ms', type=float, default=250.0,
+                        help="how often the client polls a live playlist")
+    parser.add_argument('--token-ms', type=float, default=25.0,
+                        help="generation time per two characters of the answer")
+    args = parser.parse_args()
+
+    print(f"{len(ANSWERS)} answers, client link {args.link_mbps} Mbps")
+    print(f"{'mode':<14} {'KB/answer':>10} {'server ms':>10} {'playable ms':>12}")
+    for label, name, output in MODES:
+        use_format(name, args.scale)
+        sizes, server, playable = [], [], []
+        for answer in ANSWERS:
+            size, seconds, known, first_size = run(answer, output, args.poll_ms / 1000,
+                                                  args.token_ms / 1000)
+            sizes.append(size)
+            server.append(seconds * 1000)
+            playable.append(known * 1000 + first_size * 8 / (args.link_mbps * 1000))
+        print(f"{label:<14} {np.mean(sizes) / 1024:>10.1f} {np.mean(server):>10.1f} "
+              f"{np.mean(playable):>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
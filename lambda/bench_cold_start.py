@@ -0,0 +1,134 @@
+"""
+Cold-start cost of message_creation_handler: each sample is a fresh
+interpreter that imports the handler, the way Lambda's init phase does, and
+then serves one turn. The AWS services and Postgres are the zero-latency fakes
+of replay_fakes.py, so the numbers are local work only: imports, client
+creation and model loading. Clients that the handler creates lazily are
+created after the turn, for the services it called, and counted in the turn.
+
+`--baseline REV` runs the same measurement on the lambda/ directory of an
+earlier git revision, for a before/after comparison.
+
+Usage:
+    python bench_cold_start.py [--samples 5] [--baseline HEAD~1]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA_CSV = os.path.join(HERE, '..', 'data.csv')
+
+SCENARIOS = {
+    # name: (event, environment)
+    'stage 1, known customer': ({"content": "你好，我最近膝蓋常常痠痛", "conversationId": 1,
+                                 "stage": 1, "count": 0, "customerId": None}, {}),
+    'stage 2, anonymous': ({"content": "好，我要買", "conversationId": 1, "stage": 2,
+                            "count": 1}, {}),
+    'stage 2, PREWARM=1': ({"content": "好，我要買", "conversationId": 1, "stage": 2,
+                            "count": 1}, {'PREWARM': '1'}),
+}
+
+# Runs in the child interpreter, in the lambda/ directory being measured
+CHILD = """
+import contextlib, io, json, sys, time
+started = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    import message_creation_handler as handler
+imported = time.perf_counter()
+import db, replay_fakes
+handler.polly = replay_fakes.FakePolly()
+handler.s3 = replay_fakes.FakeS3()
+handler.voice_cache = handler.tts_cache.AudioCache(handler.s3, handler.BUCKET_NAME,
+                                                   extension=getattr(handler, 'audio_output', None)
+                                                   and handler.audio_output.EXTENSION or 'wav')
+handler.bedrock_llm_runtime = replay_fakes.FakeBedrockRuntime()
+handler.bedrock_agent_runtime_client = replay_fakes.FakeBedrockAgentRuntime(
+    {handler.AGENT_ID: replay_fakes.stage_1_nodes, handler.AGENT_ID_2: replay_fakes.stage_2_nodes})
+db.connection = replay_fakes.FakeDatabase().connection
+installed = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    handler.lambda_handler(json.loads(sys.argv[1]), None)
+answered = time.perf_counter()
+# With lazy clients the turn would also have created the real clients it used;
+# the fakes skipped that, so it is timed here and added to the turn
+clients = 0.0
+if hasattr(handler, 'aws_clients'):
+    used = ['s3'] + [service for service, fake in (
+        ('polly', handler.polly), ('bedrock-runtime', handler.bedrock_llm_runtime),
+        ('bedrock-agent-runtime', handler.bedrock_agent_runtime_client)) if fake.calls]
+    created = time.perf_counter()
+    for service in used:
+        handler.aws_clients.client(service, handler.AWS_REGION)
+    clients = time.perf_counter() - created
+print(json.dumps({'import': imported - started, 'first_turn': answered - installed + clients,
+                  'numpy': 'numpy' in sys.modules, 'boto3': 'boto3' in sys.modules}))
+"""
+
+
+def first_customer():
+    with open(DATA_CSV, encoding='utf-8') as f:
+        f.readline()
+        return f.readline().split(',', 1)[0]
+
+
+def sample(directory, event, environment):
+    # No instance metadata lookups for credentials when prewarm touches AWS
+    env = dict(os.environ, PROFILE_CSV=DATA_CSV, AWS_EC2_METADATA_DISABLED='true',
+               **environment)
+    result = subprocess.run([sys.executable, '-c', CHILD, json.dumps(event)], cwd=directory,
+                            env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(directory, samples):
+    rows = {}
+    for name, (event, environment) in SCENARIOS.items():
+        if 'customerId' in event:
+            event = dict(event, customerId=first_customer())
+        runs = [sample(directory, event, environment) for _ in range(samples + 1)][1:]
+        rows[name] = {
+            'import': np.median([run['import'] for run in runs]) * 1000,
+            'first_turn': np.median([run['first_turn'] for run in runs]) * 1000,
+            'total': np.median([run['import'] + run['first_turn'] for run in runs]) * 1000,
+            'loaded': ','.join(module for module in ('numpy', 'boto3') if runs[-1][module]),
+        }
+    return rows
+
+
+def checkout(revision, target):
+    archive = subprocess.run(['git', 'archive', revision, 'lambda'], cwd=os.path.join(HERE, '..'),
+                             capture_output=True, check=True).stdout
+    subprocess.run(['tar', '-x', '-C', target], input=archive, check=True)
+    return os.path.join(target, 'lambda')
+
+
+def print_rows(label, rows):
+    print(label)
+    print(f"  {'scenario':<26} {'import ms':>10} {'turn ms':>9} {'total ms':>9}  loaded at end")
+    for name, row in rows.items():
+        print(f"  {name:<26} {row['import']:>10.1f} {row['first_turn']:>9.1f} "
+              f"{row['total']:>9.1f}  {row['loaded'] or '-'}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--samples', type=int, default=5,
+                        help="fresh interpreters per scenario, after one discarded run")
+    parser.add_argument('--baseline', help="git revision to compare with, e.g. HEAD~1")
+    args = parser.parse_args()
+
+    if args.baseline:
+        with tempfile.TemporaryDirectory() as target:
+            print_rows(f"baseline {args.baseline}", measure(checkout(args.baseline, target),
+                                                             args.samples))
+    print_rows("working tree", measure(HERE, args.samples))
+
+
+if __name__ == "__main__":
+    main()
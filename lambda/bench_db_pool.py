@@ -0,0 +1,53 @@
+"""
+Per-request latency of a trivial query with and without connection pooling.
+
+Usage:
+    DB_HOST=... DB_NAME=... DB_USER=... DB_PASS=... python bench_db_pool.py [requests]
+"""
+import statistics
+import sys
+import time
+
+import db
+
+QUERY = "SELECT id FROM conversation ORDER BY created_at DESC LIMIT 1"
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(requests: int, pooling: bool):
+    db.close_pool()
+    db.DB_POOLING = pooling
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(QUERY)
+            cursor.fetchall()
+            cursor.close()
+        samples.append((time.perf_counter() - start) * 1000)
+    db.close_pool()
+    return samples
+
+
+def report(label, samples):
+    print(f"{label:<12} n={len(samples):<5} "
+          f"mean={statistics.mean(samples):8.2f}ms "
+          f"p50={percentile(samples, 50):8.2f}ms "
+          f"p95={percentile(samples, 95):8.2f}ms "
+          f"p99={percentile(samples, 99):8.2f}ms")
+
+
+if __name__ == "__main__":
+    if not db.DB_HOST:
+        print("ERROR: set DB_HOST/DB_NAME/DB_USER/DB_PASS to run the benchmark.")
+        sys.exit(1)
+
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    report("no pooling", run(requests, pooling=False))
+    report("pooling", run(requests, pooling=True))
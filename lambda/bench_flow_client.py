@@ -0,0 +1,104 @@
+"""
+Exercises flow_client.py against flow_fake_server.py through the real boto3
+client, with many concurrent callers:
+- throttling: the share of calls that succeed with and without retries;
+- concurrency cap: streams open at once never exceed FLOW_MAX_CONCURRENCY;
+- deadlines: a stalled flow fails at its deadline instead of hanging.
+
+Usage:
+    python bench_flow_client.py [--calls 200] [--callers 32] [--throttle 0.3]
+                                [--delay-ms 50] [--cap 8]
+"""
+import argparse
+import asyncio
+import os
+import time
+from concurrent import futures
+
+import numpy as np
+
+import flow_client
+import flow_fake_server
+
+FLOW_ID = "H4I1KUGNCW"
+ALIAS_ID = "XJ83BFUVST"
+DOCUMENT = "A001: 你好，我最近膝蓋常常痠痛"
+
+
+def run_calls(client, calls, callers, timeout=None):
+    def one(_):
+        started = time.perf_counter()
+        try:
+            result = client.invoke(FLOW_ID, ALIAS_ID, DOCUMENT, timeout=timeout)
+            return True, result.attempts, time.perf_counter() - started
+        except flow_client.FlowError:
+            return False, None, time.perf_counter() - started
+
+    with futures.ThreadPoolExecutor(max_workers=callers) as pool:
+        return list(pool.map(one, range(calls)))
+
+
+def report(label, rows, server):
+    ok = [row for row in rows if row[0]]
+    latencies = np.array([row[2] for row in rows]) * 1000
+    attempts = np.mean([row[1] for row in ok]) if ok else 0
+    print(f"{label:<24} {len(ok) / len(rows):>8.1%} {attempts:>9.2f} "
+          f"{np.percentile(latencies, 50):>8.0f} {np.percentile(latencies, 99):>8.0f} "
+          f"{server.requests:>9} {server.max_active:>6}")
+
+
+async def stream_async(client, calls):
+    async def one():
+        return [event.kind async for event in client.aevents(FLOW_ID, ALIAS_ID, DOCUMENT)]
+    return await asyncio.gather(*(one() for _ in range(calls)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--callers', type=int, default=32)
+    parser.add_argument('--throttle', type=float, default=0.3,
+                        help="probability that the fake answers 429")
+    parser.add_argument('--delay-ms', type=float, default=50,
+                        help="fake time to the first event")
+    parser.add_argument('--cap', type=int, default=8, help="FLOW_MAX_CONCURRENCY")
+    args = parser.parse_args()
+    # No instance metadata lookups for credentials
+    os.environ.setdefault('AWS_EC2_METADATA_DISABLED', 'true')
+    flow_client._slots = flow_client.threading.BoundedSemaphore(args.cap)
+    delay = args.delay_ms / 1000
+
+    print(f"{args.calls} calls from {args.callers} threads, throttle {args.throttle:.0%}, "
+          f"cap {args.cap}")
+    print(f"{'case':<24} {'success':>8} {'attempts':>9} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'requests':>9} {'open':>6}")
+    for label, retries in (('no retries', 0), (f'{flow_client.FLOW_RETRIES} retries',
+                                               flow_client.FLOW_RETRIES)):
+        with flow_fake_server.FakeFlowServer(throttle=args.throttle,
+                                             first_event_delay=delay) as server:
+            client = flow_client.FlowClient(server.client(max_pool_connections=args.callers),
+                                            retries=retries)
+            report(label, run_calls(client, args.calls, args.callers), server)
+            assert server.max_active <= args.cap
+
+    # One stalled flow: the stream opens but its first event comes too late.
+    # The client has the production config, so only the call's deadline can
+    # end the wait before botocore's read timeout does
+    with flow_fake_server.FakeFlowServer(first_event_delay=3.0) as server:
+        client = flow_client.FlowClient(server.client(**flow_client.CLIENT_CONFIG), retries=1)
+        rows = run_calls(client, 4, 4, timeout=1.0)
+        report('stalled, 1 s deadline', rows, server)
+        assert not any(row[0] for row in rows) and max(row[2] for row in rows) < 1.5
+
+    with flow_fake_server.FakeFlowServer(first_event_delay=delay) as server:
+        client = flow_client.FlowClient(server.client(max_pool_connections=args.callers))
+        started = time.perf_counter()
+        streams = asyncio.run(stream_async(client, args.callers))
+        elapsed = (time.perf_counter() - started) * 1000
+        complete = sum(kinds[-1] == flow_client.COMPLETION for kinds in streams)
+        print(f"aevents: {complete}/{len(streams)} streams complete in {elapsed:.0f} ms, "
+              f"{server.max_active} open at most")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Cost of a timing span with metrics enabled and disabled (METRICS=0), against
+an empty block.
+
+Usage:
+    python bench_metrics.py
+"""
+import time
+
+import metrics
+
+N = 200_000
+
+
+def per_call(fn):
+    started = time.perf_counter()
+    fn()
+    return (time.perf_counter() - started) / N * 1e9
+
+
+def empty():
+    for _ in range(N):
+        pass
+
+
+def spans():
+    for _ in range(N):
+        with metrics.span('bench'):
+            pass
+
+
+if __name__ == "__main__":
+    baseline = per_call(empty)
+    metrics.METRICS_ENABLED = False
+    disabled = per_call(spans) - baseline
+    metrics.METRICS_ENABLED = True
+    enabled = per_call(spans) - baseline
+    metrics.start_trace()
+    traced = per_call(spans) - baseline
+    metrics.end_trace()
+    print(f"span disabled     {disabled:8.0f}ns")
+    print(f"span enabled      {enabled:8.0f}ns (histogram only)")
+    print(f"span traced       {traced:8.0f}ns (histogram + turn trace)")
+    print(f"bench histogram   {metrics.histogram('bench').snapshot()}")
@@ -0,0 +1,62 @@
+"""
+Builds a synthetic customer base by resampling the profiles in data.csv, then
+times snapshot loading, lookups by 客代 and segment queries.
+
+Usage:
+    python bench_profile_store.py [customers]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+import profile_store
+
+DATA_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data.csv')
+SEGMENT = {
+    '年齡區間': '60-69',
+    '居住縣市': '台北市*',
+    '是否有高健康意識': '是',
+    '可推薦商品類別': '*保健*',
+}
+
+
+def synthetic_rows(n_customers, seed=0):
+    base = profile_store.ProfileStore.from_csv(DATA_CSV)
+    rng = random.Random(seed)
+    templates = []
+    for customer_id in base.customer_ids:
+        templates.append([(base.tags[tag][0], base.tags[tag][1], tag, value)
+                          for tag, values in base.profile(customer_id).items()
+                          for value in values])
+    for index in range(n_customers):
+        for category_1, category_2, tag, value in rng.choice(templates):
+            yield str(index + 1), category_1, category_2, tag, value
+
+
+def timed(label, fn, repeat=1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    elapsed = (time.perf_counter() - started) / repeat
+    unit, scale = ('us', 1e6) if elapsed < 1e-3 else ('ms', 1e3)
+    print(f"{label:<28} {elapsed * scale:10.2f}{unit}")
+    return result
+
+
+if __name__ == "__main__":
+    n_customers = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    store = timed(f"build {n_customers} customers",
+                  lambda: profile_store.ProfileStore.from_rows(synthetic_rows(n_customers)))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'profiles.bin')
+        timed("save snapshot", lambda: store.save(path))
+        print(f"{'snapshot size':<28} {os.path.getsize(path) / 1024 / 1024:10.2f}MB")
+        store = timed("load snapshot", lambda: profile_store.ProfileStore.load(path))
+
+    ids = [str(random.randint(1, n_customers)) for _ in range(1000)]
+    timed("1000 profile lookups", lambda: [store.profile(i) for i in ids], repeat=10)
+    count = timed("segment count", lambda: store.count(SEGMENT), repeat=100)
+    timed("segment ids", lambda: store.segment(SEGMENT), repeat=100)
+    print(f"{'segment size':<28} {count:10d}")
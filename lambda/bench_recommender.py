@@ -0,0 +1,40 @@
+"""
+Latency of local product scoring: one customer at a time and the whole
+customer base in one batch.
+
+Usage:
+    python bench_recommender.py [profiles.bin | data.csv]
+"""
+import os
+import sys
+import time
+
+import profile_store
+import recommender
+
+DATA_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data.csv')
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else DATA_CSV
+    if path.endswith('.csv'):
+        store = profile_store.ProfileStore.from_csv(path)
+    else:
+        store = profile_store.ProfileStore.load(path)
+    engine = recommender.Recommender(store)
+
+    ids = store.customer_ids[:1000]
+    started = time.perf_counter()
+    rounds = max(1, 10000 // len(ids))
+    confident = 0
+    for _ in range(rounds):
+        for customer_id in ids:
+            confident += engine.is_confident(engine.recommend(customer_id))
+    per_call = (time.perf_counter() - started) / (rounds * len(ids))
+    print(f"recommend()       {per_call * 1e6:8.1f}us per customer")
+    print(f"confident         {confident / rounds / len(ids):8.1%} of customers skip Stage 1")
+
+    started = time.perf_counter()
+    top, scores = engine.top_k_all()
+    elapsed = time.perf_counter() - started
+    print(f"top_k_all()       {elapsed * 1e3:8.2f}ms for {len(store)} customers "
+          f"({elapsed / len(store) * 1e6:.3f}us each)")
@@ -0,0 +1,210 @@
+"""
+Offline end-to-end replay of scripted conversations through
+message_creation_handler.lambda_handler. Bedrock, Polly, S3 and Postgres are
+replaced by the deterministic fakes in replay_fakes.py, and every stage of
+every turn is timed.
+
+Conversations are a few fixed scripts for unknown customers plus one per
+customer of data.csv (introduction from the customer's tags, a follow-up, then
+Stage 2 replies).
+
+Usage:
+    python bench_replay.py [--customers 100] [--scale 1.0] [--stream]
+                           [--save results.json] [--compare baseline.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA_CSV = os.path.join(HERE, '..', 'data.csv')
+os.environ.setdefault('PROFILE_CSV', DATA_CSV)
+
+import context_store  # noqa: E402
+import db  # noqa: E402
+import intent  # noqa: E402
+import message_creation_handler as handler  # noqa: E402
+import profile_store  # noqa: E402
+import recommender  # noqa: E402
+import replay_fakes  # noqa: E402
+import retrieval  # noqa: E402
+from replay_fakes import Latency  # noqa: E402
+
+SCRIPTS = [
+    ["你好", "我今年六十五歲，膝蓋常常痠痛", "我平常都在家", "聽起來不錯，但是有點貴", "再考慮看看"],
+    ["我想看看有什麼保健品", "最近眼睛很容易累", "我是上班族，每天看電腦", "好，幫我下單"],
+    ["嗨", "我想減肥", "三餐不太固定", "這個多少錢", "不用了，謝謝"],
+]
+STAGE_2_REPLIES = ["聽起來不錯，但是有點貴", "一盒可以吃多久", "再考慮看看", "好，幫我下單"]
+# A regression is flagged when a p95 grows more than this against the baseline
+REGRESSION_THRESHOLD = 0.10
+
+
+class StageTimer:
+    """Wraps functions so that every call records its duration under a stage name."""
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds * 1000)
+
+    def wrap(self, owner, name, stage):
+        fn = getattr(owner, name)
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - started)
+
+        setattr(owner, name, timed)
+
+    def summary(self):
+        result = {}
+        for stage, samples in self.samples.items():
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+            result[stage] = {'n': len(samples), 'p50': p50, 'p95': p95, 'p99': p99,
+                             'mean': float(np.mean(samples))}
+        return result
+
+
+def install_fakes(scale, seed):
+    latency = lambda mean, jitter, per_unit=0.0, offset=0: Latency(  # noqa: E731
+        mean, jitter, per_unit, seed=seed + offset, scale=scale)
+    handler.polly = replay_fakes.FakePolly(latency(150, 50, 2.0, 1))
+    handler.s3 = replay_fakes.FakeS3(latency(40, 10, 5.0, 2))
+    handler.voice_cache = handler.tts_cache.AudioCache(handler.s3, handler.BUCKET_NAME,
+                                                       extension=handler.audio_output.EXTENSION)
+    handler.bedrock_llm_runtime = replay_fakes.FakeBedrockRuntime(
+        first_token=latency(400, 100, offset=3), per_token=latency(15, 5, offset=4))
+    handler.bedrock_agent_runtime_client = replay_fakes.FakeBedrockAgentRuntime(
+        {handler.AGENT_ID: replay_fakes.stage_1_nodes,
+         handler.AGENT_ID_2: replay_fakes.stage_2_nodes},
+        latency=latency(800, 200, offset=5), between_events=latency(50, 20, offset=6))
+    database = replay_fakes.FakeDatabase(latency(3, 1, offset=7))
+    db.connection = database.connection
+    return database
+
+
+def install_timers(timer):
+    timer.wrap(context_store, 'load', 'context_load')
+    timer.wrap(context_store, 'save', 'context_save')
+    timer.wrap(handler, 'insert_message', 'db_insert')
+    timer.wrap(handler, 'local_recommendation', 'local_recommend')
+    timer.wrap(intent, 'classify', 'local_intent')
+    timer.wrap(handler, 'invoke_rag_flow', 'flow_stage_1')
+    timer.wrap(handler, 'invoke_rag_flow_stage_2', 'flow_stage_2')
+    timer.wrap(handler, 'call_llm', 'llm')
+    timer.wrap(handler, 'gen_voice', 'tts')
+
+
+def customer_conversations(n):
+    store = profile_store.ProfileStore.from_csv(DATA_CSV)
+    conversations = []
+    for index, customer_id in enumerate(store.customer_ids[:n]):
+        profile = store.profile(customer_id)
+        first = lambda tag, default: (profile.get(tag) or [default])[0]  # noqa: E731
+        turns = [
+            f"我是{first('性別', '男')}性，年齡{first('年齡區間', '40-49')}，"
+            f"住在{first('居住縣市', '台北市')}",
+            f"最近比較關心{first('保健瀏覽', first('可推薦商品類別', '保健'))}",
+        ]
+        # Rotate the Stage 2 replies so every path (remote, rules, finish) shows up
+        turns += STAGE_2_REPLIES[index % len(STAGE_2_REPLIES):]
+        conversations.append((customer_id, turns))
+    return conversations
+
+
+def replay(conversations, timer, stream=False):
+    """Plays every conversation like the frontend does: the stage and count follow the answers."""
+    endings = {handler.finish(), handler.FAREWELL}
+    turns = 0
+    for conversation_id, (customer_id, utterances) in enumerate(conversations, start=1):
+        stage, count = 1, 0
+        for index, utterance in enumerate(utterances):
+            event = {"content": utterance, "conversationId": conversation_id, "stage": stage,
+                     "count": count, "customerId": customer_id, "stream": stream}
+            if stream:
+                # Streamed turns publish their segments on a live playlist
+                event["turnId"] = f"t{index}"
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                ai = handler.lambda_handler(event, None)[1]
+            elapsed = time.perf_counter() - started
+            timer.record('turn', elapsed)
+            timer.record(f"turn_stage_{stage}", elapsed)
+            turns += 1
+            if stage == 2:
+                count += 1
+            stage = ai["stage"] or stage
+            if ai["content"] in endings:
+                break
+    return turns
+
+
+def print_summary(summary, baseline=None):
+    print(f"{'stage':<16}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    for stage in sorted(summary, key=lambda name: (name.startswith('turn'), name)):
+        row = summary[stage]
+        line = (f"{stage:<16}{row['n']:>6}{row['p50']:>10.1f}{row['p95']:>10.1f}"
+                f"{row['p99']:>10.1f}{row['mean']:>10.1f}")
+        if baseline and stage in baseline and baseline[stage]['p95']:
+            change = row['p95'] / baseline[stage]['p95'] - 1
+            line += f"  p95 {change:+.1%}"
+            if change > REGRESSION_THRESHOLD:
+                line += "  REGRESSION"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--customers', type=int, default=100)
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="multiplies every fake latency; 0 measures local overhead only")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stream', action='store_true', help="sentence-streamed TTS")
+    parser.add_argument('--save', help="write the summary as JSON")
+    parser.add_argument('--compare', help="baseline JSON written by --save")
+    args = parser.parse_args()
+
+    database = install_fakes(args.scale, args.seed)
+    timer = StageTimer()
+    install_timers(timer)
+    conversations = [(None, script) for script in SCRIPTS]
+    conversations += customer_conversations(args.customers)
+
+    # Replay a warm container: the local models are loaded before the first turn
+    started = time.perf_counter()
+    recommender.get_recommender()
+    intent.get_model()
+    retrieval.get_retriever()
+    timer.record('warmup', time.perf_counter() - started)
+
+    started = time.perf_counter()
+    turns = replay(conversations, timer, stream=args.stream)
+    elapsed = time.perf_counter() - started
+    print(f"{len(conversations)} conversations, {turns} turns in {elapsed:.1f}s "
+          f"(latency scale {args.scale}, stream={args.stream})")
+    print(f"remote calls: flow {handler.bedrock_agent_runtime_client.calls}, "
+          f"llm {handler.bedrock_llm_runtime.calls}, polly {handler.polly.calls}, "
+          f"{len(database.messages)} messages stored")
+    summary = timer.summary()
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_summary(summary, baseline)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(summary, f, indent=2)
+    handler.db_executor.shutdown()
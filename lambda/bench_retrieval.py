@@ -0,0 +1,95 @@
+"""
+Retrieval latency and recall over a synthetic catalogue: every synthetic
+product is a passage recombined from the lines of the real product files.
+IVF search is compared with an exact scan of the same memory-mapped vectors
+at growing catalogue sizes.
+
+Usage:
+    python bench_retrieval.py [n_products] [index dir]
+
+The indexes are built in a temporary directory that is removed afterwards,
+unless an index directory is given.
+"""
+import contextlib
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import recommender
+import retrieval
+
+QUERIES = ['膝蓋痠痛 手腳無力', '眼睛乾澀 看電腦很累', '想減肥 便秘', '銀髮族 補身體',
+           '價格 優惠方案', '糖尿病 視網膜', '上班族 三餐不定時', '關節退化 骨鬆']
+
+
+def synthetic_catalogue(n, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    for product in recommender.load_products():
+        lines.extend(line.strip(' -') for line in product.text.splitlines()
+                     if line.strip(' -') and not line.rstrip().endswith(':'))
+    passages = []
+    for i in range(n):
+        body = '\n'.join(rng.sample(lines, 6))
+        passages.append(f"商品名稱: 測試商品{i}\n{body}")
+    return passages, [f"P{i}" for i in range(n)]
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - started)
+    return result, float(np.median(samples))
+
+
+def recall(approximate, exact):
+    expected = {passage for _, passage, _ in exact}
+    return len([1 for _, passage, _ in approximate if passage in expected]) / len(expected)
+
+
+def run(n_products, directory):
+    passages, sources = synthetic_catalogue(n_products)
+
+    for size in sorted({1_000, 10_000, n_products}):
+        if size > n_products:
+            continue
+        started = time.perf_counter()
+        built = retrieval.ProductRetriever.from_passages(passages[:size], sources[:size])
+        build_s = time.perf_counter() - started
+        path = os.path.join(directory, str(size))
+        built.save(path)
+        retriever = retrieval.ProductRetriever.load(path)
+        index = retriever.index
+
+        vectors = retriever.embedder.embed(QUERIES)
+        ivf_s, exact_s, hits = 0.0, 0.0, 0.0
+        for vector in vectors:
+            approximate, elapsed = timed(lambda: index.search(vector, k=10), 20)
+            ivf_s += elapsed
+            exact, elapsed = timed(lambda: index.exact_search(vector, k=10), 5)
+            exact_s += elapsed
+            hits += recall(approximate, exact)
+        print(f"{size:>7} products  build {build_s:6.1f}s  "
+              f"{len(index.centroids):4} lists  "
+              f"ivf {ivf_s / len(QUERIES) * 1e3:7.2f}ms  "
+              f"exact {exact_s / len(QUERIES) * 1e3:7.2f}ms  "
+              f"recall@10 {hits / len(QUERIES):.2f}  "
+              f"{index.vectors.nbytes / 2**20:.0f} MiB mapped")
+
+
+if __name__ == "__main__":
+    n_products = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    if len(sys.argv) > 2:
+        target = contextlib.nullcontext(sys.argv[2])
+    else:
+        target = tempfile.TemporaryDirectory(prefix='product_index_')
+    with target as directory:
+        run(n_products, directory)
+    if len(sys.argv) > 2:
+        print(f"index files in {directory}")
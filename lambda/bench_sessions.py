@@ -0,0 +1,206 @@
+"""
+Load test of sessions.SessionManager: many customers hold conversations at
+once, each running the same five-turn script (three Stage 1 turns, then Stage
+2 until the purchase) with think time between turns. The process is pinned to
+one core, and the report gives wall-clock throughput and the CPU time per turn
+of this process, i.e. the turns per second one core sustains.
+
+Turns are answered by message_creation_handler.answer_turn with its local
+fast paths; the follow-up LLM calls go to replay_fakes.FakeBedrockRuntime.
+`--transport memory` answers the flows with replay_fakes.FakeBedrockAgentRuntime
+in-process; `--transport http` starts flow_fake_server.py in a subprocess and
+goes through the real boto3 client, whose request signing and event-stream
+parsing then count as CPU time here.
+
+`--max-sessions` below `--sessions` makes the LRU evict live conversations;
+every conversation must still end with its five turns and the purchase in its
+checkpoint.
+
+Usage:
+    python bench_sessions.py [--sessions 2000] [--think-ms 500] [--latency-ms 100]
+                             [--workers 64] [--transport memory|http]
+                             [--max-sessions 500] [--checkpoint-interval 1.0]
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent import futures
+
+import numpy as np
+
+import flow_client
+import flow_dispatch
+import message_creation_handler as handler
+import profile_store
+import replay_fakes
+import sessions
+from replay_fakes import Latency
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA_CSV = os.path.join(HERE, '..', 'data.csv')
+SCRIPT = ["你好，我最近膝蓋常常痠痛", "我今年六十五歲，晚上也睡不好", "有沒有適合長輩的保健品",
+          "價格有點高，我再考慮一下", "好，我要買兩盒"]
+
+# Runs in the fake flow server's interpreter
+SERVER = """
+import sys
+import flow_fake_server, replay_fakes
+server = flow_fake_server.FakeFlowServer(flows={sys.argv[1]: replay_fakes.stage_1_nodes,
+                                                sys.argv[2]: replay_fakes.stage_2_nodes},
+                                         first_event_delay=float(sys.argv[3]))
+print(server.endpoint_url, flush=True)
+server._server.serve_forever()
+"""
+
+
+class MemoryCheckpointStore:
+
+    def __init__(self):
+        self.rows = {}
+        self.loads = 0
+        self.saves = 0
+
+    def load(self, session_id):
+        self.loads += 1
+        return self.rows.get(session_id)
+
+    def save(self, rows):
+        self.saves += 1
+        for row in rows:
+            current = self.rows.get(row[0])
+            if current is None or current[5] <= row[5]:
+                self.rows[row[0]] = row
+
+
+def memory_flow(latency_ms, workers):
+    fake = replay_fakes.FakeBedrockAgentRuntime(
+        {handler.AGENT_ID: replay_fakes.stage_1_nodes,
+         handler.AGENT_ID_2: replay_fakes.stage_2_nodes},
+        latency=Latency(latency_ms, latency_ms / 4, seed=1))
+    return fake, None
+
+
+def http_flow(latency_ms, workers):
+    import boto3
+    from botocore.config import Config
+
+    server = subprocess.Popen([sys.executable, '-c', SERVER, handler.AGENT_ID, handler.AGENT_ID_2,
+                               str(latency_ms / 1000)], cwd=HERE, stdout=subprocess.PIPE,
+                              text=True)
+    endpoint_url = server.stdout.readline().strip()
+    config = dict(flow_client.CLIENT_CONFIG, max_pool_connections=workers)
+    client = boto3.client('bedrock-agent-runtime', region_name='us-west-2',
+                          endpoint_url=endpoint_url, aws_access_key_id='fake',
+                          aws_secret_access_key='fake', config=Config(**config))
+    return client, server
+
+
+async def conversation(manager, index, customer_id, think, rng, latencies):
+    await asyncio.sleep(rng.uniform(0, think))
+    for text in SCRIPT:
+        started = time.perf_counter()
+        await manager.turn(f"session-{index}", text, customer_id)
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(rng.uniform(0.5, 1.5) * think)
+
+
+async def run(manager, args, customers):
+    rng = random.Random(0)
+    latencies = []
+    peak = 0
+
+    async def watch():
+        nonlocal peak
+        while True:
+            peak = max(peak, len(manager.sessions))
+            await asyncio.sleep(0.05)
+
+    async with manager:
+        watcher = asyncio.get_running_loop().create_task(watch())
+        cpu = time.process_time()
+        started = time.perf_counter()
+        await asyncio.gather(*(conversation(manager, index, customers[index % len(customers)],
+                                            args.think_ms / 1000, rng, latencies)
+                               for index in range(args.sessions)))
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu
+        watcher.cancel()
+    return elapsed, cpu, peak, latencies
+
+
+def session_bytes(n=2000):
+    """Memory of idle sessions after the five-turn script, per session."""
+    transcript = ''.join(f"A001: {text}\n0000: {'推薦' * 60}\n" for text in SCRIPT)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    held = [sessions.Session(f"session-{index}", str(index), 2, 2, None, 5, '', transcript)
+            for index in range(n)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del held
+    return used / n, len(transcript)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=2000)
+    parser.add_argument('--think-ms', type=float, default=500,
+                        help="mean customer pause between turns")
+    parser.add_argument('--latency-ms', type=float, default=100,
+                        help="fake flow time to the first event")
+    parser.add_argument('--workers', type=int, default=64,
+                        help="flow streams open at once (executor and FLOW_MAX_CONCURRENCY)")
+    parser.add_argument('--transport', choices=('memory', 'http'), default='memory')
+    parser.add_argument('--max-sessions', type=int, default=None,
+                        help="LRU capacity; defaults to --sessions")
+    parser.add_argument('--checkpoint-interval', type=float, default=1.0)
+    args = parser.parse_args()
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+
+    profiles = profile_store.ProfileStore.from_csv(DATA_CSV)
+    flow_client._slots = flow_client.threading.BoundedSemaphore(args.workers)
+    flow_dispatch.executor = futures.ThreadPoolExecutor(args.workers)
+    handler.bedrock_llm_runtime = replay_fakes.FakeBedrockRuntime(
+        first_token=Latency(args.latency_ms, args.latency_ms / 4, seed=2))
+    client, server = (http_flow if args.transport == 'http' else memory_flow)(args.latency_ms,
+                                                                            args.workers)
+    store = MemoryCheckpointStore()
+    flow = flow_client.FlowClient(client, executor=futures.ThreadPoolExecutor(args.workers))
+    manager = sessions.SessionManager(store, flow=flow, profiles=profiles,
+                                      max_sessions=args.max_sessions or args.sessions,
+                                      checkpoint_interval=args.checkpoint_interval)
+    try:
+        elapsed, cpu, peak, latencies = asyncio.run(run(manager, args, profiles.customer_ids))
+    finally:
+        if server is not None:
+            server.terminate()
+
+    turns = len(latencies)
+    complete = sum(row[4] == 'purchase' and row[5] == len(SCRIPT) for row in store.rows.values())
+    stats = manager.stats
+    per_session, transcript_chars = session_bytes()
+    print(f"{args.sessions} conversations x {len(SCRIPT)} turns, transport {args.transport}, "
+          f"flow {args.latency_ms:.0f} ms, {args.workers} streams, one core")
+    print(f"  wall {elapsed:.1f} s: {turns / elapsed:.0f} turns/s, "
+          f"{peak} sessions in memory at peak")
+    print(f"  cpu {cpu:.1f} s: {cpu / turns * 1000:.2f} ms per turn, "
+          f"{turns / cpu:.0f} turns per core-second")
+    print(f"  turn latency p50 {np.percentile(latencies, 50) * 1000:.0f} ms, "
+          f"p99 {np.percentile(latencies, 99) * 1000:.0f} ms")
+    print(f"  evicted {stats.evicted}, restored {stats.restored}, closed {stats.closed}, "
+          f"checkpoint passes {stats.checkpoints} ({stats.checkpointed} rows, "
+          f"{stats.checkpoint_seconds * 1000 / max(stats.checkpoints, 1):.1f} ms each)")
+    print(f"  {complete}/{args.sessions} conversations checkpointed complete")
+    print(f"  idle session with a {transcript_chars}-char transcript: {per_session:.0f} bytes, "
+          f"{2 ** 30 / per_session:,.0f} sessions per GiB")
+    assert complete == args.sessions
+
+
+if __name__ == "__main__":
+    main()
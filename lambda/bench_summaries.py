@@ -0,0 +1,205 @@
+"""
+Throughput and cost of the call-summary worker (summaries.py) by batch size,
+with LocalQueue, an in-memory store and the fake Bedrock runtime of
+replay_fakes.py. A crash between the upsert and the queue delete is then
+simulated to check that the redelivered jobs write no duplicate summaries,
+and a model that is throttled and never summarizes one conversation checks
+that the worker survives and dead-letters the poison job.
+
+Usage:
+    python bench_summaries.py [--conversations 200] [--batch-sizes 1,4,8,16]
+                              [--workers 4] [--scale 0.05]
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+
+import summaries
+from replay_fakes import FakeBedrockRuntime, Latency
+
+CUSTOMER_LINES = ["你好", "我今年六十五歲，膝蓋常常痠痛", "最近眼睛很容易乾澀", "我平常都在家",
+                  "聽起來不錯，但是有點貴", "有沒有優惠？", "好，我要買", "再考慮看看"]
+AGENT_LINES = ["您好，我是 Luna，請問最近身體狀況如何？", "推薦您鴕鳥龜鹿精，對關節很有幫助。",
+               "葉黃素可以舒緩眼睛乾澀。", "現在買九送九，平均一盒只要495元。"]
+
+
+class MemorySummaryStore:
+    """The PostgresSummaryStore contract over dicts, with the upsert's last_message_id guard."""
+
+    def __init__(self, transcripts):
+        self._transcripts = transcripts
+        self.rows = {}
+        self.writes = 0
+        self._lock = threading.Lock()
+
+    def transcripts(self, conversation_ids):
+        return {cid: self._transcripts[cid] for cid in conversation_ids
+                if cid in self._transcripts}
+
+    def summarized(self, conversation_ids):
+        with self._lock:
+            return {cid: self.rows[cid][1] for cid in conversation_ids if cid in self.rows}
+
+    def upsert(self, rows):
+        with self._lock:
+            for row in rows:
+                current = self.rows.get(row[0])
+                if current is None or current[1] <= row[1]:
+                    self.rows[row[0]] = row
+                    self.writes += 1
+
+
+def make_transcripts(n, seed=0):
+    rng = random.Random(seed)
+    transcripts = {}
+    message_id = 0
+    for conversation_id in range(1, n + 1):
+        lines = []
+        for _ in range(rng.randint(3, 8)):
+            lines.append(('A001', rng.choice(CUSTOMER_LINES)))
+            lines.append(('0000', rng.choice(AGENT_LINES)))
+        message_id += len(lines)
+        transcripts[conversation_id] = (message_id, lines)
+    return transcripts
+
+
+def summary_answer(prompt: str) -> str:
+    # A plausible-length summary for every conversation in the prompt
+    result = {}
+    for conversation_id in re.findall(r'### 對話 (\d+)', prompt):
+        result[conversation_id] = {
+            "summary": "客戶關心關節與眼睛保健，業務推薦鴕鳥龜鹿精與葉黃素並說明優惠方案，客戶表示會再考慮。",
+            "outcome": "未成交",
+            "products": ["鴕鳥龜鹿精", "葉黃素"],
+        }
+    return json.dumps(result, ensure_ascii=False)
+
+
+def fake_llm(scale):
+    client = FakeBedrockRuntime(first_token=Latency(600, 150, seed=1, scale=scale),
+                                per_token=Latency(0, 0, 12, scale=scale),
+                                answer=summary_answer)
+    return summaries.bedrock_llm(client)
+
+
+def run(transcripts, batch_size, workers, scale):
+    queue = summaries.LocalQueue()
+    for conversation_id in transcripts:
+        summaries.enqueue(conversation_id, 'farewell', queue=queue)
+    store = MemorySummaryStore(transcripts)
+    llm = fake_llm(scale)
+    # Workers share the stats so the report covers the whole run
+    stats = summaries.SummaryStats()
+    threads = []
+    for _ in range(workers):
+        worker = summaries.SummaryWorker(queue, store, llm, batch_size=batch_size)
+        worker.stats = stats
+        threads.append(threading.Thread(target=worker.run, kwargs={'idle_exit': True}))
+    stats.started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats.as_dict(), store
+
+
+class Crash(Exception):
+    pass
+
+
+def crash_and_resume(transcripts, scale):
+    """Kills the worker after its first upsert, before it deletes the messages."""
+    queue = summaries.LocalQueue(visibility_timeout=0.05)
+    for conversation_id in transcripts:
+        summaries.enqueue(conversation_id, queue=queue)
+    store = MemorySummaryStore(transcripts)
+    worker = summaries.SummaryWorker(queue, store, fake_llm(scale), batch_size=8)
+    upsert = store.upsert
+
+    def upsert_then_crash(rows):
+        upsert(rows)
+        raise Crash()
+
+    store.upsert = upsert_then_crash
+    try:
+        worker.run_once()
+    except Crash:
+        pass
+    store.upsert = upsert
+    time.sleep(0.1)  # the unacknowledged messages become visible again
+    resumed = summaries.SummaryWorker(queue, store, fake_llm(scale), batch_size=8)
+    stats = resumed.run(idle_exit=True)
+    return {
+        'summaries': len(store.rows),
+        'writes': store.writes,
+        'duplicates': store.writes - len(store.rows),
+        'skipped_on_resume': stats.skipped,
+        'left_on_queue': len(queue),
+    }
+
+
+def poison(transcripts, scale):
+    """Throttles every third call and always leaves conversation 1 out of the answer."""
+    from botocore.exceptions import ClientError
+
+    queue = summaries.LocalQueue(visibility_timeout=0.01)
+    for conversation_id in transcripts:
+        summaries.enqueue(conversation_id, queue=queue)
+    store = MemorySummaryStore(transcripts)
+    llm = fake_llm(scale)
+    calls = [0]
+
+    def flaky_llm(prompt):
+        calls[0] += 1
+        if calls[0] % 3 == 0:
+            raise ClientError({'Error': {'Code': 'ThrottlingException'}}, 'InvokeModel')
+        text, input_tokens, output_tokens = llm(prompt)
+        answer = summaries.parse_summaries(text)
+        answer.pop('1', None)
+        return json.dumps(answer, ensure_ascii=False), input_tokens, output_tokens
+
+    summaries.SUMMARY_BACKOFF_BASE = 0.01
+    worker = summaries.SummaryWorker(queue, store, flaky_llm, batch_size=8)
+    while len(queue):
+        stats = worker.run(idle_exit=True)
+        time.sleep(0.02)  # failed messages become visible again
+    return {
+        'summaries': len(store.rows),
+        'throttled': stats.throttled,
+        'dead_lettered': queue.dead,
+        'left_on_queue': len(queue),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--conversations', type=int, default=200)
+    parser.add_argument('--batch-sizes', default='1,4,8,16')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--scale', type=float, default=0.05,
+                        help="multiplier for the fake model latencies")
+    args = parser.parse_args()
+
+    transcripts = make_transcripts(args.conversations)
+    print(f"{args.conversations} conversations, {args.workers} workers, "
+          f"latency scale {args.scale}")
+    print(f"{'batch':>5} {'calls':>6} {'summ/s':>8} {'in tok':>8} {'out tok':>8} "
+          f"{'$/summary':>10}")
+    for batch_size in map(int, args.batch_sizes.split(',')):
+        stats, store = run(transcripts, batch_size, args.workers, args.scale)
+        assert len(store.rows) == args.conversations, stats
+        print(f"{batch_size:>5} {stats['llm_calls']:>6} {stats['summaries_per_second']:>8.1f} "
+              f"{stats['input_tokens']:>8} {stats['output_tokens']:>8} "
+              f"{stats['cost_per_summary_usd']:>10.6f}")
+
+    print(f"Crash between upsert and ack, then resume: "
+          f"{crash_and_resume(make_transcripts(40, seed=1), args.scale)}")
+    print(f"Throttled model and a poison conversation: "
+          f"{poison(make_transcripts(20, seed=2), args.scale)}")
+
+
+if __name__ == "__main__":
+    main()
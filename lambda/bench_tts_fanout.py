@@ -0,0 +1,94 @@
+"""
+Compares the original single-request synthesis of a long markdown answer
+with the fan-out path of gen_voice. The fan-out path runs the tts_text front
+end, sends the SSML chunks concurrently on polly_executor, and joins the parts
+in order. Polly and S3 are the fakes of replay_fakes.py; Polly latency grows
+with the characters of the request.
+
+Usage:
+    python bench_tts_fanout.py [--repeat 5] [--scale 1.0] [--workers 1,2,4,8]
+                               [--chunk-chars 80,160,320]
+"""
+import argparse
+import time
+from concurrent import futures
+
+import numpy as np
+
+import audio_output
+import message_creation_handler as handler
+import replay_fakes
+import tts_text
+from replay_fakes import Latency
+
+# The kind of answer recommend_product produces (see the sample in the handler)
+LONG_ANSWER = (
+    "# 推薦產品清單\n\n## 1. 眼睛保健產品\n- **商品名稱**: 東森專利葉黃素滋養倍效膠囊\n"
+    "- **售價**: 市價9900元（5盒），優惠方案18盒只要8910元（買9送9，平均一盒495元）\n"
+    "- **主要功效**:\n  * 修復視神經、增強夜視功能\n  * 保濕眼球、舒緩乾澀\n"
+    "  * 預防青光眼、白內障和黃斑部病變\n  * 抗藍光、抗紫外線保護\n"
+    "- **特色成分**: 四國專利Lutemax®葉黃素、高濃度綠蜂膠、小分子玻尿酸\n"
+    "- **適用人群**: 3C使用者、銀髮族、眼睛疲勞者、眼睛手術後保養\n\n"
+    "## 2. 體重管理產品\n- **商品名稱**: 東森完美動能極孅果膠\n"
+    "- **售價**: 市價1980元/盒（10包），優惠方案五盒只要1980元（買一送四）\n"
+    "- **主要功效**:\n  * 增加飽足感，控制食慾\n  * 促進腸道蠕動，改善便秘\n"
+    "  * 調控血糖吸收，減少脂肪囤積\n  * 可作為代餐（每包僅約78.3大卡）\n"
+    "- **特色成分**: 魔芋萃取物、菊苣纖維、日本栗子種皮萃取物\n"
+    "- **適用人群**: 想瘦身/控制體重者、便秘者、三餐不定時的上班族\n\n"
+    "您對哪項推薦產品有興趣？我可以提供更多相關資訊。"
+)
+
+
+def install_fakes(scale, seed=0):
+    handler.polly = replay_fakes.FakePolly(Latency(150, 50, 2.0, seed=seed + 1, scale=scale))
+    handler.s3 = replay_fakes.FakeS3(Latency(40, 10, 5.0, seed=seed + 2, scale=scale))
+    handler.voice_cache = handler.tts_cache.AudioCache(handler.s3, handler.BUCKET_NAME,
+                                                       extension=audio_output.EXTENSION)
+
+
+def single_call(text):
+    # The path before the text front end: the raw answer in one request
+    response = handler.polly.synthesize_speech(Text=text, OutputFormat=handler.OUTPUT_FORMAT,
+                                               VoiceId=handler.VOICE_ID,
+                                               SampleRate=str(handler.SAMPLE_RATE))
+    body = audio_output.upload_body([response['AudioStream']], handler.SAMPLE_RATE)
+    handler.s3.upload_fileobj(Fileobj=body, Bucket=handler.BUCKET_NAME, Key='single')
+
+
+def measure(fn, repeat, scale):
+    samples = []
+    for seed in range(repeat):
+        install_fakes(scale, seed)
+        started = time.perf_counter()
+        fn(LONG_ANSWER)
+        samples.append((time.perf_counter() - started) * 1000)
+    return np.percentile(samples, 50), max(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="multiplier for the fake Polly and S3 latencies")
+    parser.add_argument('--workers', default='1,2,4,8')
+    parser.add_argument('--chunk-chars', default='80,160,320')
+    args = parser.parse_args()
+
+    spoken = tts_text.prepare(LONG_ANSWER)
+    print(f"answer: {len(LONG_ANSWER)} chars of markdown, {len(spoken)} chars spoken")
+    print(f"{'path':<28} {'requests':>8} {'p50 ms':>8} {'max ms':>8}")
+    p50, worst = measure(single_call, args.repeat, args.scale)
+    print(f"{'single request':<28} {1:>8} {p50:>8.1f} {worst:>8.1f}")
+    for chunk_chars in map(int, args.chunk_chars.split(',')):
+        tts_text.TTS_CHUNK_CHARS = chunk_chars
+        n_chunks = len(tts_text.ssml_chunks(LONG_ANSWER))
+        for workers in map(int, args.workers.split(',')):
+            handler.polly_executor = futures.ThreadPoolExecutor(max_workers=workers)
+            p50, worst = measure(handler.gen_voice, args.repeat, args.scale)
+            label = f"fan-out {chunk_chars} chars x{workers}"
+            print(f"{label:<28} {n_chunks:>8} {p50:>8.1f} {worst:>8.1f}")
+            handler.polly_executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
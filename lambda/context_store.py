@@ -0,0 +1,183 @@
+import json
+import os
+import threading
+from collections import OrderedDict, deque
+
+# Token budgets. Traditional Chinese is roughly one token per character, so
+# character counts are used as the estimate.
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 2000))
+SUMMARY_TOKEN_BUDGET = int(os.environ.get('SUMMARY_TOKEN_BUDGET', 400))
+# Old turns are folded into the summary truncated to this many characters.
+SUMMARY_LINE_CHARS = int(os.environ.get('SUMMARY_LINE_CHARS', 40))
+# Number of conversations kept in memory per container.
+CONTEXT_CACHE_SIZE = int(os.environ.get('CONTEXT_CACHE_SIZE', 256))
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text)
+
+
+def format_turn(username: str, text: str) -> str:
+    return '{}: {}\n'.format(username, text)
+
+
+def summarize_lines(lines) -> str:
+    # Cheap extractive summary: keep the head of every evicted turn.
+    parts = []
+    for line in lines:
+        line = line.strip()
+        if len(line) > SUMMARY_LINE_CHARS:
+            line = line[:SUMMARY_LINE_CHARS] + '…'
+        parts.append(line)
+    return '\n'.join(parts) + '\n'
+
+
+class ConversationContext:
+    __slots__ = ('conversation_id', 'last_message_id', 'summary', 'turns',
+                 'tokens', 'dirty')
+
+    def __init__(self, conversation_id, last_message_id=0, summary='',
+                 transcript='', turns=None):
+        self.conversation_id = conversation_id
+        self.last_message_id = last_message_id
+        self.summary = summary
+        # `turns` is the list of formatted turns, or its JSON. Splitting the
+        # flattened transcript is only for snapshots stored without it: a
+        # message containing newlines comes back as several turns.
+        if turns is None:
+            turns = transcript.splitlines(keepends=True)
+        elif isinstance(turns, str):
+            turns = json.loads(turns)
+        self.turns = deque(turns)
+        self.tokens = sum(map(estimate_tokens, self.turns))
+        self.dirty = False
+
+    def append(self, message_id, username: str, text: str, summarizer=None):
+        if message_id is not None and message_id <= self.last_message_id:
+            return
+        line = format_turn(username, text)
+        self.turns.append(line)
+        self.tokens += estimate_tokens(line)
+        if message_id is not None:
+            self.last_message_id = message_id
+        self.dirty = True
+        self._compact(summarizer or summarize_lines)
+
+    def _compact(self, summarizer):
+        if self.tokens <= CONTEXT_TOKEN_BUDGET:
+            return
+        evicted = []
+        # Always keep the latest turn verbatim.
+        while self.tokens > CONTEXT_TOKEN_BUDGET and len(self.turns) > 1:
+            line = self.turns.popleft()
+            self.tokens -= estimate_tokens(line)
+            evicted.append(line)
+        if not evicted:
+            return
+        summary = self.summary + summarizer(evicted)
+        # Drop the oldest summary lines first, then hard-trim what is left.
+        while estimate_tokens(summary) > SUMMARY_TOKEN_BUDGET and '\n' in summary[:-1]:
+            summary = summary[summary.index('\n') + 1:]
+        if estimate_tokens(summary) > SUMMARY_TOKEN_BUDGET:
+            summary = summary[-SUMMARY_TOKEN_BUDGET:]
+        self.summary = summary
+
+    @property
+    def transcript(self) -> str:
+        return ''.join(self.turns)
+
+    @property
+    def turns_json(self) -> str:
+        return json.dumps(list(self.turns), ensure_ascii=False)
+
+    def render(self) -> str:
+        if not self.summary:
+            return self.transcript
+        return 'Earlier conversation (summary):\n{}\nRecent conversation:\n{}'.format(
+            self.summary, self.transcript)
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _cache_get(conversation_id):
+    with _cache_lock:
+        context = _cache.get(conversation_id)
+        if context is not None:
+            _cache.move_to_end(conversation_id)
+        return context
+
+
+def _cache_put(context):
+    with _cache_lock:
+        _cache[context.conversation_id] = context
+        _cache.move_to_end(context.conversation_id)
+        while len(_cache) > CONTEXT_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _load_snapshot(cursor, conversation_id):
+    cursor.execute(
+        """
+        SELECT last_message_id, summary, transcript, transcript_turns
+        FROM conversation_context
+        WHERE conversation_id = %s
+        """, (conversation_id, ))
+    row = cursor.fetchone()
+    if row is None:
+        return ConversationContext(conversation_id)
+    return ConversationContext(conversation_id,
+                               last_message_id=row[0],
+                               summary=row[1],
+                               transcript=row[2],
+                               turns=row[3])
+
+
+def load(cursor, conversation_id, summarizer=None) -> ConversationContext:
+    """
+    Returns the context of a conversation, reading only the messages that were
+    written after the cached (or persisted) snapshot.
+    """
+    context = _cache_get(conversation_id)
+    if context is None:
+        context = _load_snapshot(cursor, conversation_id)
+
+    cursor.execute(
+        """
+        SELECT id, username, content
+        FROM message
+        WHERE conversation_id = %s AND id > %s
+        ORDER BY id ASC
+        """, (conversation_id, context.last_message_id))
+    for message_id, username, text in cursor.fetchall():
+        context.append(message_id, username, text, summarizer=summarizer)
+
+    _cache_put(context)
+    return context
+
+
+def save(cursor, context: ConversationContext):
+    if not context.dirty:
+        return
+    cursor.execute(
+        """
+        INSERT INTO conversation_context
+            (conversation_id, last_message_id, summary, transcript, transcript_turns,
+             updated_at)
+        VALUES (%s, %s, %s, %s, %s, NOW())
+        ON CONFLICT (conversation_id) DO UPDATE SET
+            last_message_id = EXCLUDED.last_message_id,
+            summary = EXCLUDED.summary,
+            transcript = EXCLUDED.transcript,
+            transcript_turns = EXCLUDED.transcript_turns,
+            updated_at = EXCLUDED.updated_at
+        WHERE conversation_context.last_message_id <= EXCLUDED.last_message_id
+        """, (context.conversation_id, context.last_message_id,
+              context.summary, context.transcript, context.turns_json))
+    context.dirty = False
+
+
+def invalidate(conversation_id):
+    with _cache_lock:
+        _cache.pop(conversation_id, None)
@@ -1,32 +1,36 @@
-import psycopg2
+import db
+import pagination
 
-DB_HOST = ''
-DB_PORT = 5432
-DB_NAME = ''
-DB_USER = ''
-DB_PASS = ''
+LIST_CONVERSATIONS_QUERY = """
+    SELECT id, name, created_at, updated_at
+    FROM conversation
+    {keyset}
+    ORDER BY created_at DESC, id DESC
+    LIMIT %s
+"""
+
+
+def serialize(row):
+    return {
+        'id': row[0],
+        'name': row[1],
+        'createdAt': row[2].isoformat(),
+        'updatedAt': row[3].isoformat(),
+    }
 
 
 def lambda_handler(event, context):
 
     try:
-        conn = psycopg2.connect(host=DB_HOST,
-                                database=DB_NAME,
-                                user=DB_USER,
-                                password=DB_PASS,
-                                port=DB_PORT)
-        cursor = conn.cursor()
-        query = "SELECT * FROM conversation ORDER BY created_at DESC"
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        result = [{
-            'id': row[0],
-            'name': row[1],
-            'createdAt': row[2].isoformat(),
-            'updatedAt': row[3].isoformat(),
-        } for row in rows]
-        cursor.close()
-        conn.close()
-        return result
+        paged, limit, after = pagination.page_request(event)
+        keyset, keyset_params = pagination.keyset_clause(after)
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(LIST_CONVERSATIONS_QUERY.format(keyset=keyset),
+                           (*keyset_params, limit + 1))
+            items, next_cursor = pagination.read_page(cursor, limit, serialize,
+                                                      created_at_index=2, id_index=0)
+            cursor.close()
+        return pagination.response(items, next_cursor, paged)
     except Exception as e:
         return {'message': str(e)}
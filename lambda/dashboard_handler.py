@@ -0,0 +1,17 @@
+import db
+import rollups
+
+
+def lambda_handler(event, context):
+
+    try:
+        query = (event.get('params') or {}).get('querystring') or {}
+        days = max(1, min(int(query.get('days') or rollups.DASHBOARD_DAYS), 366))
+        segment = query.get('segment') or None
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            result = rollups.dashboard(cursor, days=days, segment=segment)
+            cursor.close()
+        return result
+    except Exception as e:
+        return {'message': str(e)}
@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool
+
+DB_HOST = os.environ.get('DB_HOST', '')
+DB_PORT = int(os.environ.get('DB_PORT', 5432))
+DB_NAME = os.environ.get('DB_NAME', '')
+DB_USER = os.environ.get('DB_USER', '')
+DB_PASS = os.environ.get('DB_PASS', '')
+
+# Pool
+# Connections are opened on demand, so a Lambda container, which serves one
+# invocation at a time on one connection, still opens a single one. The cap
+# leaves room for threaded callers that each take a connection, such as the
+# checkpoint store executor of sessions.py (4 threads); more concurrent
+# db.connection() users than DB_POOL_MAX raise psycopg2.pool.PoolError.
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 0))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 4))
+DB_POOLING = os.environ.get('DB_POOLING', '1') != '0'
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', 5))
+# Connections idle for longer than this are pinged before being handed out.
+DB_HEALTHCHECK_INTERVAL = float(os.environ.get('DB_HEALTHCHECK_INTERVAL', 30))
+
+_pool = None
+_pool_lock = threading.Lock()
+_last_used = {}
+
+
+def _connect_kwargs():
+    return {
+        "host": DB_HOST,
+        "database": DB_NAME,
+        "user": DB_USER,
+        "password": DB_PASS,
+        "port": DB_PORT,
+        "connect_timeout": DB_CONNECT_TIMEOUT,
+        "keepalives": 1,
+        "keepalives_idle": 30,
+        "keepalives_interval": 10,
+        "keepalives_count": 3,
+    }
+
+
+class _Pool(pool.ThreadedConnectionPool):
+
+    def _connect(self, key=None):
+        conn = super()._connect(key)
+        # Just opened, so the first checkout needs no ping
+        _last_used[id(conn)] = time.monotonic()
+        return conn
+
+    def _putconn(self, conn, key=None, close=False):
+        # psycopg2 keeps only `minconn` idle connections and closes the others,
+        # which with on-demand opening (DB_POOL_MIN=0) would close every one.
+        # Called with the pool lock held.
+        minconn, self.minconn = self.minconn, self.maxconn
+        try:
+            super()._putconn(conn, key, close)
+        finally:
+            self.minconn = minconn
+
+
+def get_pool():
+    global _pool
+    if _pool is None or _pool.closed:
+        with _pool_lock:
+            if _pool is None or _pool.closed:
+                _pool = _Pool(DB_POOL_MIN, DB_POOL_MAX, **_connect_kwargs())
+    return _pool
+
+
+def _is_healthy(conn) -> bool:
+    if conn.closed:
+        return False
+    last_used = _last_used.get(id(conn), 0)
+    if time.monotonic() - last_used < DB_HEALTHCHECK_INTERVAL:
+        return True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _acquire():
+    p = get_pool()
+    # One retry is enough: a freshly opened connection is healthy by definition.
+    for _ in range(2):
+        conn = p.getconn()
+        if _is_healthy(conn):
+            return conn
+        _last_used.pop(id(conn), None)
+        p.putconn(conn, close=True)
+    return p.getconn()
+
+
+def _release(conn, broken=False):
+    if conn.closed:
+        broken = True
+    if broken:
+        _last_used.pop(id(conn), None)
+    else:
+        _last_used[id(conn)] = time.monotonic()
+    get_pool().putconn(conn, close=broken)
+
+
+@contextmanager
+def connection():
+    """
+    Yields a database connection that is reused across warm invocations.
+
+    The transaction is committed when the block exits normally and rolled back
+    otherwise. Connections that fail with an OperationalError/InterfaceError
+    are dropped so the next call reconnects.
+    """
+    if not DB_POOLING:
+        conn = psycopg2.connect(**_connect_kwargs())
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return
+
+    conn = _acquire()
+    broken = False
+    try:
+        yield conn
+        conn.commit()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        _release(conn, broken=broken)
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and not _pool.closed:
+            _pool.closeall()
+        _pool = None
+        _last_used.clear()
@@ -0,0 +1,51 @@
+"""
+Offline evaluation of the local purchase-intent classifier on the held-out
+labelled set: how many remote is_buy calls it avoids and how precise the
+local answers are. `unclear` utterances answered locally count as errors.
+
+Usage:
+    python eval_intent.py [eval.tsv] [min confidence]
+"""
+import os
+import sys
+import time
+
+import intent
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(intent.DATA_DIR, 'eval.tsv')
+    min_confidence = float(sys.argv[2]) if len(sys.argv) > 2 else intent.INTENT_MIN_CONFIDENCE
+    examples = intent.load_examples(path)
+    model = intent.get_model()
+
+    decided = correct = 0
+    by_source = {}
+    errors = []
+    started = time.perf_counter()
+    results = [intent.classify(text, model=model, min_confidence=min_confidence)
+               for text, _ in examples]
+    per_call = (time.perf_counter() - started) / len(examples)
+    for (text, label), result in zip(examples, results):
+        counts = by_source.setdefault(result.source, [0, 0])
+        counts[0] += 1
+        if result.label is None:
+            continue
+        decided += 1
+        if result.label == label:
+            correct += 1
+            counts[1] += 1
+        else:
+            errors.append((text, label, result))
+
+    print(f"utterances        {len(examples)}")
+    print(f"remote avoided    {decided / len(examples):8.1%}")
+    print(f"local precision   {correct / decided if decided else 0.0:8.1%} ({correct}/{decided})")
+    for source, (count, right) in sorted(by_source.items()):
+        print(f"  {source:<10}      {count:4} answered, {right} correct")
+    for label in (intent.BUY, intent.NOT_BUY, 'unclear'):
+        labelled = [result for (_, gold), result in zip(examples, results) if gold == label]
+        local = len([result for result in labelled if result.label is not None])
+        print(f"  {label:<10}      {local}/{len(labelled)} answered locally")
+    print(f"latency           {per_call * 1e6:8.1f}us per utterance")
+    for text, label, result in errors:
+        print(f"  wrong: {text!r} is {label}, got {result}")
@@ -0,0 +1,304 @@
+"""
+Client for Bedrock flows (InvokeFlow) shared by the message handler and the
+flow/ command-line tools.
+
+The response stream is exposed three ways: `events()` is a plain iterator,
+`invoke(on_event=...)` drains the stream with a callback and returns the
+accumulated result, and `aevents()` is an async iterator for asyncio code.
+Every call:
+- has a deadline (FLOW_TIMEOUT seconds) that covers waiting for a slot,
+  retries and reading the stream. The stream is read on a pump thread, so
+  the caller gets FlowTimeout at the deadline even while a read is stalled;
+- is retried with full-jitter exponential backoff on throttling and transient
+  errors, as long as no event has been delivered yet;
+- holds one slot of a process-wide semaphore (FLOW_MAX_CONCURRENCY) while
+  its stream is open.
+Failures raise FlowError instead of returning None.
+"""
+import asyncio
+import json
+import os
+import queue
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+from urllib3.exceptions import HTTPError as StreamReadError
+
+FLOW_TIMEOUT = float(os.environ.get('FLOW_TIMEOUT', 30))
+FLOW_RETRIES = int(os.environ.get('FLOW_RETRIES', 3))
+FLOW_BACKOFF_BASE = float(os.environ.get('FLOW_BACKOFF_BASE', 0.2))
+FLOW_BACKOFF_MAX = float(os.environ.get('FLOW_BACKOFF_MAX', 4.0))
+FLOW_MAX_CONCURRENCY = int(os.environ.get('FLOW_MAX_CONCURRENCY', 16))
+# Points the default client at another endpoint, e.g. flow_fake_server.py
+FLOW_ENDPOINT_URL = os.environ.get('FLOW_ENDPOINT_URL') or None
+AWS_REGION = "us-west-2"
+
+# botocore's own retries are turned off so the deadline and backoff here are
+# the only ones. The read timeout only bounds how long an abandoned pump
+# thread keeps its connection (and slot); callers get the per-call deadline.
+CLIENT_CONFIG = {
+    'retries': {'mode': 'standard', 'total_max_attempts': 1},
+    'read_timeout': FLOW_TIMEOUT,
+    'max_pool_connections': FLOW_MAX_CONCURRENCY,
+}
+
+# Error codes worth another attempt; event-stream errors use lower camel case
+RETRYABLE_CODES = {'ThrottlingException', 'TooManyRequestsException',
+                   'ServiceQuotaExceededException', 'ServiceUnavailableException',
+                   'InternalServerException', 'BadGatewayException'}
+
+CHUNK = 'chunk'
+OUTPUT = 'output'
+TRACE = 'trace'
+ATTRIBUTION = 'attribution'
+INPUT_REQUEST = 'input_request'
+COMPLETION = 'completion'
+UNKNOWN = 'unknown'
+
+_slots = threading.BoundedSemaphore(FLOW_MAX_CONCURRENCY)
+_DONE = object()
+
+
+class FlowError(Exception):
+    pass
+
+
+class FlowTimeout(FlowError):
+    pass
+
+
+class FlowEvent:
+    """One event of the response stream; `raw` is the event as boto3 returned it."""
+    __slots__ = ('kind', 'text', 'node_name', 'document', 'raw')
+
+    def __init__(self, kind, raw, text=None, node_name=None, document=None):
+        self.kind = kind
+        self.raw = raw
+        self.text = text
+        self.node_name = node_name
+        self.document = document
+
+    def __repr__(self):
+        return f"FlowEvent({self.kind!r}, node_name={self.node_name!r})"
+
+
+def parse_event(event: dict) -> FlowEvent:
+    if 'chunk' in event:
+        return FlowEvent(CHUNK, event, text=event['chunk']['bytes'].decode('utf-8'))
+    if 'flowOutputEvent' in event:
+        output = event['flowOutputEvent']
+        return FlowEvent(OUTPUT, output, node_name=output.get('nodeName'),
+                         document=output.get('content', {}).get('document'))
+    if 'flowCompletionEvent' in event:
+        return FlowEvent(COMPLETION, event['flowCompletionEvent'],
+                         text=event['flowCompletionEvent'].get('completionReason'))
+    if 'flowTraceEvent' in event or 'trace' in event:
+        return FlowEvent(TRACE, event.get('flowTraceEvent', event.get('trace')))
+    if 'attribution' in event:
+        return FlowEvent(ATTRIBUTION, event['attribution'])
+    if 'flowMultiTurnInputRequestEvent' in event:
+        request = event['flowMultiTurnInputRequestEvent']
+        return FlowEvent(INPUT_REQUEST, request, node_name=request.get('nodeName'),
+                         document=request.get('content', {}).get('document'))
+    return FlowEvent(UNKNOWN, event)
+
+
+class FlowResult:
+    __slots__ = ('text', 'outputs', 'completion_reason', 'attempts')
+
+    def __init__(self, text, outputs, completion_reason, attempts):
+        self.text = text
+        self.outputs = outputs
+        self.completion_reason = completion_reason
+        self.attempts = attempts
+
+
+def backoff(attempt: int) -> float:
+    """Full jitter: uniform in [0, min(max, base * 2^attempt)]."""
+    return random.uniform(0, min(FLOW_BACKOFF_MAX, FLOW_BACKOFF_BASE * 2 ** attempt))
+
+
+def _retryable(error: Exception) -> bool:
+    # Reading the event stream raises urllib3's errors (e.g. a read timeout) as they are
+    if isinstance(error, (ConnectionError, HTTPClientError, StreamReadError)):
+        return True
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code', '')
+        return code[:1].upper() + code[1:] in RETRYABLE_CODES
+    return False
+
+
+class FlowClient:
+    """
+    `client` is anything with boto3's invoke_flow; by default the shared
+    bedrock-agent-runtime client of aws_clients. `executor` runs the blocking
+    streams of aevents/ainvoke; None is the event loop's default executor.
+    """
+
+    def __init__(self, client=None, timeout=FLOW_TIMEOUT, retries=FLOW_RETRIES, executor=None):
+        if client is None:
+            import aws_clients
+            client = aws_clients.lazy('bedrock-agent-runtime', AWS_REGION, FLOW_ENDPOINT_URL,
+                                      **CLIENT_CONFIG)
+        self.client = client
+        self.timeout = timeout
+        self.retries = retries
+        self.executor = executor
+
+    def events(self, flow_id, alias_id, document, input_node='FlowInputNode',
+               timeout=None, enable_trace=False, attempts=None):
+        """
+        Iterates the FlowEvents of one invocation. `attempts`, a list, gets the
+        number of attempts made appended when the call ends.
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        if not _slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            raise FlowTimeout(f"no flow slot free within the deadline for {flow_id}")
+        items = queue.Queue()
+        stop = threading.Event()
+
+        def pump():
+            # Keeps the slot until its stream is closed, even after the
+            # caller has given up on it
+            tally = [0]
+            stream = self._events(flow_id, alias_id, document, input_node, deadline,
+                                  enable_trace, tally)
+            try:
+                for event in stream:
+                    if stop.is_set():
+                        return
+                    items.put(event)
+                result = _DONE
+            except Exception as e:
+                result = e
+            finally:
+                stream.close()
+                _slots.release()
+                if attempts is not None:
+                    attempts.append(tally[0])
+            items.put(result)
+
+        threading.Thread(target=pump, daemon=True).start()
+        try:
+            while True:
+                try:
+                    item = items.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    raise FlowTimeout(f"flow {flow_id} passed its deadline") from None
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+    def _events(self, flow_id, alias_id, document, input_node, deadline, enable_trace, tally):
+        attempt = 0
+        while True:
+            tally[0] = attempt + 1
+            delivered = False
+            stream = None
+            try:
+                response = self.client.invoke_flow(
+                    flowIdentifier=flow_id,
+                    flowAliasIdentifier=alias_id,
+                    inputs=[{
+                        'content': {'document': document},
+                        'nodeName': input_node,
+                        'nodeOutputName': 'document',
+                    }],
+                    enableTrace=enable_trace)
+                stream = response.get('responseStream')
+                if stream is None:
+                    raise FlowError(f"no response stream from flow {flow_id}")
+                for event in stream:
+                    if time.monotonic() > deadline:
+                        raise FlowTimeout(f"flow {flow_id} passed its deadline")
+                    delivered = True
+                    yield parse_event(event)
+                return
+            except FlowError:
+                raise
+            except Exception as e:
+                # Events already handed out cannot be taken back, so only a
+                # call that produced nothing is repeated
+                if delivered or not _retryable(e) or attempt >= self.retries:
+                    raise FlowError(f"flow {flow_id} failed after {attempt + 1} attempts: "
+                                    f"{e}") from e
+                delay = backoff(attempt)
+                if time.monotonic() + delay > deadline:
+                    raise FlowTimeout(f"flow {flow_id} passed its deadline while retrying: "
+                                      f"{e}") from e
+                print(f"Flow {flow_id} attempt {attempt + 1} failed ({e}), "
+                      f"retrying in {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+            finally:
+                if stream is not None and hasattr(stream, 'close'):
+                    stream.close()
+
+    def invoke(self, flow_id, alias_id, document, on_event=None, **kwargs) -> FlowResult:
+        """
+        Drains one invocation, calling `on_event(event)` for each FlowEvent.
+        The text is the chunks and output documents in arrival order.
+        """
+        parts = []
+        outputs = []
+        reason = None
+        attempts = []
+        for event in self.events(flow_id, alias_id, document, attempts=attempts, **kwargs):
+            if on_event is not None:
+                on_event(event)
+            if event.kind == CHUNK:
+                parts.append(event.text)
+            elif event.kind == OUTPUT:
+                outputs.append((event.node_name, event.document))
+                parts.append(event.document if isinstance(event.document, str)
+                             else json.dumps(event.document, ensure_ascii=False))
+            elif event.kind == COMPLETION:
+                reason = event.text
+        return FlowResult(''.join(parts), outputs, reason, attempts[0])
+
+    async def aevents(self, flow_id, alias_id, document, **kwargs):
+        """
+        Async iterator over the FlowEvents of one invocation. The blocking
+        stream is read on `executor`.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            # The consumer may be gone, and its loop closed, by now
+            if not stop.is_set():
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+
+        def pump():
+            try:
+                for event in self.events(flow_id, alias_id, document, **kwargs):
+                    if stop.is_set():
+                        break  # closes the stream and frees the slot
+                    put(event)
+                put(done)
+            except Exception as e:
+                put(e)
+
+        loop.run_in_executor(self.executor, pump)
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+    async def ainvoke(self, flow_id, alias_id, document, **kwargs) -> FlowResult:
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, lambda: self.invoke(flow_id, alias_id, document, **kwargs))
@@ -0,0 +1,138 @@
+import os
+import threading
+from concurrent import futures
+from functools import partial
+
+import metrics
+
+FLOW_WORKERS = int(os.environ.get('FLOW_WORKERS', 4))
+
+executor = futures.ThreadPoolExecutor(max_workers=FLOW_WORKERS)
+
+
+class Cancelled(Exception):
+    """Raised inside a follow-up call whose flow output was superseded."""
+
+
+class FlowJob:
+    __slots__ = ('index', 'key', 'future', 'cancel_event', 'deltas',
+                 'forwarded', 'finished')
+
+    def __init__(self, index, key):
+        self.index = index
+        self.key = key
+        self.future = None
+        self.cancel_event = threading.Event()
+        self.deltas = []
+        self.forwarded = 0
+        self.finished = False
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+
+class FlowOutputDispatcher:
+    """
+    Runs the follow-up call for each flowOutputEvent on a worker thread so the
+    flow's response stream keeps draining.
+
+    With `on_text`, the follow-up calls stream and their text deltas are
+    forwarded in dispatch order: a job streams live once every earlier job has
+    finished. Without it, the calls run on their non-streaming path.
+
+    `supersedes` maps a node name to the node names it makes unnecessary;
+    dispatching it cancels those jobs and drops their results. Since text that
+    was voiced cannot be taken back, the text of a job that may still be
+    superseded is held until `close()` says no more outputs will come. When the
+    flow fails, `abort()` cancels the jobs instead.
+    """
+
+    def __init__(self, on_text=None, supersedes=None):
+        self.on_text = on_text
+        self.supersedes = supersedes or {}
+        self.jobs = []
+        self.closed = False
+        self._provisional = set().union(*self.supersedes.values())
+        self._head = 0
+        self._lock = threading.Lock()
+
+    def dispatch(self, key, fn, **kwargs) -> FlowJob:
+        job = FlowJob(len(self.jobs), key)
+        for earlier in self.jobs:
+            if earlier.key in self.supersedes.get(key, ()):
+                self.cancel(earlier)
+        with self._lock:
+            self.jobs.append(job)
+        if self.on_text is not None:
+            kwargs['on_text'] = partial(self._on_job_text, job)
+        job.future = metrics.submit(executor, self._run, job, fn, kwargs)
+        return job
+
+    def close(self):
+        """No more outputs will be dispatched; releases the held text."""
+        with self._lock:
+            self.closed = True
+            self._pump()
+
+    def abort(self):
+        """
+        The flow failed: cancels every job whose text was not fully forwarded,
+        so nothing more reaches `on_text` for this turn.
+        """
+        with self._lock:
+            pending = self.jobs[self._head:]
+            for job in pending:
+                job.cancel_event.set()
+            self.closed = True
+            self._pump()
+        for job in pending:
+            job.future.cancel()
+
+    def cancel(self, job: FlowJob):
+        print(f"Cancelling superseded flow output: {job.key}")
+        with self._lock:
+            job.cancel_event.set()
+            self._pump()
+        job.future.cancel()
+
+    def _run(self, job, fn, kwargs):
+        try:
+            return fn(**kwargs)
+        finally:
+            with self._lock:
+                job.finished = True
+                self._pump()
+
+    def _on_job_text(self, job, delta):
+        if job.cancelled:
+            raise Cancelled(job.key)
+        with self._lock:
+            job.deltas.append(delta)
+            self._pump()
+
+    def _pump(self):
+        # Called with the lock held
+        while self._head < len(self.jobs):
+            job = self.jobs[self._head]
+            if not job.cancelled and job.key in self._provisional and not self.closed:
+                break
+            if not job.cancelled and self.on_text is not None:
+                while job.forwarded < len(job.deltas):
+                    self.on_text(job.deltas[job.forwarded])
+                    job.forwarded += 1
+            if not (job.finished or job.cancelled):
+                break
+            self._head += 1
+
+    def result(self, job: FlowJob):
+        """Returns the result of a job, or None if it was cancelled."""
+        if job.cancelled:
+            return None
+        try:
+            return job.future.result()
+        except (Cancelled, futures.CancelledError):
+            return None
+
+    def wait(self):
+        futures.wait([job.future for job in self.jobs])
@@ -0,0 +1,204 @@
+"""
+Local HTTP server speaking the InvokeFlow wire protocol (REST-JSON request,
+application/vnd.amazon.eventstream response), so the real boto3 client and
+flow_client.py can be exercised without AWS: retries on throttling, in-stream
+exceptions, slow streams and deadlines.
+
+Usage:
+    python flow_fake_server.py [--port 8765] [--throttle 0.2] [--delay-ms 300]
+
+and point the flow tools at it:
+
+    FLOW_ENDPOINT_URL=http://127.0.0.1:8765 python ../flow/sales_agent.py
+"""
+import argparse
+import json
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import replay_fakes
+
+_PATH = re.compile(r'^/flows/([^/]+)/aliases/([^/]+)$')
+_STRING = 7  # event-stream header value type
+
+
+def encode_message(headers: dict, payload: bytes) -> bytes:
+    """One event-stream message: prelude, headers, payload and CRC32s."""
+    encoded = b''.join(
+        struct.pack('B', len(name)) + name.encode('utf-8')
+        + struct.pack('>BH', _STRING, len(value)) + value.encode('utf-8')
+        for name, value in headers.items())
+    total = 12 + len(encoded) + len(payload) + 4
+    prelude = struct.pack('>II', total, len(encoded))
+    prelude += struct.pack('>I', zlib.crc32(prelude))
+    message = prelude + encoded + payload
+    return message + struct.pack('>I', zlib.crc32(message))
+
+
+def event_message(event_type: str, body: dict) -> bytes:
+    return encode_message({':message-type': 'event', ':event-type': event_type,
+                           ':content-type': 'application/json'},
+                          json.dumps(body, ensure_ascii=False).encode('utf-8'))
+
+
+def exception_message(exception_type: str, message: str) -> bytes:
+    return encode_message({':message-type': 'exception', ':exception-type': exception_type,
+                           ':content-type': 'application/json'},
+                          json.dumps({'message': message}).encode('utf-8'))
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Many callers connect at once; the default backlog of 5 resets some
+    request_queue_size = 256
+
+
+class FakeFlowServer:
+    """
+    `flows` maps a flow id to a function from the input document to output
+    node names, as for replay_fakes.FakeBedrockAgentRuntime. `throttle` is the
+    probability that a request is answered 429 ThrottlingException,
+    `stream_error` the probability that an accepted stream fails with an
+    in-stream throttlingException before its first event. Delays are in
+    seconds.
+    """
+
+    def __init__(self, flows=None, throttle=0.0, stream_error=0.0, first_event_delay=0.0,
+                 between_events=0.0, seed=0, port=0):
+        self.flows = flows or {}
+        self.throttle = throttle
+        self.stream_error = stream_error
+        self.first_event_delay = first_event_delay
+        self.between_events = between_events
+        self.requests = 0
+        self.throttled = 0
+        self.active = 0
+        self.max_active = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = _HTTPServer(('127.0.0.1', port), self._handler_class())
+        self._thread = None
+
+    @property
+    def endpoint_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def client(self, **config):
+        """A real bedrock-agent-runtime client for this server, botocore retries off."""
+        import boto3
+        from botocore.config import Config
+
+        config.setdefault('retries', {'mode': 'standard', 'total_max_attempts': 1})
+        return boto3.client('bedrock-agent-runtime', region_name='us-west-2',
+                            endpoint_url=self.endpoint_url, aws_access_key_id='fake',
+                            aws_secret_access_key='fake', config=Config(**config))
+
+    def _roll(self, probability) -> bool:
+        with self._lock:
+            return self._random.random() < probability
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                match = _PATH.match(self.path)
+                with server._lock:
+                    server.requests += 1
+                if match is None:
+                    return self._error(404, 'ResourceNotFoundException', 'unknown path')
+                if server._roll(server.throttle):
+                    with server._lock:
+                        server.throttled += 1
+                    return self._error(429, 'ThrottlingException', 'Rate exceeded')
+                with server._lock:
+                    server.active += 1
+                    server.max_active = max(server.max_active, server.active)
+                try:
+                    self._stream(match.group(1), body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client gave up on the stream, e.g. its deadline passed
+                finally:
+                    with server._lock:
+                        server.active -= 1
+
+            def _error(self, status, code, message):
+                payload = json.dumps({'message': message}).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('x-amzn-ErrorType', code)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, flow_id, body):
+                document = body['inputs'][0]['content']['document']
+                if not isinstance(document, str):
+                    document = json.dumps(document, ensure_ascii=False)
+                nodes = server.flows.get(flow_id, replay_fakes.stage_1_nodes)(document)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/vnd.amazon.eventstream')
+                self.send_header('x-amz-bedrock-flow-execution-id', 'fake-execution')
+                self.end_headers()
+                # HTTP/1.0: the body ends when the connection closes
+                time.sleep(server.first_event_delay)
+                if server._roll(server.stream_error):
+                    with server._lock:
+                        server.throttled += 1
+                    self.wfile.write(exception_message('throttlingException',
+                                                       'Rate exceeded in stream'))
+                    return
+                for index, node in enumerate(nodes):
+                    self.wfile.write(event_message('flowOutputEvent', {
+                        'nodeName': node, 'nodeType': 'Output',
+                        'content': {'document': f"{node} 的檢索結果：鴕鳥龜鹿精、葉黃素、果膠"}}))
+                    self.wfile.flush()
+                    if index < len(nodes) - 1:
+                        time.sleep(server.between_events)
+                self.wfile.write(event_message('flowCompletionEvent',
+                                               {'completionReason': 'SUCCESS'}))
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--throttle', type=float, default=0.0)
+    parser.add_argument('--stream-error', type=float, default=0.0)
+    parser.add_argument('--delay-ms', type=float, default=300)
+    args = parser.parse_args()
+    fake = FakeFlowServer(throttle=args.throttle, stream_error=args.stream_error,
+                          first_event_delay=args.delay_ms / 1000, port=args.port)
+    print(f"Fake flow endpoint on {fake.endpoint_url}")
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,187 @@
+"""
+Local purchase-intent classifier for Stage 2 (buy / not buy).
+
+Normalized keyword and negation rules answer the clear utterances; a logistic
+regression over hashed character n-grams, trained on intent_data/train.tsv,
+answers the rest when it is confident. Everything else is left to the remote
+is_buy flow.
+
+Usage:
+    python intent.py "好，幫我下單"
+"""
+import os
+import re
+import sys
+import unicodedata
+import zlib
+
+import numpy as np
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intent_data')
+# Model probability needed to answer without the remote flow
+INTENT_MIN_CONFIDENCE = float(os.environ.get('INTENT_MIN_CONFIDENCE', 0.9))
+FEATURE_DIM = 2048
+EPOCHS = 300
+LEARNING_RATE = 0.5
+L2 = 1e-3
+
+BUY = 'buy'
+NOT_BUY = 'not_buy'
+
+# Simplified forms Transcribe sometimes returns
+_SIMPLIFIED = str.maketrans('买单订结账购虑还这个吧么给帮来没问题价钱贵别说时间觉', '買單訂結帳購慮還這個吧麼給幫來沒問題價錢貴別說時間覺')
+_IGNORED = re.compile(r'[\s，。？！、,.?!:：;；"“”\'‘’~～…]+')
+
+BUY_PHRASES = ('我要買', '要購買', '買一', '買兩', '買三', '買五', '下單', '訂購', '幫我訂', '幫我下',
+               '結帳', '付款', '刷卡', '成交', '就這個', '就買', '來一', '來兩', '我要一盒', '我要一組',
+               '我要一瓶', '我要兩', '我要訂', '我要這', '寄給我', '怎麼付', '要下訂', '給我一盒',
+               '給我一組', '給我一瓶')
+# Buy phrases that only count at the end of the utterance: "好吧，我買", but
+# not "我買不起" or "家裡已經買了"
+BUY_ENDINGS = ('我買', '決定買了', '就買了')
+DECLINE_PHRASES = ('考慮', '再看看', '再想想', '想一想', '不需要', '不用了', '不要了', '沒興趣',
+                   '沒有興趣', '不感興趣', '太貴', '下次', '以後再', '改天', '先這樣', '不買',
+                   '不要買', '算了', '再說', '不考慮', '商量', '問問家人', '不必了', '掛了',
+                   '買不起', '買不了', '付不起', '一點時間', '已經買了', '買過了', '別家')
+# A negation before a buy phrase turns it into a decline; FILLERS may stand
+# between them, as in "不用幫我下單"
+NEGATIONS = ('不', '沒', '別', '先不', '還不', '不想', '不會', '暫時不', '不打算', '不太想', '不讓',
+             '不准', '不用', '不必', '不需要')
+FILLERS = ('幫我', '給我', '替我', '要', '想', '再')
+# Questions and hedges need the conversation, not a keyword
+HEDGES = ('嗎', '多少', '怎麼', '什麼', '有沒有', '可不可以', '能不能', '會不會', '如果', '要是',
+          '但是', '可是', '不過', '幾', '哪')
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize('NFKC', text).lower().translate(_SIMPLIFIED)
+    return _IGNORED.sub('', text)
+
+
+def _negated(text, start):
+    before = text[:start]
+    for filler in FILLERS:
+        if before.endswith(filler):
+            before = before[:-len(filler)]
+            break
+    return before.endswith(NEGATIONS)
+
+
+def hedged(text: str) -> bool:
+    return any(word in text for word in HEDGES)
+
+
+def rule_label(text: str):
+    """BUY / NOT_BUY when a keyword rule is unambiguous, else None."""
+    buy = decline = False
+    for phrase in BUY_PHRASES:
+        start = text.find(phrase)
+        while start != -1:
+            if _negated(text, start):
+                decline = True
+            else:
+                buy = True
+            start = text.find(phrase, start + 1)
+    for phrase in BUY_ENDINGS:
+        if text.endswith(phrase):
+            if _negated(text, len(text) - len(phrase)):
+                decline = True
+            else:
+                buy = True
+    decline = decline or any(phrase in text for phrase in DECLINE_PHRASES)
+    if buy == decline:
+        return None
+    return BUY if buy else NOT_BUY
+
+
+def features(text: str):
+    # Hashed character unigrams, bigrams and trigrams of the normalized text
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    grams.update(text[i:i + 3] for i in range(len(text) - 2))
+    return [zlib.crc32(gram.encode('utf-8')) % FEATURE_DIM for gram in grams]
+
+
+class IntentModel:
+    """Logistic regression for P(buy) over `features`."""
+
+    def __init__(self, weights=None, bias=0.0):
+        self.weights = weights if weights is not None else np.zeros(FEATURE_DIM, dtype=np.float64)
+        self.bias = bias
+
+    @classmethod
+    def train(cls, examples, epochs=EPOCHS, learning_rate=LEARNING_RATE, l2=L2):
+        """`examples` is [(text, label)] with labels BUY / NOT_BUY."""
+        x = np.zeros((len(examples), FEATURE_DIM), dtype=np.float64)
+        y = np.zeros(len(examples), dtype=np.float64)
+        for row, (text, label) in enumerate(examples):
+            x[row, features(normalize(text))] = 1.0
+            y[row] = label == BUY
+        model = cls()
+        for _ in range(epochs):
+            p = 1 / (1 + np.exp(-(x @ model.weights + model.bias)))
+            error = p - y
+            model.weights -= learning_rate * (x.T @ error / len(y) + l2 * model.weights)
+            model.bias -= learning_rate * error.mean()
+        return model
+
+    def probability(self, normalized_text: str) -> float:
+        z = self.weights[features(normalized_text)].sum() + self.bias
+        return float(1 / (1 + np.exp(-z)))
+
+
+class Intent:
+    __slots__ = ('label', 'confidence', 'source')
+
+    def __init__(self, label, confidence, source):
+        self.label = label  # BUY, NOT_BUY or None when the remote flow has to decide
+        self.confidence = confidence
+        self.source = source  # 'rule', 'model' or 'ambiguous'
+
+    def __repr__(self):
+        return f"Intent({self.label}, {self.confidence:.2f}, {self.source})"
+
+
+def load_examples(path):
+    """Tab-separated `label<TAB>utterance` lines; '#' starts a comment."""
+    examples = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            label, text = line.split('\t', 1)
+            examples.append((text, label))
+    return examples
+
+
+_model = None
+
+
+def get_model():
+    global _model
+    if _model is None:
+        examples = load_examples(os.path.join(DATA_DIR, 'train.tsv'))
+        _model = IntentModel.train([(text, label) for text, label in examples
+                                    if label in (BUY, NOT_BUY)])
+    return _model
+
+
+def classify(utterance: str, model=None, min_confidence=INTENT_MIN_CONFIDENCE) -> Intent:
+    text = normalize(utterance)
+    if not text or hedged(text):
+        return Intent(None, 0.0, 'ambiguous')
+    label = rule_label(text)
+    if label is not None:
+        return Intent(label, 1.0, 'rule')
+    p = (model or get_model()).probability(text)
+    if p >= min_confidence:
+        return Intent(BUY, p, 'model')
+    if 1 - p >= min_confidence:
+        return Intent(NOT_BUY, 1 - p, 'model')
+    return Intent(None, max(p, 1 - p), 'ambiguous')
+
+
+if __name__ == "__main__":
+    for utterance in sys.argv[1:]:
+        print(utterance, classify(utterance))
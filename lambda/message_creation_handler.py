@@ -1,17 +1,23 @@
 from datetime import datetime
-import psycopg2
-import boto3
-import uuid
-import numpy as np
 import json
-import wave
-import io
-
-DB_HOST = ''
-DB_PORT = 5432
-DB_NAME = ''
-DB_USER = ''
-DB_PASS = ''
+import os
+import time
+from concurrent import futures
+
+import audio_output
+import aws_clients
+import context_store
+import db
+import flow_client
+import flow_dispatch
+import metrics
+import rollups
+import summaries
+import tts_cache
+import tts_stream
+import tts_text
+# intent, recommender and retrieval pull in numpy and load their models; they
+# are imported by the turns that use them, or by prewarm()
 
 # Bedrock
 AWS_REGION = "us-west-2"  # e.g., 'us-east-1', 'us-west-2', etc.
@@ -20,61 +26,149 @@ AGENT_ALIAS_ID = "KJO2KVHJO3"  # Replace with your Agent's Alias ID (often TSTAL
 
 # Polly
 VOICE_ID = 'Zhiyu'  # Mandarin Chinese female voice
-OUTPUT_FORMAT = 'pcm'  # raw audio format
+OUTPUT_FORMAT = audio_output.POLLY_FORMAT  # see AUDIO_FORMAT
 SAMPLE_RATE = 16000  # 16kHz
 CHANNELS = 1
 
 AGENT_ID_2= "8VDFS209D6"
 AGENT_ALIAS_ID_2 = "BE8FSGGFGL"
 
+# Skip the Stage 1 questioning when the customer's tags already pick a product
+LOCAL_RECOMMEND = os.environ.get('LOCAL_RECOMMEND', '1') != '0'
+
+# Answer clear buy / not-buy replies in Stage 2 without the is_buy flow
+LOCAL_INTENT = os.environ.get('LOCAL_INTENT', '1') != '0'
+
+# Overlap the DB writes with the flow call and the audio upload
+PARALLEL_STEPS = os.environ.get('PARALLEL_STEPS', '1') != '0'
+
+# Concurrent Polly requests for the chunks of long answers, across all turns
+POLLY_WORKERS = int(os.environ.get('POLLY_WORKERS', 4))
+
 # S3
 BUCKET_NAME = "voice-agent-file"
+CDN_URL = "https://d18bgxx0d319kq.cloudfront.net"
 
-# ---- INIT CLIENT ----
-polly = boto3.client('polly', region_name=AWS_REGION)
-s3 = boto3.client('s3', region_name=AWS_REGION)
+# Do the first turn's setup during init instead (see prewarm)
+PREWARM = os.environ.get('PREWARM', '0') != '0'
 
-try:
-    bedrock_agent_runtime_client = boto3.client('bedrock-agent-runtime',
-                                                region_name=AWS_REGION)
-    bedrock_llm_runtime = boto3.client('bedrock-runtime',
-                                       region_name=AWS_REGION)
-except Exception as e:
-    raise e
+# ---- INIT CLIENT ----
+# Created on first use and kept for the life of the container
+polly = aws_clients.lazy('polly', AWS_REGION)
+s3 = aws_clients.lazy('s3', AWS_REGION)
+bedrock_agent_runtime_client = aws_clients.lazy('bedrock-agent-runtime', AWS_REGION,
+                                                flow_client.FLOW_ENDPOINT_URL,
+                                                **flow_client.CLIENT_CONFIG)
+bedrock_llm_runtime = aws_clients.lazy('bedrock-runtime', AWS_REGION)
+
+voice_cache = tts_cache.AudioCache(s3, BUCKET_NAME, extension=audio_output.EXTENSION)
+db_executor = futures.ThreadPoolExecutor(max_workers=1)
+polly_executor = futures.ThreadPoolExecutor(max_workers=POLLY_WORKERS)
+
+
+@metrics.timed('polly.synthesize')
+def synthesize_chunk(ssml: str, read: bool = False):
+    response = polly.synthesize_speech(Text=ssml,
+                                       TextType='ssml',
+                                       OutputFormat=OUTPUT_FORMAT,
+                                       VoiceId=VOICE_ID,
+                                       SampleRate=str(SAMPLE_RATE))
+    return response['AudioStream'].read() if read else response['AudioStream']
 
 
+@metrics.timed('tts')
 def gen_voice(text):
+    # Markdown stripped, numbers spelled out, split into SSML chunks. Formats
+    # that cannot be joined are synthesized in one request, as far as Polly
+    # takes; longer answers need AUDIO_SEGMENTED
+    if audio_output.CONCATENABLE:
+        chunks = tts_text.ssml_chunks(text)
+    else:
+        chunks = tts_text.ssml_chunks(text, tts_text.POLLY_MAX_CHARS)
+        if len(chunks) > 1:
+            print(f"Warning: {audio_output.AUDIO_FORMAT} answer over "
+                  f"{tts_text.POLLY_MAX_CHARS} characters, only the first part is voiced")
+            chunks = chunks[:1]
+    if not chunks:
+        return None
+
+    # ---- CHECK CACHE ----
+    # Keyed by what is spoken, so answers differing only in markup share audio
+    cache_key = tts_cache.cache_key(''.join(chunks), VOICE_ID, OUTPUT_FORMAT, SAMPLE_RATE)
+    with metrics.span('tts.cache_lookup'):
+        filename = voice_cache.lookup(cache_key, text)
+    if filename is not None:
+        return f"{CDN_URL}/{filename}"
+    started = time.perf_counter()
 
     # ---- CALL POLLY ----
-    response = polly.synthesize_speech(Text=text,
-                                       OutputFormat=OUTPUT_FORMAT,
-                                       VoiceId=VOICE_ID,
-                                       SampleRate=str(SAMPLE_RATE))
+    # Chunks are synthesized concurrently and joined in order
+    if len(chunks) == 1:
+        parts = [synthesize_chunk(chunks[0])]
+    else:
+        parts = [future.result() for future in
+                 [metrics.submit(polly_executor, synthesize_chunk, chunk, read=True)
+                  for chunk in chunks]]
 
     # ---- UPLOAD TO S3 ----
-    # audio_stream = response['AudioStream']
-    pcm_audio = response['AudioStream'].read()
-
-    # filename = f"{uuid.uuid4()}.wav"
-    # s3.upload_fileobj(Fileobj=audio_stream, Bucket=BUCKET_NAME, Key=filename)
-    # ---- CONVERT PCM to WAV ----
-    wav_io = io.BytesIO()
-    with wave.open(wav_io, 'wb') as wav_file:
-        wav_file.setnchannels(CHANNELS)
-        wav_file.setsampwidth(2)  # 16-bit PCM = 2 bytes
-        wav_file.setframerate(SAMPLE_RATE)
-        wav_file.writeframes(pcm_audio)
-
-    wav_io.seek(0)  # Reset pointer to start
-    # ---- UPLOAD TO S3 ----
-    filename = f"{uuid.uuid4()}.wav"
-    s3.upload_fileobj(Fileobj=wav_io, Bucket=BUCKET_NAME, Key=filename)
+    # Compressed audio is streamed from Polly to S3; PCM gets a WAV header
+    with metrics.span('audio.encode'):
+        body = audio_output.upload_body(parts, SAMPLE_RATE, CHANNELS)
+    filename = voice_cache.object_key(cache_key)
+    with metrics.span('s3.upload'):
+        s3.upload_fileobj(Fileobj=body, Bucket=BUCKET_NAME, Key=filename,
+                          ExtraArgs={'ContentType': audio_output.CONTENT_TYPE})
+    voice_cache.store(cache_key, filename, elapsed=time.perf_counter() - started)
 
     # ---- GENERATE PUBLIC URL ----
-    return f"https://d18bgxx0d319kq.cloudfront.net/{filename}"
+    return f"{CDN_URL}/{filename}"
+
+
+def prewarm_voice_cache():
+    # Fixed answers are synthesized once and then always served from the cache
+    return [gen_voice(text) for text in (finish(), FAREWELL)]
 
 
-def call_llm(prompt: str) -> str:
+def prewarm():
+    """
+    Does the setup of a cold first turn ahead of time: the AWS clients, the
+    local models, the database pool and the cached fixed answers. Runs during
+    init with PREWARM=1, or for an invocation with {"warmup": true} such as a
+    scheduled ping. A step that fails is reported and left to the first turn.
+    Returns the seconds spent per step.
+    """
+    def models():
+        if LOCAL_RECOMMEND:
+            import recommender
+            recommender.get_recommender()
+        if LOCAL_INTENT:
+            import intent
+            import retrieval
+            intent.get_model()
+            retrieval.get_retriever()
+        import profile_store
+        profile_store.get_store()
+
+    def clients():
+        for client in (polly, s3, bedrock_agent_runtime_client, bedrock_llm_runtime):
+            if isinstance(client, aws_clients.LazyClient):
+                client.resolve()
+
+    timings = {}
+    for name, step in (('clients', clients), ('models', models), ('db', db.get_pool),
+                       ('voice_cache', prewarm_voice_cache)):
+        started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            print(f"Prewarm {name} failed: {e}")
+        timings[name] = time.perf_counter() - started
+    print(f"Prewarm: {timings}")
+    return timings
+
+
+@metrics.timed('llm')
+def call_llm(prompt: str, on_text=None) -> str:
     body = {
         "anthropic_version": "bedrock-2023-05-31",
         "messages": [{
@@ -91,13 +185,43 @@ def call_llm(prompt: str) -> str:
         "accept": "*/*",
         "body": json.dumps(body)
     }
+    if on_text is not None:
+        return call_llm_stream(arguments, on_text)
+
     response = bedrock_llm_runtime.invoke_model(**arguments)
     response_body = json.loads(response.get('body').read())
     print(f"RESPONSE: {response_body}")
     return response_body['content'][0]['text']
 
+
+def call_llm_stream(arguments, on_text) -> str:
+    # Same request as call_llm, but every text delta is handed to on_text as
+    # soon as it arrives.
+    started = time.perf_counter()
+    response = bedrock_llm_runtime.invoke_model_with_response_stream(**arguments)
+    body = response.get('body')
+    parts = []
+    try:
+        for event in metrics.first_item(body, 'llm.first_chunk', started):
+            if 'chunk' not in event:
+                continue
+            payload = json.loads(event['chunk']['bytes'])
+            if payload.get('type') != 'content_block_delta':
+                continue
+            text = payload['delta'].get('text', '')
+            if text:
+                parts.append(text)
+                # on_text raises flow_dispatch.Cancelled to abandon the call
+                on_text(text)
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    answer = ''.join(parts)
+    print(f"RESPONSE: {answer}")
+    return answer
+
 ### STAGE 1
-def follow_up_metadata_question(all_conversation: str, text: str) -> str:
+def follow_up_metadata_question(all_conversation: str, text: str, on_text=None) -> str:
     system_prompt = "You are a friendly and helpful sales agent engaging a potential customer. Your goal is to gather specific metadata points through natural and engaging conversation. You will receive a list of desired metadata and a history of the conversation so far. Your task is to generate the next logical and sales-oriented question to ask the user, aiming to collect one or more pieces of metadata. Ensure the question flows naturally from the previous turn in the conversation and maintains a positive and encouraging tone. Output ONLY the next question you would ask."
     user_prompt = f"""
         Conversation History: {all_conversation}
@@ -106,220 +230,328 @@ def follow_up_metadata_question(all_conversation: str, text: str) -> str:
         Next Question: 
     """
     prompt = f"{system_prompt} \n {user_prompt}"
-    return call_llm(prompt=prompt)
+    return call_llm(prompt=prompt, on_text=on_text)
 
 
-def recommend_product(all_conversation: str, text: str) -> str:
+def recommend_product(all_conversation: str, text: str, on_text=None) -> str:
     system_prompt = "You are a helpful and enthusiastic sales assistant. Your role is to recommend products to customers based on their needs and the ongoing conversation. You will be provided with a list of products and their details, as well as the current conversation history. Your task is to generate the next conversational turn, focusing on recommending one or more products from the list. The recommendation should be relevant to the customer's previous statements, needs, or interests expressed in the conversation. Maintain a friendly and persuasive tone, highlighting the key features and benefits of the recommended product(s) and how they address the customer's needs. Only output the next conversational turn. Do not include any other text or headers."
     user_prompt = f"""
         Conversation History: {all_conversation}
         Product Details: {text}
     """
     prompt = f"{system_prompt} \n {user_prompt}"
-    return call_llm(prompt=prompt)
+    return call_llm(prompt=prompt, on_text=on_text)
 
 
-def parse_flow_opt(all_conversation: str, event):
+def parse_flow_opt(all_conversation: str, event, on_text=None):
 
     node_name = event['nodeName']
     if node_name == 'FlowOutputNode_2':
         text = event['content']['document']
-        return 2, recommend_product(text=text, all_conversation=all_conversation)
+        return 2, recommend_product(text=text, all_conversation=all_conversation,
+                                    on_text=on_text)
     elif node_name == 'FlowOutputNode_1':
         return 1, follow_up_metadata_question(all_conversation=all_conversation,
-                                           text=event['content']['document'])
-
-
-def invoke_rag_flow(prompt):
-
-    # try:
-    # Invoke the agent
-    response = bedrock_agent_runtime_client.invoke_flow(
-        flowIdentifier=AGENT_ID,
-        flowAliasIdentifier=AGENT_ALIAS_ID,
-        inputs=[
-            {
-                'content': {
-                    'document': prompt
-                },
-                "nodeName": "FlowInputNode",
-                "nodeOutputName": "document"
-            },
-        ],
-        enableTrace=
-        False  # Set to True to get detailed trace information (optional)
-    )
-
-    # Handle the streaming response
-    completion = ""
-    response_stream = response.get('responseStream')
-
-    if not response_stream:
-        print("Error: No completion stream found in the response.")
+                                           text=event['content']['document'],
+                                           on_text=on_text)
+
+
+# A recommendation makes a pending follow-up question unnecessary
+STAGE_1_SUPERSEDES = {'FlowOutputNode_2': {'FlowOutputNode_1'}}
+
+
+@metrics.timed('local.recommend')
+def local_recommendation(customer_id):
+    # Ranked products from the local recommender, or None when the customer is
+    # unknown or the ranking is not confident enough to skip Stage 1
+    if not LOCAL_RECOMMEND or customer_id is None:
+        return None
+    import recommender
+    engine = recommender.get_recommender()
+    if engine is None:
+        return None
+    ranking = engine.recommend(customer_id)
+    if not engine.is_confident(ranking):
         return None
+    print(f"Local recommendation for {customer_id}: "
+          f"{[(product.key, score) for product, score, _ in ranking]}")
+    return ranking
+
+
+@metrics.timed('flow.stage_1')
+def invoke_rag_flow(prompt, on_text=None, flow=None):
+    # Throttling and transient errors are retried by flow_client; anything
+    # else raises FlowError and fails the turn
+    started = time.perf_counter()
+    flow = flow or flow_client.FlowClient(bedrock_agent_runtime_client)
+    events = flow.events(AGENT_ID, AGENT_ALIAS_ID, prompt)
 
     print("Agent Response:")
     stage = 1
-    for event in response_stream:
-        if 'chunk' in event:
-            data = event['chunk']['bytes']
-            chunk_text = data.decode('utf-8')
-            print(chunk_text, end="")  # Print chunks as they arrive
-            completion += chunk_text
-        elif 'trace' in event:
-            # You can process trace information here if enableTrace=True
-            # print(json.dumps(event['trace'], indent=2))
-            pass
-        elif 'attribution' in event:
-            # You can process citation/attribution information here if available
-            # print("\n\n-----Attribution-----")
-            # print(json.dumps(event['attribution'], indent=2))
-            pass
-        elif 'flowOutputEvent' in event:
-            stage, opt = parse_flow_opt(all_conversation=prompt,event=event['flowOutputEvent'])
-            completion += opt
-        else:
-            print(f"\nWarning: Received unknown event type: {event}")
+    # Flow outputs are answered on worker threads while the stream drains;
+    # `parts` keeps chunks and pending jobs in arrival order.
+    dispatcher = flow_dispatch.FlowOutputDispatcher(on_text=on_text,
+                                                    supersedes=STAGE_1_SUPERSEDES)
+    parts = []
+    try:
+        for event in metrics.first_item(events, 'flow.stage_1.first_chunk', started):
+            if event.kind == flow_client.CHUNK:
+                print(event.text, end="")  # Print chunks as they arrive
+                parts.append(event.text)
+            elif event.kind == flow_client.OUTPUT:
+                parts.append(dispatcher.dispatch(event.node_name, parse_flow_opt,
+                                                 all_conversation=prompt, event=event.raw))
+            elif event.kind == flow_client.UNKNOWN:
+                print(f"\nWarning: Received unknown event type: {event.raw}")
+    except BaseException:
+        # A failed flow fails the turn; its follow-up calls must not keep talking
+        dispatcher.abort()
+        raise
+    dispatcher.close()
+
+    texts = []
+    for part in parts:
+        if isinstance(part, str):
+            texts.append(part)
+            continue
+        opt = dispatcher.result(part)
+        if opt is not None:
+            stage, text = opt
+            texts.append(text)
 
     print("\n--- End of Agent Response ---")
-    return stage, completion  # Return the full concatenated response
-
-# except boto3.exceptions.Boto3Error as e:
-#     print(f"AWS API Error: {e}")
-#     return None
-# except Exception as e:
-#     print(f"An unexpected error occurred: {e}")
-#     return None
+    return stage, "".join(texts)  # Return the full concatenated response
 
 
 ### STAGE 2
+# Stage 2 ends with the farewell after this many turns
+STAGE_2_MAX_TURNS = 5
+FAREWELL = "好的，我明白。如果您需要时间考虑，这完全没问题。如果您有任何其他问题，请随时联系我们。我很高兴能以任何方式提供帮助。感谢您今天花时间"
+
+
 def finish():
     return "好的！您不会后悔的。我将立即处理您的订单。谢谢您的致电，祝您愉快"
 
-def parse_flow_opt_2(all_conversation: str, event, count = 0 ): 
+def parse_flow_opt_2(all_conversation: str, event, count = 0, on_text=None): 
     print(f'EVENNT: {event}')
     node_name = event['nodeName']
     print(f'NODENAME 2: {node_name}')
     text = event["content"]["document"]
-    if count >= 5:
-        return "好的，我明白。如果您需要时间考虑，这完全没问题。如果您有任何其他问题，请随时联系我们。我很高兴能以任何方式提供帮助。感谢您今天花时间"
+    if count >= STAGE_2_MAX_TURNS:
+        return FAREWELL
     
     if node_name == "FlowOutputode_1":
-        return recommend_product(all_conversation=all_conversation, text = text)
+        return recommend_product(all_conversation=all_conversation, text = text,
+                                 on_text=on_text)
     else:
         return finish()
 
-def invoke_rag_flow_stage_2(prompt, count):
-    try:
-        response = bedrock_agent_runtime_client.invoke_flow(
-            flowIdentifier=AGENT_ID_2,
-            flowAliasIdentifier=AGENT_ALIAS_ID_2,
-            inputs=[
-                {
-                    'content': {
-                        'document': prompt
-                    },
-                    "nodeName": "FlowInputNode",
-                    "nodeOutputName": "document"
-                }
-            ],
-            enableTrace = False
-        )
-        
-        # Handle the streaming response
-        completion = ""
-        response_stream = response.get('responseStream')
-
-        
-        if not response_stream:
-            print("Error: No completion stream found in the response.")
-            return None
-
-        print("Agent Response:")
-        for event in response_stream:
-            if 'chunk' in event:
-                data = event['chunk']['bytes']
-                chunk_text = data.decode('utf-8')
-                print(chunk_text, end="")  # Print chunks as they arrive
-                completion += chunk_text
-            elif 'trace' in event:
-                # You can process trace information here if enableTrace=True
-                # print(json.dumps(event['trace'], indent=2))
-                pass
-            elif 'attribution' in event:
-                # You can process citation/attribution information here if available
-                # print("\n\n-----Attribution-----")
-                # print(json.dumps(event['attribution'], indent=2))
-                pass
-            elif 'flowOutputEvent' in event:
-                completion += parse_flow_opt_2(all_conversation=prompt,event=event['flowOutputEvent'], count=count)
-            else:
-                print(f"\nWarning: Received unknown event type: {event}")
-
-        print("\n--- End of Agent Response ---")
-        return completion  # Return the full concatenated response
-
-    except boto3.exceptions.Boto3Error as e:
-        print(f"AWS API Error: {e}")
+def local_stage_2(utterance, all_conversation, count, on_text=None):
+    # The Stage 2 answer decided locally, or None when the is_buy flow is needed
+    if count >= STAGE_2_MAX_TURNS:
+        return FAREWELL
+    if not LOCAL_INTENT:
         return None
+    import intent
+    import retrieval
+    with metrics.span('local.intent'):
+        result = intent.classify(utterance)
+    print(f"Local intent: {result}")
+    if result.label == intent.BUY:
+        return finish()
+    if result.label == intent.NOT_BUY:
+        details = retrieval.get_retriever().details(all_conversation)
+        return recommend_product(all_conversation=all_conversation, text=details,
+                                 on_text=on_text)
+    return None
+
+
+@metrics.timed('flow.stage_2')
+def invoke_rag_flow_stage_2(prompt, count, on_text=None, flow=None):
+    started = time.perf_counter()
+    flow = flow or flow_client.FlowClient(bedrock_agent_runtime_client)
+    events = flow.events(AGENT_ID_2, AGENT_ALIAS_ID_2, prompt)
+
+    print("Agent Response:")
+    dispatcher = flow_dispatch.FlowOutputDispatcher(on_text=on_text)
+    parts = []
+    try:
+        for event in metrics.first_item(events, 'flow.stage_2.first_chunk', started):
+            if event.kind == flow_client.CHUNK:
+                print(event.text, end="")  # Print chunks as they arrive
+                parts.append(event.text)
+            elif event.kind == flow_client.OUTPUT:
+                parts.append(dispatcher.dispatch(event.node_name, parse_flow_opt_2,
+                                                 all_conversation=prompt, event=event.raw,
+                                                 count=count))
+            elif event.kind == flow_client.UNKNOWN:
+                print(f"\nWarning: Received unknown event type: {event.raw}")
+    except BaseException:
+        dispatcher.abort()
+        raise
+    dispatcher.close()
+
+    completion = "".join(part if isinstance(part, str) else (dispatcher.result(part) or "")
+                         for part in parts)
+    print("\n--- End of Agent Response ---")
+    return completion  # Return the full concatenated response
+
+
+def answer_turn(content, prompt, stage, count, customer_id=None, on_text=None, flow=None,
+                profile=None):
+    """
+    Luna's answer to one customer message, for lambda_handler and
+    sessions.SessionManager alike. `prompt` is the rendered conversation
+    including the message. Stage 1 tries the local recommendation before the
+    sales flow, Stage 2 the local intent before the is_buy flow; flow outputs
+    are answered by the follow-up LLM calls. `flow` is the FlowClient to use
+    and `profile` text put ahead of the Stage 1 flow input. Returns (stage,
+    answer, outcome), outcome being rollups.PURCHASE or rollups.FAREWELL when
+    the answer ends the conversation, else None.
+    """
+    if stage == 2:
+        answer = local_stage_2(content, prompt, count, on_text=on_text)
+        if answer is None:
+            answer = invoke_rag_flow_stage_2(prompt, count=count, on_text=on_text, flow=flow)
+    else:
+        ranking = local_recommendation(customer_id)
+        if ranking:
+            import recommender
+            stage = 2
+            answer = recommend_product(all_conversation=prompt,
+                                       text=recommender.product_details(ranking, query=content),
+                                       on_text=on_text)
+        else:
+            document = prompt if profile is None else f"{profile}\n{prompt}"
+            stage, answer = invoke_rag_flow(document, on_text=on_text, flow=flow)
+    outcome = {finish(): rollups.PURCHASE, FAREWELL: rollups.FAREWELL}.get(answer)
+    return stage, answer, outcome
+
+
+INSERT_MESSAGE_QUERY = """
+    INSERT INTO message (conversation_id, username, content, created_at, updated_at)
+    VALUES (%s, %s, %s, %s, %s)
+    RETURNING id
+"""
+
+
+@metrics.timed('db.insert')
+def insert_message(cursor, conversation_id, username, content, now):
+    cursor.execute(INSERT_MESSAGE_QUERY,
+                   (conversation_id, username, content, now, now))
+    return cursor.fetchone()[0]
+
+
+def submit_db(fn, *args):
+    # Statements share one connection, so they run one at a time on a single
+    # worker, in submission order, while the caller moves on.
+    if PARALLEL_STEPS:
+        return metrics.submit(db_executor, fn, *args)
+    future = futures.Future()
+    try:
+        future.set_result(fn(*args))
     except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        return None
+        future.set_exception(e)
+    return future
 
 
 def lambda_handler(event, context):
+    if event.get("warmup"):
+        return {"warmup": prewarm()}
 
     content = event.get("content")
     conversation_id = event.get("conversationId")
     stage  = event.get("stage") if "stage" in event else None
+    requested_stage = stage
     count = event.get("count") if "count" in event else 0
+    customer_id = event.get("customerId")
+    # Streaming mode synthesizes the answer sentence by sentence while the
+    # model is still generating. With a `turnId` each segment is also published
+    # to a live playlist (audio_output.LivePlaylist) that the client polls
+    # during the turn, so playback does not wait for this response.
+    stream = event.get("stream", False)
+    turn_id = event.get("turnId")
+    # Per-turn span timings are added to the AI message when asked for
+    with_timing = event.get("timing", False)
+    trace = metrics.start_trace()
+    turn_started = time.perf_counter()
+    live = None
 
     try:
+        if turn_id is not None and (stream or audio_output.AUDIO_SEGMENTED):
+            live = audio_output.LivePlaylist(s3, BUCKET_NAME, CDN_URL, conversation_id, turn_id)
+        on_segment = live.add if live is not None else None
 
         now = datetime.utcnow()
-        conn = psycopg2.connect(host=DB_HOST,
-                                database=DB_NAME,
-                                user=DB_USER,
-                                password=DB_PASS,
-                                port=DB_PORT)
-        cursor = conn.cursor()
-        insert_query = """
-            INSERT INTO message (conversation_id, username, content, created_at, updated_at)
-            VALUES (%s, %s, %s, %s, %s)
-            RETURNING id
-        """
-        cursor.execute(insert_query,
-                       (conversation_id, 'A001', content, now, now))
-        human_msg_id = cursor.fetchone()[0]
-
-        # Retrieve all history
-        query = "SELECT * FROM message WHERE conversation_id = {} ORDER BY created_at ASC".format(
-            conversation_id)
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        content_with_prompt = ''
-        for row in rows:
-            username = row[2]
-            text = row[3]
-            content_with_prompt += '{}: {}\n'.format(username, text)
-        content_with_prompt += 'A001: content'
-
-        # Invoke bedrock
-        answer = ""
-        if stage == 2:
-            answer = invoke_rag_flow_stage_2(content_with_prompt,count=count)
-        else:
-            stage, answer = invoke_rag_flow(content_with_prompt)
-        print("Answer:", answer)
-        # answer = '# 推薦產品清單\n\n## 1. 眼睛保健產品\n- **商品名稱**: 東森專利葉黃素滋養倍效膠囊\n- **售價**: 市價9900元（5盒），優惠方案18盒只要8910元（買9送9，平均一盒495元）\n- **主要功效**:\n  * 修復視神經、增強夜視功能\n  * 保濕眼球、舒緩乾澀\n  * 預防青光眼、白內障和黃斑部病變\n  * 抗藍光、抗紫外線保護\n- **特色成分**: 四國專利Lutemax®葉黃素、高濃度綠蜂膠、小分子玻尿酸\n- **適用人群**: 3C使用者、銀髮族、眼睛疲勞者、眼睛手術後保養\n\n## 2. 體重管理產品\n- **商品名稱**: 東森完美動能極孅果膠\n- **售價**: 市價1980元/盒（10包），優惠方案五盒只要1980元（買一送四）\n- **主要功效**:\n  * 增加飽足感，控制食慾\n  * 促進腸道蠕動，改善便秘\n  * 調控血糖吸收，減少脂肪囤積\n  * 可作為代餐（每包僅約78.3大卡）\n- **特色成分**: 魔芋萃取物、菊苣纖維、日本栗子種皮萃取物\n- **適用人群**: 想瘦身/控制體重者、便秘者、三餐不定時的上班族\n\n## 3. 美容養顏產品\n- 暫無詳細產品資料提供\n\n## 4. 護膚SPA服務\n- 暫無詳細服務資料提供\n\n您對哪項推薦產品有興趣？我可以提供更多相關資訊。'
-        voice = gen_voice(answer)
-        cursor.execute(insert_query,
-                       (conversation_id, '0000', answer, now, now))
-        ai_msg_id = cursor.fetchone()[0]
-
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            pending = []
+            try:
+                # Only messages newer than the cached context are read. The new
+                # human turn is appended locally, so the flow does not have to
+                # wait for its INSERT.
+                with metrics.span('db.history'):
+                    conversation_context = context_store.load(cursor, conversation_id)
+                human_insert = submit_db(insert_message, cursor, conversation_id,
+                                         'A001', content, now)
+                pending.append(human_insert)
+                conversation_context.append(None, 'A001', content)
+                content_with_prompt = conversation_context.render()
+
+                # Invoke bedrock
+                answer = ""
+                synthesizer = None
+                on_text = None
+                if stream:
+                    synthesizer = tts_stream.SentenceSynthesizer(gen_voice, on_segment)
+                    on_text = synthesizer.feed
+                stage, answer, outcome = answer_turn(content, content_with_prompt, stage, count,
+                                                     customer_id, on_text=on_text)
+                print("Answer:", answer)
+                # answer = '# 推薦產品清單\n\n## 1. 眼睛保健產品\n- **商品名稱**: 東森專利葉黃素滋養倍效膠囊\n- **售價**: 市價9900元（5盒），優惠方案18盒只要8910元（買9送9，平均一盒495元）\n- **主要功效**:\n  * 修復視神經、增強夜視功能\n  * 保濕眼球、舒緩乾澀\n  * 預防青光眼、白內障和黃斑部病變\n  * 抗藍光、抗紫外線保護\n- **特色成分**: 四國專利Lutemax®葉黃素、高濃度綠蜂膠、小分子玻尿酸\n- **適用人群**: 3C使用者、銀髮族、眼睛疲勞者、眼睛手術後保養\n\n## 2. 體重管理產品\n- **商品名稱**: 東森完美動能極孅果膠\n- **售價**: 市價1980元/盒（10包），優惠方案五盒只要1980元（買一送四）\n- **主要功效**:\n  * 增加飽足感，控制食慾\n  * 促進腸道蠕動，改善便秘\n  * 調控血糖吸收，減少脂肪囤積\n  * 可作為代餐（每包僅約78.3大卡）\n- **特色成分**: 魔芋萃取物、菊苣纖維、日本栗子種皮萃取物\n- **適用人群**: 想瘦身/控制體重者、便秘者、三餐不定時的上班族\n\n## 3. 美容養顏產品\n- 暫無詳細產品資料提供\n\n## 4. 護膚SPA服務\n- 暫無詳細服務資料提供\n\n您對哪項推薦產品有興趣？我可以提供更多相關資訊。'
+
+                # The AI message is stored while its audio is synthesized and uploaded
+                ai_insert = submit_db(insert_message, cursor, conversation_id,
+                                      '0000', answer, now)
+                pending.append(ai_insert)
+                voice_segments = None
+                voice_playlist = None
+                if synthesizer is None and audio_output.AUDIO_SEGMENTED:
+                    synthesizer = tts_stream.SentenceSynthesizer(gen_voice, on_segment)
+                if synthesizer is not None:
+                    # Fixed answers (finish(), the farewell) never went through the model
+                    if synthesizer.fed_chars == 0:
+                        synthesizer.feed(answer)
+                    voice_segments = synthesizer.finish()
+                    voice = voice_segments[0] if voice_segments else None
+                    if live is not None:
+                        live.close()
+                        voice_playlist = live.url
+                    elif audio_output.AUDIO_SEGMENTED and voice_segments:
+                        voice_playlist = audio_output.upload_playlist(
+                            s3, BUCKET_NAME, CDN_URL, voice_segments, synthesizer.texts)
+                else:
+                    voice = gen_voice(answer)
+
+                # Dashboard aggregates, in the same transaction as the messages
+                rollup = submit_db(rollups.record_turn, cursor, conversation_id, now,
+                                   requested_stage, stage, outcome,
+                                   (time.perf_counter() - turn_started) * 1000,
+                                   rollups.segment_of(customer_id))
+                pending.append(rollup)
+
+                human_msg_id = human_insert.result()
+                ai_msg_id = ai_insert.result()
+                # The cursor is the worker's until the rollup is done, and a
+                # failed rollup fails the turn before anything is committed
+                rollup.result()
+                conversation_context.append(ai_msg_id, '0000', answer)
+                with metrics.span('db.context_save'):
+                    context_store.save(cursor, conversation_context)
+            finally:
+                # Never hand the connection back while a worker still uses it
+                futures.wait(pending)
+                cursor.close()
 
         human_message = {
             "id": human_msg_id,
@@ -337,15 +569,47 @@ def lambda_handler(event, context):
             "voice": voice,
             "createdAt": now.isoformat()
         }
+        if voice_segments is not None:
+            ai_message["voiceSegments"] = voice_segments
+        if voice_playlist is not None:
+            ai_message["voicePlaylist"] = voice_playlist
+        if outcome is not None:
+            # Summarized later by the summaries worker, once the turn is committed;
+            # the turn is already saved, so a queue error must not fail it
+            try:
+                summaries.enqueue(conversation_id, outcome)
+            except Exception as e:
+                print(f"Summary enqueue failed for {conversation_id}: {e}")
+        metrics.record('turn', time.perf_counter() - turn_started, turn_started)
+        if trace is not None:
+            print(metrics.emf(trace, {"Service": "message_creation", "Stage": str(stage)}))
+            if with_timing:
+                ai_message["timing"] = trace.as_dict()
         result = [human_message, ai_message]
+        print(f"TTS CACHE: {voice_cache.stats()}")
         return result
     except Exception as e:
+        # The cached context may hold turns from the rolled back transaction
+        context_store.invalidate(conversation_id)
+        if live is not None:
+            # A polling client must not wait for segments that will never come
+            try:
+                live.close(failed=True)
+            except Exception as close_error:
+                print(f"Live playlist close failed for {conversation_id}: {close_error}")
         raise e
+    finally:
+        metrics.end_trace()
+
+
+if PREWARM:
+    prewarm()
 
 
-print(lambda_handler({
-    "content": "我是A會員,我今年18歲,我是男性",
-    "conversationId": 81,
-    "stage": 1,
-    "count": 0
-}, None))
+if __name__ == "__main__":
+    print(lambda_handler({
+        "content": "我是A會員,我今年18歲,我是男性",
+        "conversationId": 81,
+        "stage": 1,
+        "count": 0
+    }, None))
@@ -1,34 +1,37 @@
-import psycopg2
+import db
+import pagination
 
-DB_HOST = ''
-DB_PORT = 5432
-DB_NAME = ''
-DB_USER = ''
-DB_PASS = ''
+LIST_MESSAGES_QUERY = """
+    SELECT id, username, content, created_at, updated_at
+    FROM message
+    WHERE conversation_id = %s {keyset}
+    ORDER BY created_at DESC, id DESC
+    LIMIT %s
+"""
+
+
+def serialize(row):
+    return {
+        'id': row[0],
+        'username': row[1],
+        'content': row[2],
+        'createdAt': row[3].isoformat(),
+        'updatedAt': row[4].isoformat(),
+    }
 
 
 def lambda_handler(event, context):
     try:
-        conversation_id = event['params']['path']['conversationId']
-        conn = psycopg2.connect(host=DB_HOST,
-                                database=DB_NAME,
-                                user=DB_USER,
-                                password=DB_PASS,
-                                port=DB_PORT)
-        cursor = conn.cursor()
-        query = "SELECT * FROM message WHERE conversation_id = {} ORDER BY created_at DESC".format(
-            conversation_id)
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        result = [{
-            'id': row[0],
-            'username': row[2],
-            'content': row[3],
-            'createdAt': row[4].isoformat(),
-            'updatedAt': row[5].isoformat(),
-        } for row in rows]
-        cursor.close()
-        conn.close()
-        return result
+        conversation_id = int(event['params']['path']['conversationId'])
+        paged, limit, after = pagination.page_request(event)
+        keyset, keyset_params = pagination.keyset_clause(after, prefix='AND')
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(LIST_MESSAGES_QUERY.format(keyset=keyset),
+                           (conversation_id, *keyset_params, limit + 1))
+            items, next_cursor = pagination.read_page(cursor, limit, serialize,
+                                                      created_at_index=3, id_index=0)
+            cursor.close()
+        return pagination.response(items, next_cursor, paged)
     except Exception as e:
-        raise e
\ No newline at end of file
+        raise e
@@ -0,0 +1,242 @@
+"""
+Lightweight timing spans for the message pipeline.
+
+`span(name)` times a block into a process-wide HDR-style histogram (log-linear
+buckets, ~3% relative error, fixed memory) and into the trace of the current
+turn, if one is active. Traces follow the turn into worker threads through
+`submit(executor, fn, ...)`, which copies the context. Per-turn traces can be
+written as CloudWatch Embedded Metric Format log lines or returned with the
+response. With METRICS=0 `span` returns a shared no-op object.
+"""
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+
+METRICS_ENABLED = os.environ.get('METRICS', '1') != '0'
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'VoiceAgent')
+# Values below 2 * SUB_BUCKETS microseconds are exact, above that every power
+# of two is split into SUB_BUCKETS linear buckets
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+N_BUCKETS = 40 * SUB_BUCKETS
+
+_trace = contextvars.ContextVar('metrics_trace', default=None)
+
+
+def _bucket(value_us: int) -> int:
+    if value_us < 2 * SUB_BUCKETS:
+        return value_us
+    shift = value_us.bit_length() - SUB_BUCKET_BITS - 1
+    return min(shift * SUB_BUCKETS + (value_us >> shift), N_BUCKETS - 1)
+
+
+def _bucket_value(index: int) -> float:
+    # Midpoint of the bucket, in microseconds
+    if index < 2 * SUB_BUCKETS:
+        return float(index)
+    shift = index // SUB_BUCKETS - 1
+    return ((index - shift * SUB_BUCKETS) << shift) + (1 << shift) / 2
+
+
+class Histogram:
+
+    def __init__(self):
+        self.counts = [0] * N_BUCKETS
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        value_us = max(0, int(seconds * 1e6))
+        with self._lock:
+            self.counts[_bucket(value_us)] += 1
+            self.count += 1
+            self.total_us += value_us
+            if value_us > self.max_us:
+                self.max_us = value_us
+
+    def percentile(self, q: float) -> float:
+        """q in [0, 100]; milliseconds."""
+        with self._lock:
+            if not self.count:
+                return 0.0
+            rank = max(1, int(round(q / 100 * self.count)))
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank:
+                    return min(_bucket_value(index), self.max_us) / 1000
+        return self.max_us / 1000
+
+    def snapshot(self) -> dict:
+        return {
+            'count': self.count,
+            'mean': self.total_us / self.count / 1000 if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max_us / 1000,
+        }
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * N_BUCKETS
+            self.count = self.total_us = self.max_us = 0
+
+
+histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def histogram(name) -> Histogram:
+    found = histograms.get(name)
+    if found is None:
+        with _histograms_lock:
+            found = histograms.setdefault(name, Histogram())
+    return found
+
+
+class Trace:
+    """Spans of one turn: (name, start ms from the turn start, duration ms)."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, name, started, seconds):
+        with self._lock:
+            self.spans.append((name, (started - self.started) * 1000, seconds * 1000))
+
+    def totals(self) -> dict:
+        result = {}
+        for name, _, duration in self.spans:
+            result[name] = result.get(name, 0.0) + duration
+        return result
+
+    def as_dict(self) -> dict:
+        return {
+            'totals': {name: round(value, 2) for name, value in self.totals().items()},
+            'spans': [{'name': name, 'start': round(start, 2), 'duration': round(duration, 2)}
+                      for name, start, duration in sorted(self.spans, key=lambda s: s[1])],
+        }
+
+
+def record(name, seconds, started=None):
+    """Adds a measured duration (e.g. a time to first chunk) like a span would."""
+    if not METRICS_ENABLED:
+        return
+    histogram(name).record(seconds)
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(name, started if started is not None else time.perf_counter() - seconds,
+                  seconds)
+
+
+class _Span:
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.started, self.started)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name):
+    return _Span(name) if METRICS_ENABLED else _NOOP
+
+
+def timed(name):
+    """Decorator form of `span`."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def first_item(iterable, name, started):
+    """Iterates `iterable`, recording the time from `started` to its first item."""
+    if not METRICS_ENABLED:
+        return iterable
+    return _first_item(iterable, name, started)
+
+
+def _first_item(iterable, name, started):
+    iterator = iter(iterable)
+    for item in iterator:
+        record(name, time.perf_counter() - started, started)
+        yield item
+        break
+    yield from iterator
+
+
+def start_trace():
+    """Starts the trace of a turn in the current context; None when disabled."""
+    if not METRICS_ENABLED:
+        return None
+    trace = Trace()
+    _trace.set(trace)
+    return trace
+
+
+def end_trace():
+    _trace.set(None)
+
+
+def submit(executor, fn, *args, **kwargs):
+    # Worker threads do not inherit context variables; run in a copy so spans
+    # land in the submitting turn's trace
+    if not METRICS_ENABLED:
+        return executor.submit(fn, *args, **kwargs)
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def emf(trace: Trace, dimensions=None, namespace=None) -> str:
+    """One EMF log line with every span duration of the turn, in milliseconds."""
+    dimensions = dimensions or {}
+    values = {}
+    for name, _, duration in trace.spans:
+        values.setdefault(name, []).append(round(duration, 3))
+    document = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace or METRICS_NAMESPACE,
+                'Dimensions': [sorted(dimensions)],
+                'Metrics': [{'Name': name, 'Unit': 'Milliseconds'} for name in sorted(values)],
+            }],
+        },
+    }
+    document.update(dimensions)
+    document.update(values)
+    return json.dumps(document, ensure_ascii=False)
+
+
+def snapshot() -> dict:
+    return {name: found.snapshot() for name, found in sorted(histograms.items())}
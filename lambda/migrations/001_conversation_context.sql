@@ -0,0 +1,8 @@
+-- Cached, already-formatted conversation transcript used as prompt context.
+CREATE TABLE IF NOT EXISTS conversation_context (
+    conversation_id INTEGER PRIMARY KEY REFERENCES conversation (id) ON DELETE CASCADE,
+    last_message_id INTEGER NOT NULL DEFAULT 0,
+    summary TEXT NOT NULL DEFAULT '',
+    transcript TEXT NOT NULL DEFAULT '',
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
@@ -0,0 +1,8 @@
+-- Keyset pagination of the list endpoints: ORDER BY created_at DESC, id DESC
+-- with WHERE (created_at, id) < (%s, %s) is one range scan on these indexes.
+-- CONCURRENTLY keeps the tables writable; run this file outside a transaction.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS message_conversation_created_at_id_idx
+    ON message (conversation_id, created_at DESC, id DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS conversation_created_at_id_idx
+    ON conversation (created_at DESC, id DESC);
@@ -0,0 +1,29 @@
+-- Dashboard rollups, maintained by message_creation_handler on every turn.
+-- Everything about a conversation is counted on the day it started, so a
+-- conversation's later turns only update its own day's row.
+CREATE TABLE IF NOT EXISTS conversation_rollup (
+    conversation_id INTEGER PRIMARY KEY REFERENCES conversation (id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    segment TEXT NOT NULL DEFAULT 'unknown',
+    turns INTEGER NOT NULL DEFAULT 0,
+    stage_transitions INTEGER NOT NULL DEFAULT 0,
+    last_stage INTEGER,
+    outcome TEXT,  -- 'purchase' (finish()), 'farewell' (count >= 5) or NULL while open
+    started_at TIMESTAMP NOT NULL,
+    last_turn_at TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS daily_rollup (
+    day DATE NOT NULL,
+    segment TEXT NOT NULL,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    turns INTEGER NOT NULL DEFAULT 0,
+    stage_transitions INTEGER NOT NULL DEFAULT 0,
+    purchases INTEGER NOT NULL DEFAULT 0,
+    farewells INTEGER NOT NULL DEFAULT 0,
+    latency_ms_total BIGINT NOT NULL DEFAULT 0,
+    timed_turns INTEGER NOT NULL DEFAULT 0,  -- turns with a measured latency
+    latency_ms_max INTEGER NOT NULL DEFAULT 0,
+    duration_ms_total BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, segment)
+);
@@ -0,0 +1,14 @@
+-- Call summaries written by the summaries.py worker. last_message_id is the
+-- newest message covered, so redelivered jobs never overwrite a newer summary.
+CREATE TABLE IF NOT EXISTS call_summary (
+    conversation_id INTEGER PRIMARY KEY REFERENCES conversation (id) ON DELETE CASCADE,
+    last_message_id INTEGER NOT NULL,
+    summary TEXT NOT NULL,
+    outcome TEXT,
+    products JSONB NOT NULL DEFAULT '[]',
+    model TEXT NOT NULL,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
@@ -0,0 +1,13 @@
+-- Checkpoints of the conversations hosted by sessions.py. `turns` only grows,
+-- so a late write of an older checkpoint never overwrites a newer one.
+CREATE TABLE IF NOT EXISTS session_checkpoint (
+    session_id TEXT PRIMARY KEY,
+    customer_id TEXT,
+    stage SMALLINT NOT NULL DEFAULT 1,
+    count SMALLINT NOT NULL DEFAULT 0,
+    outcome TEXT,
+    turns INTEGER NOT NULL DEFAULT 0,
+    summary TEXT NOT NULL DEFAULT '',
+    transcript TEXT NOT NULL DEFAULT '',
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
@@ -0,0 +1,5 @@
+-- The turns of a transcript as a JSON array of formatted turns, so a message
+-- containing newlines is restored as one turn. `transcript` keeps the
+-- flattened text; rows written before this column existed are split from it.
+ALTER TABLE conversation_context ADD COLUMN IF NOT EXISTS transcript_turns JSONB;
+ALTER TABLE session_checkpoint ADD COLUMN IF NOT EXISTS transcript_turns JSONB;
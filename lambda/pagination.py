@@ -0,0 +1,92 @@
+"""
+Keyset pagination on (created_at, id) for the list endpoints.
+
+A page is read with `WHERE (created_at, id) < (cursor) ORDER BY created_at
+DESC, id DESC LIMIT n + 1`, which the composite indexes in migrations/ answer
+with one index range scan, so a page costs the same however much history
+exists. The cursor is the (created_at, id) of the last row, base64url-encoded.
+"""
+import base64
+import json
+import os
+from datetime import datetime
+
+PAGE_SIZE = int(os.environ.get('LIST_PAGE_SIZE', 50))
+MAX_PAGE_SIZE = int(os.environ.get('LIST_MAX_PAGE_SIZE', 500))
+# Upper bound for callers that do not paginate and expect a plain list; a
+# longer result comes back in the paged shape with `truncated` set
+UNPAGED_LIMIT = int(os.environ.get('LIST_UNPAGED_LIMIT', 1000))
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"invalid cursor: {cursor!r}") from e
+
+
+def page_request(event):
+    """
+    (paged, limit, after) from the query string. Requests without `limit` or
+    `cursor` keep the plain list response while it fits in UNPAGED_LIMIT rows.
+    """
+    query = (event.get('params') or {}).get('querystring') or {}
+    paged = 'limit' in query or 'cursor' in query
+    if not paged:
+        return False, UNPAGED_LIMIT, None
+    try:
+        limit = int(query.get('limit') or PAGE_SIZE)
+    except ValueError:
+        limit = PAGE_SIZE
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    after = decode_cursor(query['cursor']) if query.get('cursor') else None
+    return True, limit, after
+
+
+def keyset_clause(after, prefix='WHERE'):
+    # Row comparison so the index on (..., created_at, id) is used as a range
+    if after is None:
+        return '', ()
+    return f"{prefix} (created_at, id) < (%s, %s)", after
+
+
+def read_page(cursor, limit, serialize, created_at_index, id_index):
+    """
+    Serializes the rows of `cursor`, which must have been executed with LIMIT
+    limit + 1. Returns (items, next cursor or None). A client-side cursor holds
+    the whole result, which the LIMIT keeps to at most MAX_PAGE_SIZE or
+    UNPAGED_LIMIT rows, so no server-side cursor is needed.
+    """
+    items = []
+    last = None
+    for row in cursor:
+        if len(items) == limit:
+            return items, encode_cursor(last[created_at_index], last[id_index])
+        items.append(serialize(row))
+        last = row
+    return items, None
+
+
+def response(items, next_cursor, paged):
+    """
+    {'items', 'nextCursor'} for paged requests. Unpaged ones get the plain list,
+    unless UNPAGED_LIMIT cut it short: then the paged shape with `truncated`
+    set, so the caller cannot mistake a partial list for the whole.
+    """
+    if not paged and next_cursor is None:
+        return items
+    result = {'items': items, 'nextCursor': next_cursor}
+    if not paged:
+        result['truncated'] = True
+    return result
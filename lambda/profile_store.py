@@ -0,0 +1,228 @@
+"""
+In-process customer tag profiles built from the long-format tag list
+(客代,標籤分類1,標籤分類2,標籤名稱,標籤值).
+
+Tag names and values are interned into (tag, value) pair ids. Every customer
+is a row holding its pair ids (CSR layout), and every pair has a bitset over
+the customer rows, so segment queries are vectorized AND/OR over uint64 words.
+
+Usage:
+    python profile_store.py build ../data.csv profiles.bin
+    python profile_store.py query profiles.bin 年齡區間=60-69 居住縣市=台北市* 可推薦商品類別=*保健*
+"""
+import csv
+import fnmatch
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+
+SNAPSHOT_MAGIC = b'LUNAPRF1'
+PROFILE_SNAPSHOT = os.environ.get('PROFILE_SNAPSHOT', '')
+# Used when no snapshot is configured
+PROFILE_CSV = os.environ.get('PROFILE_CSV', '')
+
+
+def _words(n_rows: int) -> int:
+    return (n_rows + 63) // 64
+
+
+class ProfileStore:
+
+    def __init__(self, customer_ids, tags, pairs, offsets, pair_ids, bitsets=None):
+        self.customer_ids = list(customer_ids)
+        self.row_of = {customer_id: row for row, customer_id in enumerate(self.customer_ids)}
+        # tags: tag name -> (標籤分類1, 標籤分類2)
+        self.tags = dict(tags)
+        # pairs: list of (tag name, value); the index is the pair id
+        self.pairs = [tuple(pair) for pair in pairs]
+        self.pair_of = {pair: pair_id for pair_id, pair in enumerate(self.pairs)}
+        self.values_of = {}
+        for pair_id, (tag, value) in enumerate(self.pairs):
+            self.values_of.setdefault(tag, {})[value] = pair_id
+        self.offsets = np.asarray(offsets, dtype=np.int32)
+        self.pair_ids = np.asarray(pair_ids, dtype=np.int32)
+        self.bitsets = bitsets if bitsets is not None else self._build_bitsets()
+
+    def __len__(self):
+        return len(self.customer_ids)
+
+    # ---- BUILD ----
+    @classmethod
+    def from_rows(cls, rows):
+        """`rows` yields (客代, 標籤分類1, 標籤分類2, 標籤名稱, 標籤值) tuples."""
+        customer_ids = []
+        row_of = {}
+        tags = {}
+        pairs = []
+        pair_of = {}
+        per_customer = []
+        for customer_id, category_1, category_2, tag, value in rows:
+            row = row_of.get(customer_id)
+            if row is None:
+                row = row_of[customer_id] = len(customer_ids)
+                customer_ids.append(customer_id)
+                per_customer.append([])
+            tags.setdefault(tag, (category_1, category_2))
+            pair = (tag, value)
+            pair_id = pair_of.get(pair)
+            if pair_id is None:
+                pair_id = pair_of[pair] = len(pairs)
+                pairs.append(pair)
+            per_customer[row].append(pair_id)
+
+        # Duplicate rows are dropped
+        per_customer = [sorted(set(ids)) for ids in per_customer]
+        offsets = np.zeros(len(customer_ids) + 1, dtype=np.int32)
+        offsets[1:] = np.cumsum([len(ids) for ids in per_customer])
+        pair_ids = np.fromiter((pair_id for ids in per_customer for pair_id in ids),
+                               dtype=np.int32, count=int(offsets[-1]))
+        return cls(customer_ids, tags, pairs, offsets, pair_ids)
+
+    @classmethod
+    def from_csv(cls, path, encoding='utf-8'):
+        with open(path, encoding=encoding, newline='') as f:
+            reader = csv.reader(f)
+            next(reader)  # header
+            return cls.from_rows((row[0], row[1], row[2], row[3], row[4])
+                                 for row in reader if len(row) >= 5)
+
+    def _build_bitsets(self):
+        n_words = _words(len(self.customer_ids))
+        bitsets = np.zeros((len(self.pairs), n_words), dtype=np.uint64)
+        rows = np.repeat(np.arange(len(self.customer_ids)), np.diff(self.offsets))
+        words = rows >> 6
+        bits = np.left_shift(np.uint64(1), (rows & 63).astype(np.uint64))
+        np.bitwise_or.at(bitsets, (self.pair_ids, words), bits)
+        return bitsets
+
+    # ---- LOOKUP ----
+    def profile(self, customer_id) -> dict:
+        """Tag name -> list of values for one customer, or {} if unknown."""
+        row = self.row_of.get(str(customer_id))
+        if row is None:
+            return {}
+        result = {}
+        for pair_id in self.pair_ids[self.offsets[row]:self.offsets[row + 1]]:
+            tag, value = self.pairs[pair_id]
+            result.setdefault(tag, []).append(value)
+        return result
+
+    def profile_text(self, customer_id) -> str:
+        # Same shape as data/customer_files_txt, for prompts
+        lines = [f"客代: {customer_id}"]
+        for tag, values in self.profile(customer_id).items():
+            lines.append(f"{tag}: {'、'.join(values)}")
+        return '\n'.join(lines)
+
+    # ---- SEGMENTS ----
+    def _pattern_bits(self, tag, pattern):
+        values = self.values_of.get(tag, {})
+        patterns = pattern if isinstance(pattern, (list, tuple, set)) else [pattern]
+        matched = [pair_id for value, pair_id in values.items()
+                   if any(fnmatch.fnmatchcase(value, p) for p in patterns)]
+        if not matched:
+            return np.zeros(self.bitsets.shape[1], dtype=np.uint64)
+        return np.bitwise_or.reduce(self.bitsets[matched], axis=0)
+
+    def segment_bits(self, conditions: dict) -> np.ndarray:
+        """
+        Bitset of the customers matching every condition. A condition maps a tag
+        name to a value, a glob pattern ('台北市*') or a list of them (OR).
+        """
+        result = np.full(self.bitsets.shape[1], np.uint64(0xFFFFFFFFFFFFFFFF), dtype=np.uint64)
+        tail = len(self.customer_ids) & 63
+        if tail:
+            result[-1] = np.uint64((1 << tail) - 1)
+        for tag, pattern in conditions.items():
+            result &= self._pattern_bits(tag, pattern)
+        return result
+
+    def segment(self, conditions: dict) -> list:
+        rows = bits_to_rows(self.segment_bits(conditions), len(self.customer_ids))
+        return [self.customer_ids[row] for row in rows]
+
+    def count(self, conditions: dict) -> int:
+        bits = self.segment_bits(conditions)
+        return int(np.unpackbits(bits.view(np.uint8)).sum())
+
+    # ---- SNAPSHOT ----
+    def save(self, path):
+        header = json.dumps({
+            "customers": self.customer_ids,
+            "tags": self.tags,
+            "pairs": self.pairs,
+        }, ensure_ascii=False).encode('utf-8')
+        with open(path, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(struct.pack('<QQQQ', len(header), len(self.offsets), len(self.pair_ids),
+                                self.bitsets.shape[0]))
+            f.write(header)
+            # Arrays start on 8-byte boundaries so they can be used in place
+            for array in (self.offsets, self.pair_ids, self.bitsets):
+                f.write(b'\0' * (-f.tell() % 8))
+                f.write(np.ascontiguousarray(array).tobytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if data[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path}: not a profile snapshot")
+        position = len(SNAPSHOT_MAGIC)
+        header_len, n_offsets, n_pair_ids, n_pairs = struct.unpack_from('<QQQQ', data, position)
+        position += 32
+        header = json.loads(data[position:position + header_len])
+        position += header_len
+        position += -position % 8
+        offsets = np.frombuffer(data, dtype=np.int32, count=n_offsets, offset=position)
+        position += offsets.nbytes
+        position += -position % 8
+        pair_ids = np.frombuffer(data, dtype=np.int32, count=n_pair_ids, offset=position)
+        position += pair_ids.nbytes
+        position += -position % 8
+        n_words = _words(len(header["customers"]))
+        bitsets = np.frombuffer(data, dtype=np.uint64, count=n_pairs * n_words,
+                                offset=position).reshape(n_pairs, n_words)
+        return cls(header["customers"], header["tags"], header["pairs"], offsets, pair_ids,
+                   bitsets=bitsets)
+
+
+def bits_to_rows(bits: np.ndarray, n_rows: int) -> np.ndarray:
+    flags = np.unpackbits(bits.view(np.uint8), bitorder='little')[:n_rows]
+    return np.flatnonzero(flags)
+
+
+_store = None
+
+
+def get_store():
+    """
+    Process-wide store, loaded once per container from PROFILE_SNAPSHOT (or
+    built from PROFILE_CSV). Returns None when neither is configured.
+    """
+    global _store
+    if _store is None:
+        if PROFILE_SNAPSHOT:
+            _store = ProfileStore.load(PROFILE_SNAPSHOT)
+        elif PROFILE_CSV:
+            _store = ProfileStore.from_csv(PROFILE_CSV)
+    return _store
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'build':
+        store = ProfileStore.from_csv(sys.argv[2])
+        store.save(sys.argv[3])
+        print(f"{len(store)} customers, {len(store.pairs)} tag values -> {sys.argv[3]}")
+    elif command == 'query':
+        store = ProfileStore.load(sys.argv[2])
+        conditions = dict(arg.split('=', 1) for arg in sys.argv[3:])
+        customers = store.segment(conditions)
+        print(f"{len(customers)} customers: {customers[:50]}")
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,185 @@
+"""
+Local product scoring from customer tags.
+
+Products are read from the hackathon product files (商品名稱, 商品類別,
+主要功能, 適用族群 ...). Every (tag, value) pair of the profile store gets an
+affinity weight per product, so a customer's scores are the sum of the weight
+rows of its pairs and the whole customer base is one NumPy reduceat.
+"""
+import glob
+import os
+import re
+
+import numpy as np
+
+import profile_store
+import retrieval
+
+PRODUCT_DIR = os.environ.get(
+    'PRODUCT_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'hackson_file'))
+# Stage 1 is skipped when the best product scores at least this much and leads
+# the runner-up by RECOMMEND_MIN_MARGIN
+RECOMMEND_MIN_SCORE = float(os.environ.get('RECOMMEND_MIN_SCORE', 3.0))
+RECOMMEND_MIN_MARGIN = float(os.environ.get('RECOMMEND_MIN_MARGIN', 1.0))
+TOP_K = 3
+
+# Weights
+CATEGORY_MATCH = 3.0  # 可推薦商品類別 equals the product's 商品類別
+BROWSE_MATCH = 2.0  # 保健瀏覽 mentions the product
+TEXT_MATCH = 1.0  # a 保健 value appears in the product text
+SENIOR_MATCH = 1.0  # age 50+ and the product targets 銀髮族/中高齡者
+HEALTH_CONSCIOUS = 0.5
+
+SENIOR_AGES = ('50-59', '60-69', '70-79', '80以上')
+SENIOR_WORDS = ('銀髮', '中高齡', '長輩')
+_FIELD = re.compile(r'^(\S+?):\s*(.*)$')
+
+
+class Product:
+    __slots__ = ('key', 'name', 'category', 'text')
+
+    def __init__(self, key, name, category, text):
+        self.key = key
+        self.name = name
+        self.category = category
+        self.text = text
+
+
+def load_products(directory=PRODUCT_DIR):
+    products = []
+    for path in sorted(glob.glob(os.path.join(directory, '產品*.txt'))):
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        fields = {}
+        for line in text.splitlines():
+            match = _FIELD.match(line.strip())
+            if match and match.group(2):
+                fields.setdefault(match.group(1), match.group(2))
+        key = os.path.basename(path).split('_', 1)[0]
+        products.append(Product(key, fields.get('商品名稱', key), fields.get('商品類別', ''), text))
+    return products
+
+
+def _bigrams(text):
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def _mentions(value, text) -> bool:
+    # Whole value, or most of its character bigrams, appear in the text
+    if value in text:
+        return True
+    bigrams = _bigrams(value)
+    return bool(bigrams) and len([b for b in bigrams if b in text]) / len(bigrams) >= 0.5
+
+
+def pair_weight(tag, value, product):
+    """Affinity of one customer tag value with a product, and why."""
+    if tag == '可推薦商品類別':
+        if value == product.category:
+            return CATEGORY_MATCH, f"可推薦商品類別為{value}"
+        if _mentions(value, product.text):
+            return TEXT_MATCH, f"可推薦商品類別「{value}」與產品功效相關"
+    elif tag == '保健瀏覽':
+        if _mentions(value, product.category + product.name) or value in product.text:
+            return BROWSE_MATCH, f"曾瀏覽{value}相關保健品"
+    elif tag == '年齡區間':
+        if value in SENIOR_AGES and any(word in product.text for word in SENIOR_WORDS):
+            return SENIOR_MATCH, f"年齡{value}，屬適用族群"
+    elif tag == '是否有高健康意識' and value == '是':
+        return HEALTH_CONSCIOUS, "有高健康意識"
+    return 0.0, None
+
+
+class Recommender:
+
+    def __init__(self, store: profile_store.ProfileStore, products=None):
+        self.store = store
+        self.products = products if products is not None else load_products()
+        n_pairs = len(store.pairs)
+        self.weights = np.zeros((n_pairs, len(self.products)), dtype=np.float32)
+        self.reasons = {}
+        for pair_id, (tag, value) in enumerate(store.pairs):
+            for column, product in enumerate(self.products):
+                weight, reason = pair_weight(tag, value, product)
+                if weight:
+                    self.weights[pair_id, column] = weight
+                    self.reasons[pair_id, column] = reason
+
+    def scores(self, customer_id):
+        row = self.store.row_of.get(str(customer_id))
+        if row is None:
+            return None, None
+        pair_ids = self.store.pair_ids[self.store.offsets[row]:self.store.offsets[row + 1]]
+        return self.weights[pair_ids].sum(axis=0), pair_ids
+
+    def recommend(self, customer_id, k=TOP_K):
+        """
+        Ranked [(product, score, reasons)] for one customer, best first, or []
+        for unknown customers.
+        """
+        scores, pair_ids = self.scores(customer_id)
+        if scores is None:
+            return []
+        ranking = []
+        for column in np.argsort(-scores, kind='stable')[:k]:
+            contributing = [pair_id for pair_id in pair_ids if (pair_id, column) in self.reasons]
+            contributing.sort(key=lambda pair_id: -self.weights[pair_id, column])
+            reasons = [self.reasons[pair_id, column] for pair_id in contributing]
+            ranking.append((self.products[column], float(scores[column]), reasons))
+        return ranking
+
+    def is_confident(self, ranking) -> bool:
+        if not ranking:
+            return False
+        top = ranking[0][1]
+        runner_up = ranking[1][1] if len(ranking) > 1 else 0.0
+        return top >= RECOMMEND_MIN_SCORE and top - runner_up >= RECOMMEND_MIN_MARGIN
+
+    def score_all(self):
+        """(n_customers, n_products) scores for the whole customer base."""
+        offsets = self.store.offsets
+        contributions = self.weights[self.store.pair_ids]
+        scores = np.zeros((len(self.store), len(self.products)), dtype=np.float32)
+        non_empty = np.flatnonzero(np.diff(offsets) > 0)
+        if len(non_empty):
+            scores[non_empty] = np.add.reduceat(contributions, offsets[non_empty], axis=0)
+        return scores
+
+    def top_k_all(self, k=TOP_K):
+        scores = self.score_all()
+        return np.argsort(-scores, axis=1, kind='stable')[:, :k], scores
+
+
+def product_details(ranking, query=None) -> str:
+    """
+    `Product Details` for recommend_product, with the local reasons attached.
+    With a query, only the product passages most relevant to it are sent
+    instead of the whole product files.
+    """
+    if query is None or not retrieval.RETRIEVAL_TOP_K:
+        parts = []
+        for product, score, reasons in ranking:
+            parts.append(f"{product.text.strip()}\n推薦理由: {'；'.join(reasons) or '無'}")
+        return '\n\n'.join(parts)
+
+    keys = [product.key for product, _, _ in ranking]
+    lines = [f"{product.name} 推薦理由: {'；'.join(reasons) or '無'}"
+             for product, _, reasons in ranking]
+    # The reasons say what the customer cares about even when the query does not
+    query = ' '.join([query] + [reason for _, _, reasons in ranking for reason in reasons])
+    passages = retrieval.get_retriever().details(query, product_keys=keys)
+    return '\n\n'.join([passages] + lines)
+
+
+_recommender = None
+
+
+def get_recommender():
+    global _recommender
+    if _recommender is None:
+        store = profile_store.get_store()
+        if store is None:
+            return None
+        _recommender = Recommender(store)
+    return _recommender
@@ -0,0 +1,323 @@
+"""
+Deterministic local stand-ins for Bedrock, Polly, S3 and Postgres, for
+replaying conversations through the real handler code without AWS.
+
+Every fake sleeps for a configurable latency with seeded jitter, so runs are
+repeatable and the stage timings behave like the remote calls they replace.
+"""
+import io
+import json
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+
+class Latency:
+    """`mean_ms` ± uniform `jitter_ms`, plus `per_unit_ms` for every unit of work."""
+
+    def __init__(self, mean_ms=0.0, jitter_ms=0.0, per_unit_ms=0.0, seed=0, scale=1.0):
+        self.mean_ms = mean_ms
+        self.jitter_ms = jitter_ms
+        self.per_unit_ms = per_unit_ms
+        self.scale = scale
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def seconds(self, units=0):
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(0.0, self.mean_ms + jitter + self.per_unit_ms * units) * self.scale / 1000
+
+    def sleep(self, units=0):
+        delay = self.seconds(units)
+        if delay:
+            time.sleep(delay)
+
+
+# Bytes per second of speech of Polly's compressed formats, roughly
+COMPRESSED_BYTES_PER_SECOND = {'mp3': 4000, 'ogg_vorbis': 3000}
+CONTENT_TYPES = {'pcm': 'audio/pcm', 'mp3': 'audio/mpeg', 'ogg_vorbis': 'audio/ogg'}
+
+
+class FakePolly:
+    """synthesize_speech returns silence whose length follows the text."""
+
+    def __init__(self, latency=None, sample_rate=16000, chars_per_second=4.0):
+        self.latency = latency or Latency()
+        self.sample_rate = sample_rate
+        self.chars_per_second = chars_per_second
+        self.calls = 0
+
+    def synthesize_speech(self, Text, OutputFormat='pcm', VoiceId='', SampleRate=None,
+                          TextType='text', **kwargs):
+        self.calls += 1
+        if TextType == 'ssml':
+            Text = re.sub(r'<[^>]+>', '', Text)
+        self.latency.sleep(len(Text))
+        seconds = len(Text) / self.chars_per_second
+        if OutputFormat == 'pcm':
+            size = int(seconds * int(SampleRate or self.sample_rate)) * 2
+        else:
+            size = int(seconds * COMPRESSED_BYTES_PER_SECOND[OutputFormat])
+        return {'AudioStream': io.BytesIO(bytes(size)),
+                'ContentType': CONTENT_TYPES[OutputFormat]}
+
+
+class FakeS3:
+    """Objects are kept in memory; head_object answers 404 like S3."""
+
+    def __init__(self, latency=None):
+        self.latency = latency or Latency()
+        self.objects = {}
+        self.modified = {}
+        self._lock = threading.Lock()
+
+    def _key(self, Bucket, Key):
+        return f"{Bucket}/{Key}"
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.latency.sleep()
+        with self._lock:
+            body = self.objects.get(self._key(Bucket, Key))
+        if body is None:
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        return {'ContentLength': len(body), 'LastModified': self.modified[self._key(Bucket, Key)]}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, **kwargs):
+        body = Fileobj.read()
+        # Upload time grows with the size, 1 unit per 64 KiB
+        self.latency.sleep(len(body) / 65536)
+        with self._lock:
+            self.objects[self._key(Bucket, Key)] = body
+            self.modified[self._key(Bucket, Key)] = datetime.now(timezone.utc)
+
+    def put_object(self, Bucket, Key, Body=b'', **kwargs):
+        self.upload_fileobj(io.BytesIO(Body if isinstance(Body, bytes) else Body.read()),
+                            Bucket, Key)
+        return {}
+
+
+def scripted_answer(prompt: str) -> str:
+    # Stable answer derived from the prompt, long enough for several sentences
+    seed = sum(map(ord, prompt[-200:])) % 997
+    return (f"謝謝您的分享，這是第{seed}號回覆。我們的產品很適合您的需求。"
+            f"現在購買還有優惠方案。請問您還有其他想了解的嗎？")
+
+
+class FakeBedrockRuntime:
+    """invoke_model and invoke_model_with_response_stream for the Claude messages API."""
+
+    def __init__(self, first_token=None, per_token=None, answer=scripted_answer, chars_per_token=2):
+        self.first_token = first_token or Latency()
+        self.per_token = per_token or Latency()
+        self.answer = answer
+        self.chars_per_token = chars_per_token
+        self.calls = 0
+
+    def _text(self, kwargs):
+        self.calls += 1
+        body = json.loads(kwargs['body'])
+        return self.answer(body['messages'][-1]['content'])
+
+    def input_tokens(self, kwargs):
+        body = json.loads(kwargs['body'])
+        chars = sum(len(message['content']) for message in body['messages'])
+        return -(-chars // self.chars_per_token)
+
+    def invoke_model(self, **kwargs):
+        text = self._text(kwargs)
+        tokens = -(-len(text) // self.chars_per_token)
+        self.first_token.sleep()
+        self.per_token.sleep(tokens)
+        body = {"content": [{"type": "text", "text": text}], "stop_reason": "end_turn",
+                "usage": {"input_tokens": self.input_tokens(kwargs), "output_tokens": tokens}}
+        return {'body': io.BytesIO(json.dumps(body).encode('utf-8'))}
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        text = self._text(kwargs)
+
+        def events():
+            self.first_token.sleep()
+            for start in range(0, len(text), self.chars_per_token):
+                self.per_token.sleep(1)
+                delta = {"type": "content_block_delta", "index": 0,
+                         "delta": {"type": "text_delta",
+                                   "text": text[start:start + self.chars_per_token]}}
+                yield {'chunk': {'bytes': json.dumps(delta).encode('utf-8')}}
+            yield {'chunk': {'bytes': json.dumps({"type": "message_stop"}).encode('utf-8')}}
+
+        return {'body': events()}
+
+
+def stage_1_nodes(document: str):
+    # Recommend once the customer has answered a couple of questions
+    return ['FlowOutputNode_2'] if document.count('A001') >= 3 else ['FlowOutputNode_1']
+
+
+def stage_2_nodes(document: str):
+    last = document.rstrip().rsplit('\n', 1)[-1]
+    return ['FlowOutputNode_2'] if re.search(r'買|下單|訂', last) and '不' not in last \
+        else ['FlowOutputode_1']
+
+
+class FakeBedrockAgentRuntime:
+    """
+    invoke_flow streams flowOutputEvents. `flows` maps a flow id to a function
+    from the input document to the output node names, one event per node.
+    """
+
+    def __init__(self, flows, latency=None, between_events=None):
+        self.flows = flows
+        self.latency = latency or Latency()
+        self.between_events = between_events or Latency()
+        self.calls = 0
+
+    def invoke_flow(self, flowIdentifier, flowAliasIdentifier=None, inputs=(), **kwargs):
+        self.calls += 1
+        document = inputs[0]['content']['document']
+        nodes = self.flows.get(flowIdentifier, stage_1_nodes)(document)
+
+        def events():
+            self.latency.sleep()
+            for node in nodes:
+                yield {'flowOutputEvent': {
+                    'nodeName': node,
+                    'nodeType': 'Output',
+                    'content': {'document': f"{node} 的檢索結果：鴕鳥龜鹿精、葉黃素、果膠"},
+                }}
+                self.between_events.sleep()
+            yield {'flowCompletionEvent': {'completionReason': 'SUCCESS'}}
+
+        return {'responseStream': events()}
+
+
+class FakeDatabase:
+    """
+    In-process stand-in for the tables the message handler uses (message,
+    conversation_context and the dashboard rollups). `connection()` has the
+    same contract as db.connection(): commit on success, rollback on error.
+    """
+
+    def __init__(self, latency=None):
+        self.latency = latency or Latency()
+        self.messages = []  # (id, conversation_id, username, content, created_at)
+        self.contexts = {}
+        self.conversation_rollups = {}
+        self.daily_rollups = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        conn = FakeConnection(self)
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+class FakeConnection:
+
+    def __init__(self, database):
+        self.database = database
+        self.closed = False
+        self._undo = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self._undo = []
+
+    def rollback(self):
+        with self.database._lock:
+            for undo in reversed(self._undo):
+                undo()
+        self._undo = []
+
+
+class FakeCursor:
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.database = connection.database
+        self._rows = []
+
+    def execute(self, query, params=()):
+        self.database.latency.sleep()
+        statement = ' '.join(query.split()).upper()
+        database = self.database
+        with database._lock:
+            if statement.startswith('INSERT INTO MESSAGE'):
+                conversation_id, username, content, created_at, _ = params
+                message_id = len(database.messages) + 1
+                database.messages.append((message_id, conversation_id, username, content,
+                                          created_at))
+                self.connection._undo.append(database.messages.pop)
+                self._rows = [(message_id, )]
+            elif statement.startswith('INSERT INTO CONVERSATION_CONTEXT'):
+                conversation_id = params[0]
+                previous = database.contexts.get(conversation_id)
+                database.contexts[conversation_id] = tuple(params[1:]) + (datetime.utcnow(), )
+                self.connection._undo.append(
+                    lambda: database.contexts.__setitem__(conversation_id, previous)
+                    if previous is not None else database.contexts.pop(conversation_id, None))
+                self._rows = []
+            elif statement.startswith('SELECT LAST_MESSAGE_ID'):
+                row = database.contexts.get(params[0])
+                self._rows = [row[:4]] if row is not None else []
+            elif statement.startswith('SELECT ID, USERNAME, CONTENT FROM MESSAGE'):
+                conversation_id, after = params
+                self._rows = [(m[0], m[2], m[3]) for m in database.messages
+                              if m[1] == conversation_id and m[0] > (after or 0)]
+            elif 'CONVERSATION_ROLLUP' in statement or 'DAILY_ROLLUP' in statement:
+                self._rollup(statement, params)
+            else:
+                raise NotImplementedError(f"FakeDatabase does not support: {statement[:60]}")
+
+    def _rollup(self, statement, params):
+        # Called with the database lock held; mirrors the statements of rollups.py
+        conversations = self.database.conversation_rollups
+        self._rows = []
+        if statement.startswith('INSERT INTO CONVERSATION_ROLLUP'):
+            conversation_id, day, segment, transitions, last_stage, outcome, started, last = params
+            row = conversations.get(conversation_id)
+            inserted = row is None
+            if inserted:
+                row = conversations[conversation_id] = {
+                    'day': day, 'segment': segment, 'turns': 1, 'stage_transitions': transitions,
+                    'last_stage': last_stage, 'outcome': outcome, 'started_at': started,
+                    'last_turn_at': last}
+            self._rows = [(inserted, row['day'], row['segment'], row['last_stage'],
+                           row['outcome'], row['last_turn_at'])]
+        elif statement.startswith('UPDATE CONVERSATION_ROLLUP'):
+            transition, last_stage, outcome, now, conversation_id = params
+            row = conversations[conversation_id]
+            row['turns'] += 1
+            row['stage_transitions'] += transition
+            row['last_stage'] = last_stage
+            row['outcome'] = row['outcome'] or outcome
+            row['last_turn_at'] = max(row['last_turn_at'], now)
+        elif statement.startswith('INSERT INTO DAILY_ROLLUP'):
+            day, segment, *values = params
+            row = self.database.daily_rollups.setdefault((day, segment), [0] * len(values))
+            for index, value in enumerate(values):
+                # latency_ms_max is the only column that is not a sum
+                row[index] = max(row[index], value) if index == 7 else row[index] + value
+        else:
+            raise NotImplementedError(f"FakeDatabase does not support: {statement[:60]}")
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def close(self):
+        pass
@@ -0,0 +1,275 @@
+"""
+Local retrieval over the product knowledge files.
+
+Documents are split into passages, embedded by a pluggable offline embedder
+(the default is TF-IDF over hashed character n-grams, no model download
+needed) and stored
+in an IVF index: vectors are clustered around k-means centroids and kept
+grouped by cluster, so a query only scans the `nprobe` closest clusters. The
+vectors live in a float32 .npy file that is memory-mapped on load.
+
+An embedder only needs a `dim` attribute and `embed(texts)` returning unit
+float32 rows; `fit(texts)` and an `idf` array are optional.
+
+Usage:
+    python retrieval.py product_index
+    python retrieval.py product_index "膝蓋痠痛 價格"
+"""
+import json
+import os
+import re
+import zlib
+
+import numpy as np
+
+PRODUCT_INDEX_DIR = os.environ.get('PRODUCT_INDEX_DIR', '')
+RETRIEVAL_TOP_K = int(os.environ.get('RETRIEVAL_TOP_K', 4))
+EMBEDDING_DIM = 512
+NPROBE = 16
+KMEANS_ITERATIONS = 10
+
+_SECTION = re.compile(r'\n\s*\n')
+_NON_TEXT = re.compile(r'[\s\-*#:：，。、（）()／/]+')
+
+
+class HashingEmbedder:
+    """
+    Signed feature hashing of character unigrams and bigrams with log term
+    frequency, weighted by the IDF learnt in `fit` and L2-normalized.
+    Deterministic across processes (crc32).
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM, idf=None):
+        self.dim = dim
+        self.idf = idf
+        self._features = {}
+
+    def _feature(self, gram):
+        feature = self._features.get(gram)
+        if feature is None:
+            h = zlib.crc32(gram.encode('utf-8'))
+            feature = self._features[gram] = (h % self.dim, 1.0 if (h >> 31) & 1 else -1.0)
+        return feature
+
+    @staticmethod
+    def _grams(text):
+        counts = {}
+        text = _NON_TEXT.sub(' ', text)
+        for i, char in enumerate(text):
+            if char != ' ':
+                counts[char] = counts.get(char, 0) + 1
+                gram = text[i:i + 2]
+                if len(gram) == 2 and ' ' not in gram:
+                    counts[gram] = counts.get(gram, 0) + 1
+        return counts
+
+    def fit(self, texts):
+        document_frequency = np.zeros(self.dim, dtype=np.float64)
+        for text in texts:
+            buckets = {self._feature(gram)[0] for gram in self._grams(text)}
+            document_frequency[list(buckets)] += 1
+        self.idf = np.log((1 + len(texts)) / (1 + document_frequency)).astype(np.float32) + 1
+        return self
+
+    def embed(self, texts) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for gram, count in self._grams(text).items():
+                index, sign = self._feature(gram)
+                vectors[row, index] += sign * (1.0 + np.log(count))
+        if self.idf is not None:
+            vectors *= self.idf
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+def chunk_document(text, title=''):
+    """
+    Splits a product file into passages at blank lines (one per section), with
+    the product title prefixed so each passage stands on its own.
+    """
+    passages = []
+    for section in _SECTION.split(text.strip()):
+        section = section.strip()
+        if not section:
+            continue
+        if title and not section.startswith(title):
+            section = f"{title}\n{section}"
+        passages.append(section)
+    return passages
+
+
+def kmeans(vectors, n_clusters, iterations=KMEANS_ITERATIONS, seed=0):
+    # Spherical k-means on unit vectors; a sample is enough for the centroids
+    rng = np.random.default_rng(seed)
+    sample = vectors
+    if len(vectors) > n_clusters * 64:
+        sample = vectors[rng.choice(len(vectors), n_clusters * 64, replace=False)]
+    centroids = sample[rng.choice(len(sample), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        for cluster in range(n_clusters):
+            members = sample[assignment == cluster]
+            if len(members):
+                centroids[cluster] = members.sum(axis=0)
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids /= norms
+    return centroids
+
+
+class VectorIndex:
+
+    def __init__(self, vectors, centroids, offsets, passages, sources):
+        # vectors are grouped by cluster: cluster c is vectors[offsets[c]:offsets[c + 1]]
+        self.vectors = vectors
+        self.centroids = centroids
+        self.offsets = offsets
+        self.passages = passages
+        self.sources = sources
+
+    def __len__(self):
+        return len(self.passages)
+
+    @classmethod
+    def build(cls, passages, sources, embedder, n_clusters=None, batch=4096):
+        vectors = np.concatenate([embedder.embed(passages[i:i + batch])
+                                  for i in range(0, len(passages), batch)]) \
+            if passages else np.zeros((0, embedder.dim), dtype=np.float32)
+        if n_clusters is None:
+            n_clusters = max(1, int(np.sqrt(len(passages))))
+        n_clusters = min(n_clusters, max(1, len(passages)))
+        centroids = kmeans(vectors, n_clusters) if len(passages) else \
+            np.zeros((1, embedder.dim), dtype=np.float32)
+        assignment = np.argmax(vectors @ centroids.T, axis=1) if len(passages) else \
+            np.zeros(0, dtype=np.int64)
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignment, minlength=len(centroids)))
+        return cls(vectors[order], centroids, offsets,
+                   [passages[i] for i in order], [sources[i] for i in order])
+
+    def search(self, query_vector, k=RETRIEVAL_TOP_K, nprobe=NPROBE, allowed_sources=None):
+        """Returns [(score, passage, source)] for the k nearest passages."""
+        if not len(self):
+            return []
+        nprobe = min(nprobe, len(self.centroids))
+        clusters = np.argsort(-(self.centroids @ query_vector))[:nprobe]
+        candidates, scores = [], []
+        for cluster in clusters:
+            # Clusters are contiguous, so each one is scored on a slice of the mapping
+            start, end = self.offsets[cluster], self.offsets[cluster + 1]
+            candidates.append(np.arange(start, end))
+            scores.append(self.vectors[start:end] @ query_vector)
+        candidates = np.concatenate(candidates)
+        scores = np.concatenate(scores)
+        if allowed_sources is not None:
+            allowed = set(allowed_sources)
+            keep = np.array([self.sources[i] in allowed for i in candidates], dtype=bool)
+            candidates, scores = candidates[keep], scores[keep]
+        if not len(candidates):
+            return []
+        top = np.argsort(-scores)[:k]
+        return [(float(scores[i]), self.passages[candidates[i]], self.sources[candidates[i]])
+                for i in top]
+
+    def exact_search(self, query_vector, k=RETRIEVAL_TOP_K):
+        scores = self.vectors @ query_vector
+        top = np.argsort(-scores)[:k]
+        return [(float(scores[i]), self.passages[i], self.sources[i]) for i in top]
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'vectors.npy'), self.vectors)
+        np.save(os.path.join(directory, 'centroids.npy'), self.centroids)
+        np.save(os.path.join(directory, 'offsets.npy'), self.offsets)
+        with open(os.path.join(directory, 'passages.json'), 'w', encoding='utf-8') as f:
+            json.dump({"passages": self.passages, "sources": self.sources}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory):
+        vectors = np.load(os.path.join(directory, 'vectors.npy'), mmap_mode='r')
+        centroids = np.load(os.path.join(directory, 'centroids.npy'))
+        offsets = np.load(os.path.join(directory, 'offsets.npy'))
+        with open(os.path.join(directory, 'passages.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        return cls(vectors, centroids, offsets, meta["passages"], meta["sources"])
+
+
+class ProductRetriever:
+
+    def __init__(self, index: VectorIndex, embedder=None):
+        self.index = index
+        self.embedder = embedder or HashingEmbedder()
+
+    @classmethod
+    def from_products(cls, products, embedder=None):
+        passages, sources = [], []
+        for product in products:
+            for passage in chunk_document(product.text, title=f"商品名稱: {product.name}"):
+                passages.append(passage)
+                sources.append(product.key)
+        return cls.from_passages(passages, sources, embedder)
+
+    @classmethod
+    def from_passages(cls, passages, sources, embedder=None, n_clusters=None):
+        embedder = embedder or HashingEmbedder()
+        if getattr(embedder, 'idf', True) is None:
+            embedder.fit(passages)
+        return cls(VectorIndex.build(passages, sources, embedder, n_clusters=n_clusters),
+                   embedder)
+
+    def save(self, directory):
+        self.index.save(directory)
+        idf = getattr(self.embedder, 'idf', None)
+        if idf is not None:
+            np.save(os.path.join(directory, 'idf.npy'), idf)
+
+    @classmethod
+    def load(cls, directory):
+        index = VectorIndex.load(directory)
+        idf_path = os.path.join(directory, 'idf.npy')
+        idf = np.load(idf_path) if os.path.exists(idf_path) else None
+        return cls(index, HashingEmbedder(dim=index.centroids.shape[1], idf=idf))
+
+    def passages(self, query, k=RETRIEVAL_TOP_K, product_keys=None):
+        query_vector = self.embedder.embed([query])[0]
+        return self.index.search(query_vector, k=k, allowed_sources=product_keys)
+
+    def details(self, query, k=RETRIEVAL_TOP_K, product_keys=None) -> str:
+        # `Product Details` made only of the passages relevant to the query
+        return '\n\n'.join(passage for _, passage, _ in
+                           self.passages(query, k=k, product_keys=product_keys))
+
+
+_retriever = None
+
+
+def get_retriever():
+    """Loads PRODUCT_INDEX_DIR, or indexes the product files in memory."""
+    global _retriever
+    if _retriever is None:
+        if PRODUCT_INDEX_DIR:
+            _retriever = ProductRetriever.load(PRODUCT_INDEX_DIR)
+        else:
+            import recommender
+            _retriever = ProductRetriever.from_products(recommender.load_products())
+    return _retriever
+
+
+if __name__ == "__main__":
+    import sys
+    import recommender
+
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    if len(sys.argv) > 2:
+        retriever = ProductRetriever.load(sys.argv[1])
+        for score, passage, source in retriever.passages(sys.argv[2]):
+            print(f"[{source} {score:.3f}] {passage}\n")
+    else:
+        retriever = ProductRetriever.from_products(recommender.load_products())
+        retriever.save(sys.argv[1])
+        print(f"{len(retriever.index)} passages -> {sys.argv[1]}")
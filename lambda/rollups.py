@@ -0,0 +1,264 @@
+"""
+Incrementally maintained dashboard aggregates (migrations/003).
+
+`record_turn` runs in the message handler's transaction and updates the
+conversation's row in conversation_rollup and the (day, segment) row in
+daily_rollup by the turn's deltas. The dashboard then reads at most one row per
+day and segment, whatever the size of the message table.
+
+Usage:
+    python rollups.py backfill
+    python rollups.py dashboard [days] [segment]
+"""
+import os
+import sys
+from datetime import datetime, timedelta
+
+# Customer tag whose value is the dashboard segment
+ROLLUP_SEGMENT_TAG = os.environ.get('ROLLUP_SEGMENT_TAG', '年齡區間')
+DASHBOARD_DAYS = int(os.environ.get('DASHBOARD_DAYS', 30))
+UNKNOWN_SEGMENT = 'unknown'
+
+PURCHASE = 'purchase'
+FAREWELL = 'farewell'
+
+# Inserts the conversation's first turn, or locks the existing row and returns
+# it unchanged (the no-op DO UPDATE). xmax = 0 only for a freshly inserted row,
+# so concurrent first turns cannot both take the insert path.
+UPSERT_CONVERSATION_QUERY = """
+    INSERT INTO conversation_rollup
+        (conversation_id, day, segment, turns, stage_transitions, last_stage, outcome,
+         started_at, last_turn_at)
+    VALUES (%s, %s, %s, 1, %s, %s, %s, %s, %s)
+    ON CONFLICT (conversation_id) DO UPDATE SET conversation_id = EXCLUDED.conversation_id
+    RETURNING (xmax = 0), day, segment, last_stage, outcome, last_turn_at
+"""
+
+UPDATE_CONVERSATION_QUERY = """
+    UPDATE conversation_rollup SET
+        turns = turns + 1,
+        stage_transitions = stage_transitions + %s,
+        last_stage = %s,
+        outcome = COALESCE(outcome, %s),
+        last_turn_at = GREATEST(last_turn_at, %s)
+    WHERE conversation_id = %s
+"""
+
+UPSERT_DAILY_QUERY = """
+    INSERT INTO daily_rollup
+        (day, segment, sessions, turns, stage_transitions, purchases, farewells,
+         latency_ms_total, timed_turns, latency_ms_max, duration_ms_total)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (day, segment) DO UPDATE SET
+        sessions = daily_rollup.sessions + EXCLUDED.sessions,
+        turns = daily_rollup.turns + EXCLUDED.turns,
+        stage_transitions = daily_rollup.stage_transitions + EXCLUDED.stage_transitions,
+        purchases = daily_rollup.purchases + EXCLUDED.purchases,
+        farewells = daily_rollup.farewells + EXCLUDED.farewells,
+        latency_ms_total = daily_rollup.latency_ms_total + EXCLUDED.latency_ms_total,
+        timed_turns = daily_rollup.timed_turns + EXCLUDED.timed_turns,
+        latency_ms_max = GREATEST(daily_rollup.latency_ms_max, EXCLUDED.latency_ms_max),
+        duration_ms_total = daily_rollup.duration_ms_total + EXCLUDED.duration_ms_total
+"""
+
+DASHBOARD_QUERY = """
+    SELECT day, segment, sessions, turns, stage_transitions, purchases, farewells,
+           latency_ms_total, timed_turns, latency_ms_max, duration_ms_total
+    FROM daily_rollup
+    WHERE day >= %s {segment}
+    ORDER BY day, segment
+"""
+
+COUNTERS = ('sessions', 'turns', 'stage_transitions', 'purchases', 'farewells',
+            'latency_ms_total', 'timed_turns', 'duration_ms_total')
+
+
+def segment_of(customer_id) -> str:
+    if customer_id is None:
+        return UNKNOWN_SEGMENT
+    # Imported here so the handler does not load numpy for anonymous turns
+    import profile_store
+    store = profile_store.get_store()
+    if store is None:
+        return UNKNOWN_SEGMENT
+    values = store.profile(customer_id).get(ROLLUP_SEGMENT_TAG)
+    return values[0] if values else UNKNOWN_SEGMENT
+
+
+def record_turn(cursor, conversation_id, now, stage_before, stage_after, outcome=None,
+                latency_ms=None, segment=UNKNOWN_SEGMENT):
+    """
+    Adds one turn. `outcome` is PURCHASE, FAREWELL or None; only the first
+    outcome of a conversation is counted.
+    """
+    transition = int(stage_before is not None and stage_after != stage_before)
+    cursor.execute(UPSERT_CONVERSATION_QUERY,
+                   (conversation_id, now.date(), segment, transition, stage_after, outcome,
+                    now, now))
+    inserted, day, segment, last_stage, previous_outcome, last_turn_at = cursor.fetchone()
+    if inserted:
+        sessions, new_outcome, duration_ms = 1, outcome, 0
+    else:
+        transition = int(last_stage is not None and stage_after != last_stage)
+        cursor.execute(UPDATE_CONVERSATION_QUERY,
+                       (transition, stage_after, outcome, now, conversation_id))
+        sessions = 0
+        new_outcome = outcome if previous_outcome is None else None
+        duration_ms = max(0, int((now - last_turn_at).total_seconds() * 1000))
+
+    latency = int(latency_ms) if latency_ms is not None else 0
+    cursor.execute(UPSERT_DAILY_QUERY,
+                   (day, segment, sessions, 1, transition, int(new_outcome == PURCHASE),
+                    int(new_outcome == FAREWELL), latency, int(latency_ms is not None),
+                    latency, duration_ms))
+
+
+def summarize(rows) -> dict:
+    """Dashboard document from daily_rollup rows (DASHBOARD_QUERY column order)."""
+    columns = ('day', 'segment', 'sessions', 'turns', 'stage_transitions', 'purchases',
+               'farewells', 'latency_ms_total', 'timed_turns', 'latency_ms_max',
+               'duration_ms_total')
+    totals = dict.fromkeys(COUNTERS, 0)
+    totals['latency_ms_max'] = 0
+    by_day = {}
+    by_segment = {}
+    for row in rows:
+        record = dict(zip(columns, row))
+        for key, bucket in ((record['day'].isoformat(), by_day),
+                            (record['segment'], by_segment)):
+            group = bucket.setdefault(key, dict.fromkeys(('sessions', 'turns', 'purchases',
+                                                          'farewells'), 0))
+            for name in group:
+                group[name] += record[name]
+        for name in COUNTERS:
+            totals[name] += record[name]
+        totals['latency_ms_max'] = max(totals['latency_ms_max'], record['latency_ms_max'])
+
+    sessions = totals['sessions']
+    conversion = totals['purchases'] / sessions * 100 if sessions else 0.0
+    avg_minutes = totals['duration_ms_total'] / sessions / 60000 if sessions else 0.0
+    return {
+        # Same fields and formatting as the frontend's ConversationStats
+        'totalChats': sessions,
+        'convertedChats': totals['purchases'],
+        'conversionRate': f"{conversion:.1f}",
+        'avgDuration': f"{avg_minutes:.1f}分鐘",
+        'turns': totals['turns'],
+        'stageTransitions': totals['stage_transitions'],
+        'farewells': totals['farewells'],
+        'avgLatencyMs': (totals['latency_ms_total'] / totals['timed_turns']
+                         if totals['timed_turns'] else None),
+        'maxLatencyMs': totals['latency_ms_max'],
+        'byDay': by_day,
+        'bySegment': by_segment,
+    }
+
+
+def dashboard(cursor, days=DASHBOARD_DAYS, segment=None, today=None) -> dict:
+    since = (today or datetime.utcnow().date()) - timedelta(days=days - 1)
+    params = (since, )
+    clause = ''
+    if segment is not None:
+        clause = 'AND segment = %s'
+        params += (segment, )
+    cursor.execute(DASHBOARD_QUERY.format(segment=clause), params)
+    return summarize(cursor)
+
+
+BACKFILL_QUERY = """
+    SELECT conversation_id, username, content, created_at
+    FROM message
+    ORDER BY conversation_id, id
+"""
+
+LOCK_ROLLUPS_QUERY = "LOCK TABLE conversation_rollup, daily_rollup IN EXCLUSIVE MODE"
+
+BACKFILL_CONVERSATION_QUERY = """
+    INSERT INTO conversation_rollup
+        (conversation_id, day, segment, turns, stage_transitions, last_stage, outcome,
+         started_at, last_turn_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+
+def backfill(conn, purchase_text, farewell_text, batch=5000):
+    """
+    Rebuilds both rollup tables from the message table. Messages do not store
+    the stage, customer or latency, so backfilled conversations are in the
+    unknown segment, count one stage transition when they reached an outcome
+    and carry no latency.
+
+    Both tables are locked before the messages are read: live turns wait in
+    record_turn until the backfill commits and are then added on top, instead
+    of racing its DELETE and INSERTs.
+    """
+    lock = conn.cursor()
+    lock.execute(LOCK_ROLLUPS_QUERY)
+    lock.close()
+    conversations = {}
+    read = conn.cursor(name='rollup_backfill')  # server-side, streamed in batches
+    read.itersize = batch
+    read.execute(BACKFILL_QUERY)
+    for conversation_id, username, content, created_at in read:
+        state = conversations.get(conversation_id)
+        if state is None:
+            state = conversations[conversation_id] = {
+                'turns': 0, 'outcome': None, 'started_at': created_at, 'last_turn_at': created_at}
+        if username == '0000':
+            if state['outcome'] is None and content in (purchase_text, farewell_text):
+                state['outcome'] = PURCHASE if content == purchase_text else FAREWELL
+        else:
+            state['turns'] += 1
+        state['last_turn_at'] = max(state['last_turn_at'], created_at)
+    read.close()
+
+    daily = {}
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM conversation_rollup")
+    cursor.execute("DELETE FROM daily_rollup")
+    conversation_rows = []
+    for conversation_id, state in conversations.items():
+        day = state['started_at'].date()
+        transitions = int(state['outcome'] is not None)
+        conversation_rows.append((conversation_id, day, UNKNOWN_SEGMENT, state['turns'],
+                                  transitions, 2 if transitions else 1, state['outcome'],
+                                  state['started_at'], state['last_turn_at']))
+        totals = daily.setdefault(day, dict.fromkeys(COUNTERS, 0))
+        totals['sessions'] += 1
+        totals['turns'] += state['turns']
+        totals['stage_transitions'] += transitions
+        totals['purchases'] += int(state['outcome'] == PURCHASE)
+        totals['farewells'] += int(state['outcome'] == FAREWELL)
+        totals['duration_ms_total'] += int(
+            (state['last_turn_at'] - state['started_at']).total_seconds() * 1000)
+    cursor.executemany(BACKFILL_CONVERSATION_QUERY, conversation_rows)
+    cursor.executemany(UPSERT_DAILY_QUERY, [
+        (day, UNKNOWN_SEGMENT, t['sessions'], t['turns'], t['stage_transitions'],
+         t['purchases'], t['farewells'], 0, 0, 0, t['duration_ms_total'])
+        for day, t in daily.items()])
+    cursor.close()
+    return len(conversations), len(daily)
+
+
+if __name__ == "__main__":
+    import json
+
+    import db
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'backfill':
+        import message_creation_handler
+        with db.connection() as conn:
+            n_conversations, n_days = backfill(conn, message_creation_handler.finish(),
+                                               message_creation_handler.FAREWELL)
+        print(f"{n_conversations} conversations over {n_days} days rolled up")
+    elif command == 'dashboard':
+        days = int(sys.argv[2]) if len(sys.argv) > 2 else DASHBOARD_DAYS
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            result = dashboard(cursor, days, sys.argv[3] if len(sys.argv) > 3 else None)
+            cursor.close()
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,405 @@
+"""
+Conversation server: many concurrent sales conversations in one asyncio
+process, each with its own flow state. flow/sales_agent.py and flow/is_buy.py
+serve a single module-level session, and the Lambda handler rebuilds the state
+from Postgres on every turn; here it stays in memory between turns.
+
+A Session holds the stage, the Stage 2 count, the conversation context and the
+cached customer profile. Each turn is answered by
+message_creation_handler.answer_turn, as in the Lambda handler. Sessions idle
+for SESSION_TTL seconds, and the least recently used ones beyond
+SESSION_MAX_SESSIONS, are dropped from memory. Dirty
+sessions are written to the checkpoint store every CHECKPOINT_INTERVAL
+seconds, and a dropped session is restored from its checkpoint on its next
+turn.
+
+Usage:
+    python sessions.py [--checkpoints sessions.json | --postgres]
+
+then type one "<session id>[@<customer id>] <message>" line per turn, e.g.
+"alice@1 你好".
+"""
+import argparse
+import asyncio
+import functools
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent import futures
+
+import context_store
+import flow_client
+import message_creation_handler as handler
+
+SESSION_TTL = float(os.environ.get('SESSION_TTL', 1800))
+SESSION_MAX_SESSIONS = int(os.environ.get('SESSION_MAX_SESSIONS', 10000))
+CHECKPOINT_INTERVAL = float(os.environ.get('CHECKPOINT_INTERVAL', 30))
+SESSION_CHECKPOINT_FILE = os.environ.get('SESSION_CHECKPOINT_FILE', 'sessions.json')
+# Sessions looked at per new session when over capacity; evict() looks at all
+EVICT_SCAN = 32
+
+LOAD_CHECKPOINT_QUERY = """
+    SELECT session_id, customer_id, stage, count, outcome, turns, summary, transcript,
+           transcript_turns
+    FROM session_checkpoint
+    WHERE session_id = %s
+"""
+
+SAVE_CHECKPOINT_QUERY = """
+    INSERT INTO session_checkpoint
+        (session_id, customer_id, stage, count, outcome, turns, summary, transcript,
+         transcript_turns, updated_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
+    ON CONFLICT (session_id) DO UPDATE SET
+        customer_id = EXCLUDED.customer_id,
+        stage = EXCLUDED.stage,
+        count = EXCLUDED.count,
+        outcome = EXCLUDED.outcome,
+        turns = EXCLUDED.turns,
+        summary = EXCLUDED.summary,
+        transcript = EXCLUDED.transcript,
+        transcript_turns = EXCLUDED.transcript_turns,
+        updated_at = EXCLUDED.updated_at
+    WHERE session_checkpoint.turns <= EXCLUDED.turns
+"""
+
+
+class SessionClosed(Exception):
+    pass
+
+
+class Session:
+    __slots__ = ('session_id', 'customer_id', 'stage', 'count', 'outcome', 'turns',
+                 'context', 'profile', 'last_used', 'dirty', 'lock')
+
+    def __init__(self, session_id, customer_id=None, stage=1, count=0, outcome=None, turns=0,
+                 summary='', transcript='', transcript_turns=None):
+        self.session_id = session_id
+        self.customer_id = customer_id
+        self.stage = stage
+        self.count = count
+        self.outcome = outcome
+        self.turns = turns
+        self.context = context_store.ConversationContext(session_id, summary=summary,
+                                                         transcript=transcript,
+                                                         turns=transcript_turns)
+        self.profile = None
+        self.last_used = 0.0
+        self.dirty = False
+        # One turn at a time per session
+        self.lock = asyncio.Lock()
+
+    def checkpoint(self) -> tuple:
+        """The row of the session_checkpoint table; Session(*row) restores it."""
+        return (self.session_id, self.customer_id, self.stage, self.count, self.outcome,
+                self.turns, self.context.summary, self.context.transcript,
+                self.context.turns_json)
+
+
+class SessionStats:
+    __slots__ = ('turns', 'created', 'restored', 'evicted', 'closed', 'checkpoints',
+                 'checkpointed', 'checkpoint_seconds', 'started')
+
+    def __init__(self):
+        self.turns = 0
+        self.created = 0
+        self.restored = 0
+        self.evicted = 0
+        self.closed = 0
+        self.checkpoints = 0
+        self.checkpointed = 0
+        self.checkpoint_seconds = 0.0
+        self.started = time.perf_counter()
+
+    def as_dict(self):
+        elapsed = time.perf_counter() - self.started
+        result = {name: getattr(self, name) for name in self.__slots__ if name != 'started'}
+        result['turns_per_second'] = self.turns / elapsed if elapsed else 0.0
+        return result
+
+
+# ---- CHECKPOINT STORES ----
+class FileCheckpointStore:
+    """All checkpoints in one JSON file, rewritten atomically on every save."""
+
+    def __init__(self, path=SESSION_CHECKPOINT_FILE):
+        self.path = path
+        self.rows = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.rows = {row[0]: tuple(row) for row in json.load(f)}
+
+    def load(self, session_id):
+        return self.rows.get(session_id)
+
+    def save(self, rows):
+        for row in rows:
+            current = self.rows.get(row[0])
+            if current is None or current[5] <= row[5]:
+                self.rows[row[0]] = row
+        partial = self.path + '.tmp'
+        with open(partial, 'w', encoding='utf-8') as f:
+            json.dump(list(self.rows.values()), f, ensure_ascii=False)
+        os.replace(partial, self.path)
+
+
+class PostgresCheckpointStore:
+
+    def __init__(self, connection=None):
+        if connection is None:
+            import db
+            connection = db.connection
+        self.connection = connection
+
+    def load(self, session_id):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(LOAD_CHECKPOINT_QUERY, (session_id, ))
+            row = cursor.fetchone()
+            cursor.close()
+        return row
+
+    def save(self, rows):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(SAVE_CHECKPOINT_QUERY, rows)
+            cursor.close()
+
+
+# ---- SESSIONS ----
+class SessionManager:
+    """
+    `store` has load(session_id), returning a checkpoint row or None, and
+    save(rows). `flow` is a flow_client.FlowClient and `profiles` a
+    profile_store.ProfileStore (by default profile_store.get_store()). The
+    blocking store calls run on `executor`, apart from the flow streams, so
+    checkpoints and restores never queue behind slow flows.
+    """
+
+    def __init__(self, store, flow=None, profiles=None, ttl=SESSION_TTL,
+                 max_sessions=SESSION_MAX_SESSIONS, checkpoint_interval=CHECKPOINT_INTERVAL,
+                 executor=None, clock=time.monotonic):
+        if profiles is None:
+            import profile_store
+            profiles = profile_store.get_store()
+        self.store = store
+        self.executor = executor or futures.ThreadPoolExecutor(max_workers=4)
+        self.flow = flow or flow_client.FlowClient(executor=futures.ThreadPoolExecutor(
+            max_workers=flow_client.FLOW_MAX_CONCURRENCY))
+        self.profiles = profiles
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.checkpoint_interval = checkpoint_interval
+        self.clock = clock
+        # Least recently used first
+        self.sessions = OrderedDict()
+        # Dropped from memory while dirty, until their checkpoint is written
+        self._evicted = {}
+        self._checkpoint_lock = asyncio.Lock()
+        self._task = None
+        self.stats = SessionStats()
+
+    def _run(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def _profile(self, customer_id):
+        if self.profiles is None or customer_id is None \
+                or str(customer_id) not in self.profiles.row_of:
+            return None
+        return self.profiles.profile_text(customer_id)
+
+    async def session(self, session_id, customer_id=None) -> Session:
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self._evicted.pop(session_id, None)
+            if session is None:
+                row = await self._run(self.store.load, session_id)
+                # Another turn of the session may have brought it back meanwhile
+                session = self.sessions.get(session_id) or self._evicted.pop(session_id, None)
+                if session is None and row is not None:
+                    session = Session(*row)
+                    self.stats.restored += 1
+                elif session is None:
+                    session = Session(session_id, customer_id)
+                    self.stats.created += 1
+                if session.profile is None:
+                    session.profile = self._profile(session.customer_id)
+            self.sessions[session_id] = session
+            self._evict_lru(keep=session, scan=EVICT_SCAN)
+        self.sessions.move_to_end(session_id)
+        session.last_used = self.clock()
+        return session
+
+    def _drop(self, session):
+        del self.sessions[session.session_id]
+        if session.dirty:
+            self._evicted[session.session_id] = session
+
+    def _evict_lru(self, keep=None, scan=None):
+        excess = len(self.sessions) - self.max_sessions
+        if excess <= 0:
+            return
+        # Sessions in the middle of a turn stay, and go to the back so the
+        # next scan does not look at them again
+        victims = []
+        busy = []
+        for index, session in enumerate(self.sessions.values()):
+            if len(victims) >= excess or (scan is not None and index >= scan):
+                break
+            if session is keep or session.lock.locked():
+                busy.append(session)
+            else:
+                victims.append(session)
+        for session in busy:
+            self.sessions.move_to_end(session.session_id)
+        for session in victims:
+            self._drop(session)
+        self.stats.evicted += len(victims)
+
+    def evict(self) -> int:
+        """
+        Drops the sessions unused for `ttl` seconds, and those over
+        `max_sessions` that were busy when it was reached; returns how many.
+        """
+        evicted = self.stats.evicted
+        self._evict_lru()
+        cutoff = self.clock() - self.ttl
+        victims = []
+        for session in self.sessions.values():
+            if session.last_used > cutoff:
+                break  # the rest were used more recently
+            if not session.lock.locked():
+                victims.append(session)
+        for session in victims:
+            self._drop(session)
+        self.stats.evicted += len(victims)
+        return self.stats.evicted - evicted
+
+    async def turn(self, session_id, text, customer_id=None):
+        """One customer message; returns (stage, answer) like the Lambda handler."""
+        session = await self.session(session_id, customer_id)
+        async with session.lock:
+            if session.outcome is not None:
+                raise SessionClosed(f"session {session_id} ended with {session.outcome}")
+            # The context only changes once the answer is in, so a failed
+            # flow leaves the session as it was
+            prompt = session.context.render() + context_store.format_turn('A001', text)
+            # The turn blocks on the flow and LLM streams, so it runs on the
+            # flow executor
+            stage, answer, outcome = await asyncio.get_running_loop().run_in_executor(
+                self.flow.executor, functools.partial(
+                    handler.answer_turn, text, prompt, session.stage, session.count,
+                    session.customer_id, flow=self.flow, profile=session.profile))
+            if session.stage == 2:
+                session.count += 1
+            session.stage = stage
+            session.outcome = outcome
+            session.context.append(None, 'A001', text)
+            session.context.append(None, '0000', answer)
+            session.turns += 1
+            session.dirty = True
+            self.stats.turns += 1
+        # A finished conversation takes no more turns; only its checkpoint is left
+        if session.outcome is not None and self.sessions.get(session_id) is session:
+            self._drop(session)
+            self.stats.closed += 1
+        return session.stage, answer
+
+    async def checkpoint(self) -> int:
+        """Writes the dirty sessions, live and dropped; returns how many."""
+        async with self._checkpoint_lock:
+            sessions = list(self._evicted.values())
+            sessions += [session for session in self.sessions.values() if session.dirty]
+            if not sessions:
+                return 0
+            rows = [session.checkpoint() for session in sessions]
+            # Turns taken while the rows are written mark their session dirty again
+            for session in sessions:
+                session.dirty = False
+            started = time.perf_counter()
+            try:
+                await self._run(self.store.save, rows)
+            except Exception:
+                for session in sessions:
+                    session.dirty = True
+                raise
+            for session in sessions:
+                if self._evicted.get(session.session_id) is session and not session.dirty:
+                    del self._evicted[session.session_id]
+            self.stats.checkpoints += 1
+            self.stats.checkpointed += len(rows)
+            self.stats.checkpoint_seconds += time.perf_counter() - started
+            return len(rows)
+
+    async def maintain(self):
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            self.evict()
+            try:
+                await self.checkpoint()
+            except Exception as e:
+                print(f"Session checkpoint failed: {e}")
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self.maintain())
+        return self
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.checkpoint()
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+        return False
+
+
+async def serve(store):
+    loop = asyncio.get_running_loop()
+
+    async def answer(manager, line):
+        session_id, _, text = line.partition(' ')
+        session_id, _, customer_id = session_id.partition('@')
+        try:
+            stage, text = await manager.turn(session_id, text.strip(), customer_id or None)
+            print(f"[{session_id} stage {stage}] {text}")
+        except (flow_client.FlowError, SessionClosed) as e:
+            print(f"[{session_id}] {e}")
+
+    async with SessionManager(store) as manager:
+        pending = set()
+        while True:
+            line = await loop.run_in_executor(None, sys.stdin.readline)
+            if not line or line.strip() == 'quit':
+                break
+            if line.strip():
+                # Turns of different sessions run concurrently
+                task = loop.create_task(answer(manager, line.strip()))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.wait(pending)
+    print(f"Session stats: {manager.stats.as_dict()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoints', default=SESSION_CHECKPOINT_FILE)
+    parser.add_argument('--postgres', action='store_true',
+                        help="keep checkpoints in the session_checkpoint table")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(PostgresCheckpointStore() if args.postgres
+                          else FileCheckpointStore(args.checkpoints)))
+    except KeyboardInterrupt:
+        pass
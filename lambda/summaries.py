@@ -0,0 +1,426 @@
+"""
+Call summaries (通話摘要), generated off the request path.
+
+The message handler enqueues a conversation id when a conversation reaches an
+outcome. A worker drains the queue in batches and summarizes several
+transcripts with one model call. It upserts the summaries and deletes the
+queue messages only after the summaries are committed. A crash therefore
+leaves the messages to be redelivered, and conversations already summarized
+up to their last message are skipped. A message received SUMMARY_MAX_RECEIVES
+times without being summarized is moved to the dead-letter queue (dropped when
+there is none), so one poison conversation cannot cycle forever.
+
+Usage:
+    python summaries.py worker
+    python summaries.py enqueue 81 82 83
+"""
+import collections
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+
+SUMMARY_QUEUE_URL = os.environ.get('SUMMARY_QUEUE_URL', '')
+SUMMARY_DLQ_URL = os.environ.get('SUMMARY_DLQ_URL', '')
+SUMMARY_MAX_RECEIVES = int(os.environ.get('SUMMARY_MAX_RECEIVES', 5))
+# Seconds the worker sleeps after a throttled batch: full jitter, doubling
+SUMMARY_BACKOFF_BASE = float(os.environ.get('SUMMARY_BACKOFF_BASE', 1.0))
+SUMMARY_BACKOFF_MAX = float(os.environ.get('SUMMARY_BACKOFF_MAX', 60.0))
+# Seconds the worker waits after an empty batch or a failed one, so a queue
+# without long polling (LocalQueue) or a persistent error does not spin a core
+SUMMARY_IDLE_SLEEP = float(os.environ.get('SUMMARY_IDLE_SLEEP', 1.0))
+THROTTLING_CODES = {'ThrottlingException', 'TooManyRequestsException', 'Throttling',
+                    'RequestLimitExceeded', 'ServiceUnavailableException'}
+SUMMARY_BATCH_SIZE = int(os.environ.get('SUMMARY_BATCH_SIZE', 8))
+SUMMARY_MODEL_ID = os.environ.get('SUMMARY_MODEL_ID', 'anthropic.claude-3-5-haiku-20241022-v1:0')
+# USD per million tokens, for the cost report
+INPUT_TOKEN_PRICE = float(os.environ.get('SUMMARY_INPUT_TOKEN_PRICE', 0.8))
+OUTPUT_TOKEN_PRICE = float(os.environ.get('SUMMARY_OUTPUT_TOKEN_PRICE', 4.0))
+VISIBILITY_TIMEOUT = 120
+AWS_REGION = "us-west-2"
+
+SYSTEM_PROMPT = (
+    "你是銷售通話的分析助理。以下有多段銷售員 Luna (0000) 與客戶 (A001) 的通話逐字稿，"
+    "每段以「### 對話 <編號>」開頭。請為每段對話以繁體中文寫 2-3 句摘要，"
+    "包含客戶需求、推薦的商品與成交結果。"
+    "只輸出一個 JSON 物件，鍵為對話編號，值為 "
+    '{"summary": "...", "outcome": "成交|未成交|未完成", "products": ["..."]}。'
+)
+
+TRANSCRIPTS_QUERY = """
+    SELECT conversation_id, id, username, content
+    FROM message
+    WHERE conversation_id = ANY(%s)
+    ORDER BY conversation_id, id
+"""
+
+SUMMARIZED_QUERY = """
+    SELECT conversation_id, last_message_id
+    FROM call_summary
+    WHERE conversation_id = ANY(%s)
+"""
+
+UPSERT_SUMMARY_QUERY = """
+    INSERT INTO call_summary
+        (conversation_id, last_message_id, summary, outcome, products, model,
+         input_tokens, output_tokens, created_at, updated_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+    ON CONFLICT (conversation_id) DO UPDATE SET
+        last_message_id = EXCLUDED.last_message_id,
+        summary = EXCLUDED.summary,
+        outcome = EXCLUDED.outcome,
+        products = EXCLUDED.products,
+        model = EXCLUDED.model,
+        input_tokens = EXCLUDED.input_tokens,
+        output_tokens = EXCLUDED.output_tokens,
+        updated_at = EXCLUDED.updated_at
+    WHERE call_summary.last_message_id <= EXCLUDED.last_message_id
+"""
+
+
+# ---- QUEUES ----
+class LocalQueue:
+    """
+    In-process stand-in for SQS with the same delivery semantics: a received
+    message is invisible for `visibility_timeout` seconds and comes back unless
+    it is deleted. Dead-lettered bodies are kept in `dead`.
+    """
+
+    def __init__(self, visibility_timeout=VISIBILITY_TIMEOUT):
+        self.visibility_timeout = visibility_timeout
+        self._messages = collections.OrderedDict()  # id -> (body, visible at, receives)
+        self._receipts = {}
+        self._lock = threading.Lock()
+        self.dead = []
+
+    def send(self, body: dict):
+        with self._lock:
+            self._messages[uuid.uuid4().hex] = (json.dumps(body), 0.0, 0)
+
+    def receive(self, max_messages=10):
+        """[(receipt handle, body, receive count)] of up to max_messages visible messages."""
+        now = time.monotonic()
+        received = []
+        with self._lock:
+            for message_id, (body, visible_at, receives) in self._messages.items():
+                if len(received) == max_messages:
+                    break
+                if visible_at > now:
+                    continue
+                receipt = uuid.uuid4().hex
+                self._receipts[receipt] = message_id
+                self._messages[message_id] = (body, now + self.visibility_timeout, receives + 1)
+                received.append((receipt, json.loads(body), receives + 1))
+        return received
+
+    def delete(self, receipt):
+        with self._lock:
+            message_id = self._receipts.pop(receipt, None)
+            if message_id is not None:
+                self._messages.pop(message_id, None)
+
+    def dead_letter(self, receipt, body: dict):
+        with self._lock:
+            self.dead.append(body)
+        self.delete(receipt)
+
+    def __len__(self):
+        return len(self._messages)
+
+
+class SqsQueue:
+
+    def __init__(self, url, client=None, dead_letter_url=SUMMARY_DLQ_URL):
+        import aws_clients
+
+        self.url = url
+        self.dead_letter_url = dead_letter_url
+        self.client = client or aws_clients.client('sqs', AWS_REGION)
+
+    def send(self, body: dict):
+        self.client.send_message(QueueUrl=self.url, MessageBody=json.dumps(body))
+
+    def receive(self, max_messages=10):
+        response = self.client.receive_message(QueueUrl=self.url,
+                                               MaxNumberOfMessages=min(max_messages, 10),
+                                               WaitTimeSeconds=20,
+                                               VisibilityTimeout=VISIBILITY_TIMEOUT,
+                                               AttributeNames=['ApproximateReceiveCount'])
+        return [(message['ReceiptHandle'], json.loads(message['Body']),
+                 int(message.get('Attributes', {}).get('ApproximateReceiveCount', 1)))
+                for message in response.get('Messages', [])]
+
+    def delete(self, receipt):
+        self.client.delete_message(QueueUrl=self.url, ReceiptHandle=receipt)
+
+    def dead_letter(self, receipt, body: dict):
+        if self.dead_letter_url:
+            self.client.send_message(QueueUrl=self.dead_letter_url, MessageBody=json.dumps(body))
+        self.delete(receipt)
+
+
+_queue = None
+
+
+def get_queue():
+    """The SQS queue of SUMMARY_QUEUE_URL, or None when summaries are not configured."""
+    global _queue
+    if _queue is None and SUMMARY_QUEUE_URL:
+        _queue = SqsQueue(SUMMARY_QUEUE_URL)
+    return _queue
+
+
+def enqueue(conversation_id, outcome=None, queue=None):
+    if queue is None:
+        queue = get_queue()
+    if queue is None:
+        return False
+    queue.send({"conversationId": conversation_id, "outcome": outcome})
+    return True
+
+
+# ---- STORAGE ----
+class PostgresSummaryStore:
+
+    def __init__(self, connection=None):
+        if connection is None:
+            import db
+            connection = db.connection
+        self.connection = connection
+
+    def transcripts(self, conversation_ids):
+        """{conversation id: (last message id, [(username, content)])}"""
+        result = {}
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(TRANSCRIPTS_QUERY, (list(conversation_ids), ))
+            for conversation_id, message_id, username, content in cursor:
+                last, lines = result.setdefault(conversation_id, (0, []))
+                lines.append((username, content))
+                result[conversation_id] = (max(last, message_id), lines)
+            cursor.close()
+        return result
+
+    def summarized(self, conversation_ids):
+        """{conversation id: last message id already summarized}"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(SUMMARIZED_QUERY, (list(conversation_ids), ))
+            result = dict(cursor.fetchall())
+            cursor.close()
+        return result
+
+    def upsert(self, rows):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(UPSERT_SUMMARY_QUERY, rows)
+            cursor.close()
+
+
+# ---- SUMMARIZATION ----
+def render_batch(transcripts) -> str:
+    parts = [SYSTEM_PROMPT]
+    for conversation_id, (_, lines) in transcripts.items():
+        parts.append(f"### 對話 {conversation_id}")
+        parts.extend(f"{username}: {content}" for username, content in lines)
+    return '\n'.join(parts)
+
+
+def parse_summaries(text: str) -> dict:
+    # The model sometimes wraps the JSON in a code fence or adds a sentence
+    match = re.search(r'\{.*\}', text, re.S)
+    if match is None:
+        return {}
+    try:
+        parsed = json.loads(match.group(0))
+    except ValueError:
+        return {}
+    return {str(key): value for key, value in parsed.items() if isinstance(value, dict)}
+
+
+class SummaryStats:
+    __slots__ = ('summaries', 'skipped', 'failed', 'dead_lettered', 'errors', 'throttled',
+                 'batches', 'llm_calls', 'input_tokens', 'output_tokens', 'started')
+
+    def __init__(self):
+        self.summaries = 0
+        self.skipped = 0
+        self.failed = 0
+        self.dead_lettered = 0
+        self.errors = 0
+        self.throttled = 0
+        self.batches = 0
+        self.llm_calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.started = time.perf_counter()
+
+    @property
+    def cost(self) -> float:
+        return (self.input_tokens * INPUT_TOKEN_PRICE
+                + self.output_tokens * OUTPUT_TOKEN_PRICE) / 1e6
+
+    def as_dict(self):
+        elapsed = time.perf_counter() - self.started
+        result = {name: getattr(self, name) for name in self.__slots__ if name != 'started'}
+        result['summaries_per_second'] = self.summaries / elapsed if elapsed else 0.0
+        result['cost_usd'] = self.cost
+        result['cost_per_summary_usd'] = self.cost / self.summaries if self.summaries else 0.0
+        return result
+
+
+class SummaryWorker:
+    """
+    `llm(prompt)` returns (text, input tokens, output tokens). Each batch is
+    summarized with one call; conversations missing from the answer stay on
+    the queue and are retried, up to `max_receives` deliveries.
+    """
+
+    def __init__(self, queue, store, llm, batch_size=SUMMARY_BATCH_SIZE, model=SUMMARY_MODEL_ID,
+                 max_receives=SUMMARY_MAX_RECEIVES):
+        self.queue = queue
+        self.store = store
+        self.llm = llm
+        self.batch_size = batch_size
+        self.model = model
+        self.max_receives = max_receives
+        self.stats = SummaryStats()
+
+    def run_once(self) -> int:
+        """Processes one batch; returns the number of queue messages received."""
+        received = self.queue.receive(self.batch_size)
+        if not received:
+            return 0
+        self.stats.batches += 1
+        receipts = collections.defaultdict(list)
+        for receipt, body, receives in received:
+            try:
+                conversation_id = int(body['conversationId'])
+            except (KeyError, TypeError, ValueError):
+                conversation_id = None
+            if conversation_id is None or receives > self.max_receives:
+                print(f"Dead-lettering summary job {body} after {receives} receives")
+                self.stats.dead_lettered += 1
+                self.queue.dead_letter(receipt, body)
+                continue
+            receipts[conversation_id].append(receipt)
+        if not receipts:
+            return len(received)
+
+        transcripts = self.store.transcripts(receipts)
+        done = self.store.summarized(receipts)
+        pending = {}
+        for conversation_id in receipts:
+            last, lines = transcripts.get(conversation_id, (0, []))
+            if not lines or done.get(conversation_id, -1) >= last:
+                # Redelivered after a crash, or nothing to summarize
+                self.stats.skipped += 1
+                self._delete(receipts[conversation_id])
+            else:
+                pending[conversation_id] = (last, lines)
+        if not pending:
+            return len(received)
+
+        text, input_tokens, output_tokens = self.llm(render_batch(pending))
+        self.stats.llm_calls += 1
+        self.stats.input_tokens += input_tokens
+        self.stats.output_tokens += output_tokens
+        summaries = parse_summaries(text)
+        rows = []
+        for conversation_id, (last, _) in pending.items():
+            summary = summaries.get(str(conversation_id))
+            if summary is None:
+                self.stats.failed += 1
+                continue
+            # Tokens are attributed to the conversations of the call evenly
+            rows.append((conversation_id, last, summary.get('summary', ''),
+                         summary.get('outcome'), json.dumps(summary.get('products') or [],
+                                                            ensure_ascii=False),
+                         self.model, input_tokens // len(pending),
+                         output_tokens // len(pending)))
+        if rows:
+            self.store.upsert(rows)
+            self.stats.summaries += len(rows)
+        # Only committed summaries are acknowledged
+        for row in rows:
+            self._delete(receipts[row[0]])
+        return len(received)
+
+    def _delete(self, receipts):
+        for receipt in receipts:
+            self.queue.delete(receipt)
+
+    def run(self, idle_exit=False):
+        """
+        Loops over batches. A failed batch is logged and left on the queue for
+        redelivery; a throttled one pauses the worker with backoff, any other
+        failure and an empty batch for SUMMARY_IDLE_SLEEP.
+        """
+        throttled = 0
+        while True:
+            try:
+                received = self.run_once()
+                throttled = 0
+            except Exception as e:
+                self.stats.errors += 1
+                code = getattr(e, 'response', {}).get('Error', {}).get('Code', '')
+                if code in THROTTLING_CODES:
+                    self.stats.throttled += 1
+                    delay = random.uniform(0, min(SUMMARY_BACKOFF_MAX,
+                                                  SUMMARY_BACKOFF_BASE * 2 ** throttled))
+                    throttled += 1
+                    print(f"Summary batch throttled ({e}), retrying in {delay:.1f}s")
+                    time.sleep(delay)
+                else:
+                    print(f"Summary batch failed, left for redelivery: {e!r}")
+                    time.sleep(SUMMARY_IDLE_SLEEP)
+                continue
+            if not received:
+                if idle_exit:
+                    return self.stats
+                time.sleep(SUMMARY_IDLE_SLEEP)
+
+
+def bedrock_llm(client=None, model=SUMMARY_MODEL_ID, max_tokens=4096):
+    if client is None:
+        import aws_clients
+        client = aws_clients.client('bedrock-runtime', AWS_REGION)
+
+    def llm(prompt):
+        body = {
+            "anthropic_version": "bedrock-2023-05-31",
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": max_tokens,
+            "temperature": 0.2,
+        }
+        response = client.invoke_model(modelId=model, contentType="application/json",
+                                       accept="*/*", body=json.dumps(body))
+        payload = json.loads(response['body'].read())
+        usage = payload.get('usage', {})
+        return (payload['content'][0]['text'], usage.get('input_tokens', 0),
+                usage.get('output_tokens', 0))
+
+    return llm
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'worker':
+        if get_queue() is None:
+            print("SUMMARY_QUEUE_URL is not set")
+            sys.exit(1)
+        worker = SummaryWorker(get_queue(), PostgresSummaryStore(), bedrock_llm())
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            print(f"Summary stats: {worker.stats.as_dict()}")
+    elif command == 'enqueue':
+        for conversation_id in sys.argv[2:]:
+            enqueue(int(conversation_id))
+    else:
+        print(__doc__)
+        sys.exit(1)
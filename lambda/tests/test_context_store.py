@@ -0,0 +1,97 @@
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import context_store
+import replay_fakes
+
+NOW = datetime(2025, 3, 1, 9, 0, 0)
+
+
+class ConversationContextTest(unittest.TestCase):
+
+    def test_append_skips_messages_already_seen(self):
+        context = context_store.ConversationContext(1)
+        context.append(1, 'A001', "你好")
+        context.append(2, '0000', "您好，我是 Luna")
+        context.append(2, '0000', "您好，我是 Luna")
+        context.append(None, 'A001', "我想買")
+        self.assertEqual(context.transcript, "A001: 你好\n0000: 您好，我是 Luna\nA001: 我想買\n")
+        self.assertEqual(context.last_message_id, 2)
+        self.assertTrue(context.dirty)
+
+    def test_old_turns_are_folded_into_the_summary(self):
+        context = context_store.ConversationContext(1)
+        with mock.patch.object(context_store, 'CONTEXT_TOKEN_BUDGET', 30), \
+                mock.patch.object(context_store, 'SUMMARY_LINE_CHARS', 8):
+            for message_id in range(1, 6):
+                context.append(message_id, 'A001', f"第{message_id}句話說得比較長一些")
+        self.assertLessEqual(context.tokens, 30)
+        self.assertTrue(context.transcript.endswith("A001: 第5句話說得比較長一些\n"))
+        self.assertIn("A001: 第1…", context.summary)
+        rendered = context.render()
+        self.assertTrue(rendered.startswith("Earlier conversation (summary):\n"))
+        self.assertIn("Recent conversation:\n" + context.transcript, rendered)
+
+    def test_latest_turn_is_kept_verbatim(self):
+        context = context_store.ConversationContext(1)
+        with mock.patch.object(context_store, 'CONTEXT_TOKEN_BUDGET', 10):
+            context.append(1, 'A001', "這是一段超過預算的很長的訊息")
+        self.assertEqual(context.transcript, "A001: 這是一段超過預算的很長的訊息\n")
+
+    def test_multiline_turns_survive_a_snapshot(self):
+        context = context_store.ConversationContext(1)
+        context.append(1, '0000', "推薦：\n- 葉黃素\n- 龜鹿精")
+        restored = context_store.ConversationContext(1, turns=context.turns_json)
+        self.assertEqual(list(restored.turns), list(context.turns))
+        legacy = context_store.ConversationContext(1, transcript=context.transcript)
+        self.assertEqual(len(legacy.turns), 3)
+
+
+class LoadSaveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.database = replay_fakes.FakeDatabase()
+        context_store.invalidate(7)
+        self.addCleanup(context_store.invalidate, 7)
+
+    def message(self, username, content):
+        with self.database.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO message (conversation_id, username, content, created_at,"
+                           " updated_at) VALUES (%s, %s, %s, %s, %s)",
+                           (7, username, content, NOW, NOW))
+
+    def load(self):
+        with self.database.connection() as conn:
+            cursor = conn.cursor()
+            context = context_store.load(cursor, 7)
+            context_store.save(cursor, context)
+        return context
+
+    def test_only_new_messages_are_read(self):
+        self.message('A001', "你好")
+        self.message('0000', "您好")
+        first = self.load()
+        self.message('A001', "我膝蓋痛")
+        with mock.patch.object(context_store, 'format_turn',
+                               wraps=context_store.format_turn) as format_turn:
+            second = self.load()
+        self.assertIs(first, second)
+        format_turn.assert_called_once_with('A001', "我膝蓋痛")
+        self.assertEqual(second.last_message_id, 3)
+
+    def test_snapshot_is_used_after_the_cache_is_dropped(self):
+        self.message('A001', "你好")
+        self.message('0000', "推薦：\n- 葉黃素")
+        saved = self.load()
+        context_store.invalidate(7)
+        self.database.messages.clear()  # the snapshot alone must be enough
+        restored = self.load()
+        self.assertIsNot(restored, saved)
+        self.assertEqual(list(restored.turns), list(saved.turns))
+        self.assertEqual(restored.last_message_id, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import unittest
+from unittest import mock
+
+import psycopg2
+from psycopg2 import extensions
+
+import db
+
+
+class FakeCursor:
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query, params=()):
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.conn.queries.append(query)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.queries = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.info = mock.Mock(transaction_status=extensions.TRANSACTION_STATUS_IDLE)
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+        db.close_pool()
+        self.opened = []
+        patch = mock.patch.object(psycopg2, 'connect', side_effect=self.connect)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.addCleanup(db.close_pool)
+
+    def connect(self, *args, **kwargs):
+        conn = FakeConnection()
+        self.opened.append(conn)
+        return conn
+
+    def use(self):
+        with db.connection() as conn:
+            conn.cursor().execute("SELECT 1")
+        return conn
+
+    def test_connection_is_reused_and_committed(self):
+        first = self.use()
+        second = self.use()
+        self.assertIs(first, second)
+        self.assertEqual(len(self.opened), 1)
+        self.assertEqual(first.commits, 2)
+        self.assertFalse(first.closed)
+
+    def test_concurrent_users_get_their_own_connections(self):
+        with db.connection() as first:
+            with db.connection() as second:
+                self.assertIsNot(first, second)
+        self.assertEqual(len(self.opened), 2)
+        # Both stay open for the next callers
+        self.use()
+        self.use()
+        self.assertEqual(len(self.opened), 2)
+        self.assertFalse(any(conn.closed for conn in self.opened))
+
+    def test_error_rolls_back_and_keeps_the_connection(self):
+        with self.assertRaises(ValueError):
+            with db.connection() as conn:
+                raise ValueError("bad input")
+        self.assertEqual((conn.commits, conn.rollbacks), (0, 1))
+        self.assertIs(self.use(), conn)
+
+    def test_broken_connection_is_replaced(self):
+        with self.assertRaises(psycopg2.OperationalError):
+            with db.connection() as conn:
+                conn.broken = True
+                conn.cursor().execute("SELECT 1")
+        self.assertTrue(conn.closed)
+        self.assertIsNot(self.use(), conn)
+        self.assertEqual(len(self.opened), 2)
+
+    def test_idle_connection_is_pinged(self):
+        conn = self.use()
+        with mock.patch.object(db, 'DB_HEALTHCHECK_INTERVAL', 0):
+            self.assertIs(self.use(), conn)
+            self.assertEqual(conn.queries.count("SELECT 1"), 3)  # two uses and the ping
+            conn.broken = True
+            replacement = self.use()
+        self.assertIsNot(replacement, conn)
+        self.assertTrue(conn.closed)
+
+    def test_without_pooling_every_call_connects(self):
+        with mock.patch.object(db, 'DB_POOLING', False):
+            first = self.use()
+            second = self.use()
+        self.assertIsNot(first, second)
+        self.assertTrue(first.closed and second.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+from botocore.exceptions import ClientError
+
+import flow_client
+from flow_fake_server import FakeFlowServer
+
+
+def output(node, document="檢索結果"):
+    return {'flowOutputEvent': {'nodeName': node, 'content': {'document': document}}}
+
+
+COMPLETION = {'flowCompletionEvent': {'completionReason': 'SUCCESS'}}
+
+
+def client_error(code):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, 'InvokeFlow')
+
+
+class ScriptedRuntime:
+    """invoke_flow plays one script per attempt: an exception, or a list of events
+    in which an exception is raised mid-stream and a number is a pause in seconds."""
+
+    def __init__(self, *attempts):
+        self.attempts = list(attempts)
+        self.calls = 0
+
+    def invoke_flow(self, **kwargs):
+        script = self.attempts[min(self.calls, len(self.attempts) - 1)]
+        self.calls += 1
+        if isinstance(script, Exception):
+            raise script
+
+        def events():
+            for item in script:
+                if isinstance(item, Exception):
+                    raise item
+                if isinstance(item, (int, float)):
+                    time.sleep(item)
+                    continue
+                yield item
+
+        return {'responseStream': events()}
+
+
+class FlowClientTest(unittest.TestCase):
+
+    def setUp(self):
+        patch = mock.patch.object(flow_client, 'backoff', return_value=0.0)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_invoke_collects_the_stream(self):
+        runtime = ScriptedRuntime([{'chunk': {'bytes': "你好".encode('utf-8')}},
+                                   output('FlowOutputNode_1', "請問您幾歲？"), COMPLETION])
+        seen = []
+        result = flow_client.FlowClient(runtime).invoke('flow', 'alias', "A001: 你好",
+                                                        on_event=seen.append)
+        self.assertEqual(result.text, "你好請問您幾歲？")
+        self.assertEqual(result.outputs, [('FlowOutputNode_1', "請問您幾歲？")])
+        self.assertEqual((result.completion_reason, result.attempts), ('SUCCESS', 1))
+        self.assertEqual([event.kind for event in seen],
+                         [flow_client.CHUNK, flow_client.OUTPUT, flow_client.COMPLETION])
+
+    def test_throttled_call_is_retried(self):
+        runtime = ScriptedRuntime(client_error('ThrottlingException'),
+                                  [client_error('serviceUnavailableException')],
+                                  [output('FlowOutputNode_2'), COMPLETION])
+        result = flow_client.FlowClient(runtime).invoke('flow', 'alias', "文件")
+        self.assertEqual(result.attempts, 3)
+        self.assertEqual(result.outputs[0][0], 'FlowOutputNode_2')
+
+    def test_permanent_errors_and_exhausted_retries(self):
+        runtime = ScriptedRuntime(client_error('ValidationException'))
+        with self.assertRaises(flow_client.FlowError):
+            list(flow_client.FlowClient(runtime).events('flow', 'alias', "文件"))
+        self.assertEqual(runtime.calls, 1)
+
+        runtime = ScriptedRuntime(client_error('ThrottlingException'))
+        with self.assertRaises(flow_client.FlowError):
+            list(flow_client.FlowClient(runtime, retries=2).events('flow', 'alias', "文件"))
+        self.assertEqual(runtime.calls, 3)
+
+    def test_no_retry_after_an_event_was_delivered(self):
+        runtime = ScriptedRuntime([output('FlowOutputNode_1'),
+                                   client_error('ThrottlingException')])
+        events = flow_client.FlowClient(runtime).events('flow', 'alias', "文件")
+        self.assertEqual(next(events).node_name, 'FlowOutputNode_1')
+        with self.assertRaises(flow_client.FlowError):
+            next(events)
+        self.assertEqual(runtime.calls, 1)
+
+    def test_stalled_stream_times_out_at_the_deadline(self):
+        runtime = ScriptedRuntime([output('FlowOutputNode_1'), 1.0, COMPLETION])
+        events = flow_client.FlowClient(runtime, timeout=0.2).events('flow', 'alias', "文件")
+        started = time.monotonic()
+        with self.assertRaises(flow_client.FlowTimeout):
+            list(events)
+        self.assertLess(time.monotonic() - started, 0.6)
+
+    def test_slot_is_released_when_the_stream_ends(self):
+        slots = threading.BoundedSemaphore(1)
+        with mock.patch.object(flow_client, '_slots', slots):
+            runtime = ScriptedRuntime([0.3, COMPLETION])
+            with self.assertRaises(flow_client.FlowTimeout):
+                list(flow_client.FlowClient(runtime, timeout=0.1).events('flow', 'alias', "文件"))
+            # The abandoned stream still holds the slot until it ends
+            with self.assertRaises(flow_client.FlowTimeout):
+                list(flow_client.FlowClient(ScriptedRuntime([COMPLETION]), timeout=0.05)
+                     .events('flow', 'alias', "文件"))
+            self.assertTrue(slots.acquire(timeout=1))
+            slots.release()
+
+    def test_aevents(self):
+        runtime = ScriptedRuntime([output('FlowOutputNode_2'), COMPLETION])
+
+        async def collect():
+            return [event.kind async for event in
+                    flow_client.FlowClient(runtime).aevents('flow', 'alias', "文件")]
+
+        self.assertEqual(asyncio.run(collect()), [flow_client.OUTPUT, flow_client.COMPLETION])
+
+    def test_parse_event(self):
+        self.assertEqual(flow_client.parse_event({'flowTraceEvent': {}}).kind, flow_client.TRACE)
+        event = flow_client.parse_event({'flowMultiTurnInputRequestEvent': {
+            'nodeName': 'Agent', 'content': {'document': "還需要什麼？"}}})
+        self.assertEqual((event.kind, event.node_name, event.document),
+                         (flow_client.INPUT_REQUEST, 'Agent', "還需要什麼？"))
+        self.assertEqual(flow_client.parse_event({'somethingNew': {}}).kind, flow_client.UNKNOWN)
+
+
+class WireTest(unittest.TestCase):
+    """The real boto3 client against flow_fake_server."""
+
+    def test_event_stream(self):
+        with FakeFlowServer(flows={'f': lambda document: ['FlowOutputNode_2']}) as server:
+            client = flow_client.FlowClient(server.client(**flow_client.CLIENT_CONFIG))
+            result = client.invoke('f', 'a', "A001: 我膝蓋痛")
+        self.assertEqual(result.outputs[0][0], 'FlowOutputNode_2')
+        self.assertEqual(result.completion_reason, 'SUCCESS')
+
+    def test_in_stream_throttling_is_retried_then_fails(self):
+        with mock.patch.object(flow_client, 'backoff', return_value=0.0), \
+                FakeFlowServer(stream_error=1.0) as server:
+            client = flow_client.FlowClient(server.client(**flow_client.CLIENT_CONFIG), retries=2)
+            with self.assertRaises(flow_client.FlowError) as raised:
+                client.invoke('f', 'a', "文件")
+            self.assertEqual(server.requests, 3)
+        self.assertNotIsInstance(raised.exception, flow_client.FlowTimeout)
+
+
+if __name__ == "__main__":
+    unittest.main()
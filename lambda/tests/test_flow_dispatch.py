@@ -0,0 +1,111 @@
+import threading
+import time
+import unittest
+
+import flow_client
+import flow_dispatch
+import message_creation_handler as handler
+import replay_fakes
+from replay_fakes import Latency
+
+
+def speak(words, delay=0.0, release=None, on_text=None):
+    """Follow-up call stand-in: streams `words` and returns them joined."""
+    if release is not None:
+        release.wait(1)
+    for word in words:
+        time.sleep(delay)
+        if on_text is not None:
+            on_text(word)
+    return ''.join(words)
+
+
+class FailingFlow:
+    """FlowClient stand-in whose stream fails right after one flow output."""
+
+    def __init__(self, node_name):
+        self.node_name = node_name
+
+    def events(self, flow_id, alias_id, document):
+        output = {'nodeName': self.node_name, 'content': {'document': "商品資料"}}
+        yield flow_client.FlowEvent(flow_client.OUTPUT, output, node_name=self.node_name)
+        raise flow_client.FlowTimeout("no event within the deadline")
+
+
+class FlowOutputDispatcherTest(unittest.TestCase):
+
+    def test_text_is_forwarded_in_dispatch_order(self):
+        deltas = []
+        dispatcher = flow_dispatch.FlowOutputDispatcher(on_text=deltas.append)
+        release = threading.Event()
+        first = dispatcher.dispatch('a', speak, words=["一", "二"], release=release)
+        second = dispatcher.dispatch('b', speak, words=["三", "四"])
+        second.future.result()
+        self.assertEqual(deltas, [])  # the second job waits for the first
+        release.set()
+        dispatcher.close()
+        dispatcher.wait()
+        self.assertEqual(deltas, ["一", "二", "三", "四"])
+        self.assertEqual([dispatcher.result(first), dispatcher.result(second)], ["一二", "三四"])
+
+    def test_superseded_job_is_never_voiced(self):
+        deltas = []
+        dispatcher = flow_dispatch.FlowOutputDispatcher(
+            on_text=deltas.append, supersedes={'recommend': {'question'}})
+        question = dispatcher.dispatch('question', speak, words=["您幾歲？"])
+        question.future.result()
+        self.assertEqual(deltas, [])  # held until no recommendation can come
+        recommend = dispatcher.dispatch('recommend', speak, words=["推薦", "龜鹿精"])
+        dispatcher.close()
+        dispatcher.wait()
+        self.assertEqual(deltas, ["推薦", "龜鹿精"])
+        self.assertIsNone(dispatcher.result(question))
+        self.assertEqual(dispatcher.result(recommend), "推薦龜鹿精")
+
+    def test_abort_stops_forwarding(self):
+        deltas = []
+        dispatcher = flow_dispatch.FlowOutputDispatcher(on_text=deltas.append)
+        job = dispatcher.dispatch('a', speak, words=["字"] * 20, delay=0.01)
+        time.sleep(0.05)
+        dispatcher.abort()
+        forwarded = len(deltas)
+        dispatcher.wait()
+        self.assertLess(forwarded, 20)
+        self.assertEqual(len(deltas), forwarded)
+        self.assertIsNone(dispatcher.result(job))
+
+    def test_without_on_text_the_calls_do_not_stream(self):
+        dispatcher = flow_dispatch.FlowOutputDispatcher()
+        job = dispatcher.dispatch('a', speak, words=["好", "的"])
+        dispatcher.close()
+        self.assertEqual(dispatcher.result(job), "好的")
+
+
+class FailedFlowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.llm = handler.bedrock_llm_runtime
+        handler.bedrock_llm_runtime = replay_fakes.FakeBedrockRuntime(
+            first_token=Latency(50), per_token=Latency(5))
+
+    def tearDown(self):
+        handler.bedrock_llm_runtime = self.llm
+
+    def assert_silent_after_failure(self, call):
+        deltas = []
+        with self.assertRaises(flow_client.FlowTimeout):
+            call(deltas.append)
+        time.sleep(0.3)
+        self.assertEqual(deltas, [])
+
+    def test_stage_1(self):
+        self.assert_silent_after_failure(lambda on_text: handler.invoke_rag_flow(
+            "A001: 你好", on_text=on_text, flow=FailingFlow('FlowOutputNode_2')))
+
+    def test_stage_2(self):
+        self.assert_silent_after_failure(lambda on_text: handler.invoke_rag_flow_stage_2(
+            "A001: 再想想", 0, on_text=on_text, flow=FailingFlow('FlowOutputode_1')))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+
+import intent
+
+
+def label(utterance):
+    return intent.rule_label(intent.normalize(utterance))
+
+
+class RuleLabelTest(unittest.TestCase):
+
+    def test_buy(self):
+        for utterance in ("好，我要買", "幫我下單兩盒", "我要一盒", "那就我買"):
+            with self.subTest(utterance=utterance):
+                self.assertEqual(label(utterance), intent.BUY)
+
+    def test_decline(self):
+        for utterance in ("我再考慮一下", "我不要買", "我買不起", "不用了，謝謝"):
+            with self.subTest(utterance=utterance):
+                self.assertEqual(label(utterance), intent.NOT_BUY)
+
+    def test_no_rule(self):
+        # Questions and small talk are left to the model or the flow
+        for utterance in ("這個多少錢", "你好"):
+            with self.subTest(utterance=utterance):
+                self.assertIsNone(label(utterance))
+
+    def test_buy_phrase_inside_a_sentence_is_not_an_ending(self):
+        self.assertIsNone(label("我買過類似的"))
+
+    def test_simplified_input(self):
+        self.assertEqual(label("好，帮我下单"), intent.BUY)
+
+
+if __name__ == "__main__":
+    unittest.main()
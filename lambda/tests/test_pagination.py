@@ -0,0 +1,74 @@
+import unittest
+from datetime import datetime, timedelta
+
+import pagination
+
+
+def rows(n):
+    start = datetime(2025, 1, 1, 12, 0, 0)
+    return [(n - i, start - timedelta(minutes=i)) for i in range(n)]
+
+
+def event(**query):
+    return {'params': {'querystring': query}}
+
+
+class CursorTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        created_at = datetime(2025, 1, 1, 12, 30, 15, 123456)
+        cursor = pagination.encode_cursor(created_at, 42)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(pagination.decode_cursor(cursor), (created_at, 42))
+
+    def test_invalid_cursor(self):
+        for cursor in ("not a cursor", pagination.encode_cursor(datetime(2025, 1, 1), 1)[:-3]):
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(pagination.InvalidCursor):
+                    pagination.decode_cursor(cursor)
+
+
+class PageRequestTest(unittest.TestCase):
+
+    def test_unpaged(self):
+        self.assertEqual(pagination.page_request({}),
+                         (False, pagination.UNPAGED_LIMIT, None))
+
+    def test_limit_is_clamped(self):
+        self.assertEqual(pagination.page_request(event(limit='0'))[1], 1)
+        self.assertEqual(pagination.page_request(event(limit='100000'))[1],
+                         pagination.MAX_PAGE_SIZE)
+        self.assertEqual(pagination.page_request(event(limit='x'))[1], pagination.PAGE_SIZE)
+
+    def test_cursor(self):
+        created_at = datetime(2025, 1, 1)
+        paged, _, after = pagination.page_request(
+            event(cursor=pagination.encode_cursor(created_at, 7)))
+        self.assertTrue(paged)
+        self.assertEqual(after, (created_at, 7))
+
+
+class ReadPageTest(unittest.TestCase):
+
+    def read(self, n, limit):
+        return pagination.read_page(iter(rows(n)), limit, lambda row: row[0],
+                                    created_at_index=1, id_index=0)
+
+    def test_last_page(self):
+        self.assertEqual(self.read(3, 5), ([3, 2, 1], None))
+
+    def test_next_cursor_points_at_the_last_item(self):
+        items, cursor = self.read(6, 5)
+        self.assertEqual(items, [6, 5, 4, 3, 2])
+        self.assertEqual(pagination.decode_cursor(cursor), rows(6)[4][::-1])
+
+    def test_unpaged_response(self):
+        self.assertEqual(pagination.response([1, 2], None, paged=False), [1, 2])
+        self.assertEqual(pagination.response([1, 2], 'c', paged=False),
+                         {'items': [1, 2], 'nextCursor': 'c', 'truncated': True})
+        self.assertEqual(pagination.response([1, 2], None, paged=True),
+                         {'items': [1, 2], 'nextCursor': None})
+
+
+if __name__ == "__main__":
+    unittest.main()
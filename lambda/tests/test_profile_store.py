@@ -0,0 +1,92 @@
+import os
+import random
+import tempfile
+import unittest
+
+import profile_store
+
+AGES = ['40-49', '50-59', '60-69']
+CITIES = ['台北市大安區', '台北市信義區', '新北市板橋區', '台中市西屯區']
+CATEGORIES = ['保健食品', '美容保養', '居家用品']
+
+
+def make_rows(n=150, seed=0):
+    # More than two bitset words, and some customers with several values per tag
+    rng = random.Random(seed)
+    rows = []
+    for index in range(n):
+        customer_id = f"C{index:04d}"
+        rows.append((customer_id, '基本資料', '人口', '年齡區間', rng.choice(AGES)))
+        rows.append((customer_id, '基本資料', '地址', '居住縣市', rng.choice(CITIES)))
+        for category in rng.sample(CATEGORIES, rng.randint(1, 2)):
+            rows.append((customer_id, '偏好', '商品', '可推薦商品類別', category))
+    rows.append(rows[0])  # a duplicate row
+    return rows
+
+
+class ProfileStoreTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.rows = make_rows()
+        cls.store = profile_store.ProfileStore.from_rows(cls.rows)
+        cls.expected = {}
+        for customer_id, _, _, tag, value in cls.rows:
+            values = cls.expected.setdefault(customer_id, {}).setdefault(tag, [])
+            if value not in values:
+                values.append(value)
+
+    def brute_force(self, predicate):
+        return [customer_id for customer_id, profile in self.expected.items()
+                if predicate(profile)]
+
+    def test_profile(self):
+        self.assertEqual(len(self.store), 150)
+        for customer_id in ('C0000', 'C0077', 'C0149'):
+            profile = self.store.profile(customer_id)
+            self.assertEqual({tag: sorted(values) for tag, values in profile.items()},
+                             {tag: sorted(values)
+                              for tag, values in self.expected[customer_id].items()})
+        self.assertEqual(self.store.profile('C9999'), {})
+        text = self.store.profile_text('C0001')
+        self.assertTrue(text.startswith("客代: C0001\n"))
+        self.assertIn(f"年齡區間: {self.expected['C0001']['年齡區間'][0]}\n", text + '\n')
+
+    def test_segment_matches_a_scan(self):
+        conditions = {'年齡區間': '60-69', '居住縣市': '台北市*'}
+        expected = self.brute_force(lambda p: p['年齡區間'] == ['60-69']
+                                    and p['居住縣市'][0].startswith('台北市'))
+        self.assertEqual(self.store.segment(conditions), expected)
+        self.assertEqual(self.store.count(conditions), len(expected))
+
+    def test_list_is_an_or_and_tags_are_anded(self):
+        conditions = {'年齡區間': ['40-49', '50-59'], '可推薦商品類別': '*保健*'}
+        expected = self.brute_force(lambda p: p['年齡區間'][0] in ('40-49', '50-59')
+                                    and '保健食品' in p['可推薦商品類別'])
+        self.assertEqual(self.store.segment(conditions), expected)
+
+    def test_empty_conditions_and_unknown_values(self):
+        self.assertEqual(self.store.count({}), 150)
+        self.assertEqual(self.store.segment({'年齡區間': '90-99'}), [])
+        self.assertEqual(self.store.count({'不存在的標籤': '*'}), 0)
+
+    def test_snapshot_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'profiles.bin')
+            self.store.save(path)
+            loaded = profile_store.ProfileStore.load(path)
+        self.assertEqual(loaded.customer_ids, self.store.customer_ids)
+        self.assertEqual(loaded.profile('C0042'), self.store.profile('C0042'))
+        conditions = {'居住縣市': '新北市*'}
+        self.assertEqual(loaded.segment(conditions), self.store.segment(conditions))
+
+    def test_load_rejects_other_files(self):
+        with tempfile.NamedTemporaryFile(suffix='.bin', delete=False) as f:
+            f.write(b'not a snapshot')
+        self.addCleanup(os.unlink, f.name)
+        with self.assertRaises(ValueError):
+            profile_store.ProfileStore.load(f.name)
+
+
+if __name__ == "__main__":
+    unittest.main()
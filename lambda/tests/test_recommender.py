@@ -0,0 +1,92 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import profile_store
+import recommender
+import retrieval
+
+PRODUCTS = [
+    recommender.Product('產品A', '龜鹿精', '保健食品',
+                        "商品名稱: 龜鹿精\n商品類別: 保健食品\n主要功能: 關節保養\n適用族群: 銀髮族"),
+    recommender.Product('產品B', '葉黃素', '保健食品',
+                        "商品名稱: 葉黃素\n商品類別: 保健食品\n主要功能: 眼睛保健\n適用族群: 上班族"),
+    recommender.Product('產品C', '果膠', '美容保養',
+                        "商品名稱: 果膠\n商品類別: 美容保養\n主要功能: 體重管理\n適用族群: 上班族"),
+]
+
+ROWS = [
+    ('1', '基本', '人口', '年齡區間', '60-69'),
+    ('1', '偏好', '商品', '可推薦商品類別', '保健食品'),
+    ('1', '偏好', '瀏覽', '保健瀏覽', '關節'),
+    ('2', '基本', '人口', '年齡區間', '30-39'),
+    ('2', '偏好', '商品', '可推薦商品類別', '美容保養'),
+    ('3', '基本', '人口', '是否有高健康意識', '是'),
+]
+
+
+class RecommenderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = profile_store.ProfileStore.from_rows(ROWS)
+        self.engine = recommender.Recommender(self.store, products=PRODUCTS)
+
+    def test_pair_weights(self):
+        turtle = PRODUCTS[0]
+        self.assertEqual(recommender.pair_weight('可推薦商品類別', '保健食品', turtle)[0],
+                         recommender.CATEGORY_MATCH)
+        self.assertEqual(recommender.pair_weight('保健瀏覽', '關節', turtle)[0],
+                         recommender.BROWSE_MATCH)
+        self.assertEqual(recommender.pair_weight('年齡區間', '60-69', turtle)[0],
+                         recommender.SENIOR_MATCH)
+        self.assertEqual(recommender.pair_weight('年齡區間', '30-39', turtle), (0.0, None))
+        self.assertEqual(recommender.pair_weight('是否有高健康意識', '是', turtle)[0],
+                         recommender.HEALTH_CONSCIOUS)
+
+    def test_recommend_ranks_with_reasons(self):
+        ranking = self.engine.recommend('1')
+        self.assertEqual([product.key for product, _, _ in ranking], ['產品A', '產品B', '產品C'])
+        product, score, reasons = ranking[0]
+        self.assertEqual(score, recommender.CATEGORY_MATCH + recommender.BROWSE_MATCH
+                         + recommender.SENIOR_MATCH)
+        self.assertEqual(reasons[0], "可推薦商品類別為保健食品")  # heaviest first
+        self.assertEqual(len(reasons), 3)
+        self.assertTrue(self.engine.is_confident(ranking))
+        self.assertEqual(self.engine.recommend(1, k=1)[0][0].key, '產品A')
+
+    def test_unknown_or_unsure_customers(self):
+        self.assertEqual(self.engine.recommend('404'), [])
+        self.assertFalse(self.engine.is_confident([]))
+        # Health conscious only: every product scores the same
+        self.assertFalse(self.engine.is_confident(self.engine.recommend('3')))
+
+    def test_score_all_matches_single_customers(self):
+        top, scores = self.engine.top_k_all(k=2)
+        for row, customer_id in enumerate(self.store.customer_ids):
+            single, _ = self.engine.scores(customer_id)
+            np.testing.assert_allclose(scores[row], single)
+        self.assertEqual(top[1, 0], 2)  # customer 2 prefers 果膠
+
+    def test_customer_without_tags_scores_zero(self):
+        store = profile_store.ProfileStore(['1', '2'], {'年齡區間': ('基本', '人口')},
+                                           [('年齡區間', '60-69')], [0, 0, 1], [0])
+        engine = recommender.Recommender(store, products=PRODUCTS)
+        scores = engine.score_all()
+        self.assertFalse(scores[0].any())
+        self.assertEqual(scores[1, 0], recommender.SENIOR_MATCH)
+
+    def test_product_details_without_retrieval(self):
+        with mock.patch.object(retrieval, 'RETRIEVAL_TOP_K', 0):
+            details = recommender.product_details(self.engine.recommend('2', k=1), query="減肥")
+        self.assertTrue(details.startswith("商品名稱: 果膠"))
+        self.assertTrue(details.endswith("推薦理由: 可推薦商品類別為美容保養"))
+
+    def test_load_products(self):
+        products = recommender.load_products()
+        self.assertEqual([product.key for product in products], ['產品A', '產品B', '產品C'])
+        self.assertTrue(all(product.name and product.category for product in products))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+import recommender
+import retrieval
+
+PASSAGES = [
+    ("龜鹿精 主要功能: 關節保養，膝蓋痠痛、行動不便的長輩適用", '產品A'),
+    ("龜鹿精 價格: 買三送三，平均一盒990元", '產品A'),
+    ("葉黃素 主要功能: 舒緩眼睛乾澀，適合長時間看手機", '產品B'),
+    ("葉黃素 價格: 買九送九，平均一盒495元", '產品B'),
+    ("果膠 主要功能: 增加飽足感，幫助體重管理", '產品C'),
+    ("果膠 價格: 買一送四，五盒1980元", '產品C'),
+]
+
+
+class HashingEmbedderTest(unittest.TestCase):
+
+    def test_unit_rows_and_determinism(self):
+        texts = ["膝蓋痠痛", "眼睛乾澀", ""]
+        first = retrieval.HashingEmbedder(dim=64).embed(texts)
+        second = retrieval.HashingEmbedder(dim=64).embed(texts)
+        np.testing.assert_array_equal(first, second)
+        np.testing.assert_allclose(np.linalg.norm(first[:2], axis=1), 1.0, rtol=1e-6)
+        self.assertFalse(first[2].any())
+
+    def test_similar_texts_score_higher(self):
+        embedder = retrieval.HashingEmbedder().fit([text for text, _ in PASSAGES])
+        query, near, far = embedder.embed(["膝蓋痠痛", "關節保養，膝蓋痠痛", "眼睛乾澀"])
+        self.assertGreater(query @ near, query @ far)
+
+
+class ChunkDocumentTest(unittest.TestCase):
+
+    def test_sections_get_the_title(self):
+        text = "商品名稱: 龜鹿精\n商品類別: 保健食品\n\n主要功能:\n- 關節保養\n\n\n價格: 990元\n"
+        passages = retrieval.chunk_document(text, title="商品名稱: 龜鹿精")
+        self.assertEqual(passages, ["商品名稱: 龜鹿精\n商品類別: 保健食品",
+                                    "商品名稱: 龜鹿精\n主要功能:\n- 關節保養",
+                                    "商品名稱: 龜鹿精\n價格: 990元"])
+
+
+class ProductRetrieverTest(unittest.TestCase):
+
+    def setUp(self):
+        passages, sources = zip(*PASSAGES)
+        self.retriever = retrieval.ProductRetriever.from_passages(list(passages), list(sources),
+                                                                  n_clusters=3)
+
+    def test_best_passage_for_a_query(self):
+        score, passage, source = self.retriever.passages("膝蓋痠痛怎麼辦", k=1)[0]
+        self.assertEqual(source, '產品A')
+        self.assertIn("關節保養", passage)
+
+    def test_product_filter(self):
+        results = self.retriever.passages("價格優惠", k=4, product_keys=['產品B'])
+        self.assertEqual({source for _, _, source in results}, {'產品B'})
+        self.assertEqual(len(results), 2)
+        self.assertEqual(self.retriever.passages("價格", product_keys=['產品Z']), [])
+
+    def test_ivf_with_every_cluster_probed_is_exact(self):
+        index = self.retriever.index
+        query = self.retriever.embedder.embed(["體重管理價格"])[0]
+        ivf = index.search(query, k=3, nprobe=len(index.centroids))
+        exact = index.exact_search(query, k=3)
+        self.assertEqual([passage for _, passage, _ in ivf],
+                         [passage for _, passage, _ in exact])
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.retriever.save(directory)
+            loaded = retrieval.ProductRetriever.load(directory)
+            query = "眼睛乾澀"
+            self.assertEqual(loaded.details(query, k=2), self.retriever.details(query, k=2))
+            self.assertIsInstance(loaded.index.vectors, np.memmap)
+            del loaded
+
+    def test_empty_index(self):
+        retriever = retrieval.ProductRetriever.from_passages([], [])
+        self.assertEqual(retriever.passages("任何問題"), [])
+        self.assertEqual(retriever.details("任何問題"), '')
+
+    def test_shipped_product_files(self):
+        retriever = retrieval.ProductRetriever.from_products(recommender.load_products())
+        _, passage, source = retriever.passages("葉黃素 眼睛", k=1)[0]
+        self.assertEqual(source, '產品B')
+        self.assertTrue(passage.startswith("商品名稱: "))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import threading
+import unittest
+from datetime import date, datetime, timedelta
+
+import replay_fakes
+import rollups
+
+NOW = datetime(2025, 3, 1, 9, 0, 0)
+
+
+class RecordingCursor:
+    """Cursor for backfill: the named cursor yields `rows`, the others record statements."""
+
+    def __init__(self, rows=(), log=None):
+        self.rows = list(rows)
+        self.log = log if log is not None else []
+        self.itersize = None
+
+    def execute(self, query, params=()):
+        self.log.append(' '.join(query.split()))
+
+    def executemany(self, query, params):
+        self.log.append((' '.join(query.split()), list(params)))
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        pass
+
+
+class RecordingConnection:
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.log = []
+
+    def cursor(self, name=None):
+        return RecordingCursor(self.rows if name else (), self.log)
+
+
+class RecordTurnTest(unittest.TestCase):
+
+    def setUp(self):
+        self.database = replay_fakes.FakeDatabase()
+
+    def record(self, conversation_id, now, stage_before, stage_after, outcome=None,
+               latency_ms=None, segment='60+'):
+        with self.database.connection() as conn:
+            cursor = conn.cursor()
+            rollups.record_turn(cursor, conversation_id, now, stage_before, stage_after,
+                                outcome, latency_ms, segment)
+
+    def daily(self, day=NOW.date(), segment='60+'):
+        columns = ('sessions', 'turns', 'stage_transitions', 'purchases', 'farewells',
+                   'latency_ms_total', 'timed_turns', 'latency_ms_max', 'duration_ms_total')
+        return dict(zip(columns, self.database.daily_rollups[(day, segment)]))
+
+    def test_conversation_counts_once(self):
+        self.record(1, NOW, 1, 1, latency_ms=120)
+        self.record(1, NOW + timedelta(seconds=30), 1, 2, latency_ms=200)
+        self.record(1, NOW + timedelta(seconds=60), 2, 2, rollups.PURCHASE)
+        self.record(1, NOW + timedelta(seconds=90), 2, 2, rollups.FAREWELL)
+
+        daily = self.daily()
+        self.assertEqual(daily['sessions'], 1)
+        self.assertEqual(daily['turns'], 4)
+        self.assertEqual(daily['stage_transitions'], 1)
+        self.assertEqual((daily['purchases'], daily['farewells']), (1, 0))
+        self.assertEqual((daily['latency_ms_total'], daily['timed_turns']), (320, 2))
+        self.assertEqual(daily['latency_ms_max'], 200)
+        self.assertEqual(daily['duration_ms_total'], 90000)
+        self.assertEqual(self.database.conversation_rollups[1]['outcome'], rollups.PURCHASE)
+
+    def test_later_turns_keep_the_first_day_and_segment(self):
+        self.record(2, NOW, None, 1, segment='40-59')
+        self.record(2, NOW + timedelta(days=1), 1, 1, segment='60+')
+        daily = self.daily(segment='40-59')
+        self.assertEqual((daily['sessions'], daily['turns']), (1, 2))
+        self.assertNotIn((NOW.date() + timedelta(days=1), '60+'), self.database.daily_rollups)
+
+    def test_concurrent_first_turns(self):
+        barrier = threading.Barrier(8)
+
+        def first_turn():
+            barrier.wait()
+            self.record(3, NOW, 1, 1)
+
+        threads = [threading.Thread(target=first_turn) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        daily = self.daily()
+        self.assertEqual((daily['sessions'], daily['turns']), (1, 8))
+        self.assertEqual(self.database.conversation_rollups[3]['turns'], 8)
+
+
+class DashboardTest(unittest.TestCase):
+
+    def test_summarize(self):
+        rows = [
+            (date(2025, 3, 1), '60+', 2, 6, 1, 1, 0, 300, 3, 150, 240000),
+            (date(2025, 3, 2), 'unknown', 2, 4, 0, 0, 1, 0, 0, 0, 120000),
+        ]
+        result = rollups.summarize(rows)
+        self.assertEqual(result['totalChats'], 4)
+        self.assertEqual(result['conversionRate'], "25.0")
+        self.assertEqual(result['avgDuration'], "1.5分鐘")
+        self.assertEqual(result['avgLatencyMs'], 100)
+        self.assertEqual(result['byDay']['2025-03-02']['farewells'], 1)
+        self.assertEqual(result['bySegment']['60+']['sessions'], 2)
+
+    def test_empty(self):
+        result = rollups.summarize([])
+        self.assertEqual((result['totalChats'], result['conversionRate']), (0, "0.0"))
+        self.assertIsNone(result['avgLatencyMs'])
+
+
+class BackfillTest(unittest.TestCase):
+
+    def test_locks_before_reading_and_rebuilds(self):
+        rows = [
+            (1, 'A001', "你好", NOW),
+            (1, '0000', "歡迎", NOW + timedelta(seconds=5)),
+            (1, 'A001', "我要買", NOW + timedelta(seconds=60)),
+            (1, '0000', "已下單", NOW + timedelta(seconds=65)),
+            (2, 'A001', "再見", NOW),
+            (2, '0000', "掰掰", NOW + timedelta(seconds=1)),
+        ]
+        conn = RecordingConnection(rows)
+        self.assertEqual(rollups.backfill(conn, "已下單", "掰掰"), (2, 1))
+
+        self.assertTrue(conn.log[0].startswith('LOCK TABLE conversation_rollup'))
+        (_, conversations), (_, daily) = conn.log[-2:]
+        self.assertEqual([row[:7] for row in conversations], [
+            (1, NOW.date(), 'unknown', 2, 1, 2, rollups.PURCHASE),
+            (2, NOW.date(), 'unknown', 1, 1, 2, rollups.FAREWELL),
+        ])
+        self.assertEqual(daily, [(NOW.date(), 'unknown', 2, 3, 2, 1, 1, 0, 0, 0, 66000)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+from concurrent import futures
+from unittest import mock
+
+import message_creation_handler as handler
+import profile_store
+import rollups
+import sessions
+
+
+class Flow:
+    """Stands in for the FlowClient; answer_turn is replaced, only the executor is used."""
+
+    def __init__(self):
+        self.executor = futures.ThreadPoolExecutor(max_workers=4)
+
+
+class ScriptedTurns:
+    """answer_turn stand-in: stage 1 moves to stage 2, '買' buys, 'error' fails."""
+
+    def __init__(self):
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, content, prompt, stage, count, customer_id=None, on_text=None,
+                 flow=None, profile=None):
+        with self._lock:
+            self.calls.append((content, prompt, stage, count, customer_id, profile))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            if content == 'error':
+                raise handler.flow_client.FlowError("flow failed")
+            if content == 'slow':
+                threading.Event().wait(0.05)
+            if '買' in content:
+                return stage, handler.finish(), rollups.PURCHASE
+            return 2, f"回覆{len(self.calls)}", None
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class SessionManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.turns = ScriptedTurns()
+        patch = mock.patch.object(handler, 'answer_turn', self.turns)
+        patch.start()
+        self.addCleanup(patch.stop)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'sessions.json')
+        self.profiles = profile_store.ProfileStore.from_rows(
+            [('7', '基本', '人口', '年齡區間', '60-69')])
+        self.clock = Clock()
+
+    def manager(self, **kwargs):
+        kwargs.setdefault('store', sessions.FileCheckpointStore(self.path))
+        return sessions.SessionManager(flow=Flow(), profiles=self.profiles, clock=self.clock,
+                                       executor=futures.ThreadPoolExecutor(max_workers=2),
+                                       **kwargs)
+
+    def run_turns(self, manager, *turns):
+        async def play():
+            return [await manager.turn(*turn) for turn in turns]
+        return asyncio.run(play())
+
+    def test_turns_carry_the_session_state(self):
+        manager = self.manager()
+        answers = self.run_turns(manager, ('s1', "你好", '7'), ('s1', "膝蓋痛"), ('s1', "還有嗎"))
+        self.assertEqual(answers, [(2, "回覆1"), (2, "回覆2"), (2, "回覆3")])
+        stages_and_counts = [(stage, count) for _, _, stage, count, _, _ in self.turns.calls]
+        self.assertEqual(stages_and_counts, [(1, 0), (2, 0), (2, 1)])
+        _, prompt, _, _, customer_id, profile = self.turns.calls[2]
+        self.assertEqual(prompt, "A001: 你好\n0000: 回覆1\nA001: 膝蓋痛\n0000: 回覆2\nA001: 還有嗎\n")
+        self.assertEqual(customer_id, '7')
+        self.assertEqual(profile, "客代: 7\n年齡區間: 60-69")
+        self.assertEqual(manager.stats.turns, 3)
+
+    def test_failed_turn_leaves_the_session_unchanged(self):
+        manager = self.manager()
+        self.run_turns(manager, ('s1', "你好"))
+        with self.assertRaises(handler.flow_client.FlowError):
+            self.run_turns(manager, ('s1', "error"))
+        session = manager.sessions['s1']
+        self.assertEqual((session.stage, session.count, session.turns), (2, 0, 1))
+        self.assertEqual(len(session.context.turns), 2)
+
+    def test_outcome_closes_the_session_even_after_a_restart(self):
+        manager = self.manager()
+        self.assertEqual(self.run_turns(manager, ('s1', "你好"), ('s1', "好，我要買"))[-1],
+                         (2, handler.finish()))
+        self.assertNotIn('s1', manager.sessions)
+        self.assertEqual(manager.stats.closed, 1)
+        asyncio.run(manager.close())
+
+        restarted = self.manager()
+        with self.assertRaises(sessions.SessionClosed):
+            self.run_turns(restarted, ('s1', "再見"))
+        self.assertEqual(restarted.stats.restored, 1)
+
+    def test_evicted_sessions_come_back_from_memory_or_checkpoint(self):
+        manager = self.manager(max_sessions=2, ttl=60)
+        self.run_turns(manager, ('a', "你好"), ('b', "你好"), ('c', "你好"))
+        self.assertEqual(list(manager.sessions), ['b', 'c'])
+        # Dirty and not yet checkpointed: kept aside, not lost
+        self.assertIn('a', manager._evicted)
+        self.run_turns(manager, ('a', "我回來了"))
+        self.assertEqual(manager.stats.restored, 0)
+        self.assertEqual(manager.sessions['a'].turns, 2)
+
+        self.assertEqual(asyncio.run(manager.checkpoint()), 3)
+        self.clock.now += 120
+        self.assertEqual(manager.evict(), 2)
+        self.assertEqual(manager._evicted, {})
+        self.run_turns(manager, ('c', "我也回來了"))
+        self.assertEqual(manager.stats.restored, 1)
+        session = manager.sessions['c']
+        self.assertEqual((session.stage, session.count, session.turns), (2, 1, 2))
+        self.assertEqual(session.context.transcript,
+                         "A001: 你好\n0000: 回覆3\nA001: 我也回來了\n0000: 回覆5\n")
+
+    def test_turns_of_one_session_run_one_at_a_time(self):
+        manager = self.manager()
+
+        async def play():
+            await asyncio.gather(*[manager.turn('s1', 'slow') for _ in range(3)],
+                                 *[manager.turn(f"other{i}", 'slow') for i in range(3)])
+
+        asyncio.run(play())
+        self.assertEqual(manager.sessions['s1'].turns, 3)
+        self.assertEqual([count for content, _, stage, count, _, _ in self.turns.calls
+                          if content == 'slow' and stage == 2], [0, 1])
+        self.assertGreater(self.turns.max_active, 1)  # other sessions did overlap
+
+
+class FileCheckpointStoreTest(unittest.TestCase):
+
+    def test_newer_checkpoints_win(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'sessions.json')
+            store = sessions.FileCheckpointStore(path)
+            newer = sessions.Session('s1', turns=3).checkpoint()
+            older = sessions.Session('s1', stage=2, turns=2).checkpoint()
+            store.save([newer])
+            store.save([older])
+            self.assertEqual(sessions.FileCheckpointStore(path).load('s1'), newer)
+            self.assertIsNone(store.load('s2'))
+
+
+if __name__ == "__main__":
+    unittest.main()
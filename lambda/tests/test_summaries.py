@@ -0,0 +1,106 @@
+import json
+import unittest
+from unittest import mock
+
+import summaries
+from bench_summaries import MemorySummaryStore, make_transcripts, summary_answer
+
+
+class Stop(Exception):
+    pass
+
+
+class EmptyQueue:
+
+    def __init__(self):
+        self.receives = 0
+
+    def receive(self, max_messages=10):
+        self.receives += 1
+        return []
+
+
+def llm(answer=summary_answer):
+    return lambda prompt: (answer(prompt), 1000, 200)
+
+
+class SummaryWorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.transcripts = make_transcripts(6)
+        self.store = MemorySummaryStore(self.transcripts)
+        self.queue = summaries.LocalQueue()
+
+    def test_batch_is_summarized_and_acknowledged(self):
+        for conversation_id in self.transcripts:
+            summaries.enqueue(conversation_id, queue=self.queue)
+        worker = summaries.SummaryWorker(self.queue, self.store, llm(), batch_size=4)
+        self.assertEqual(worker.run_once(), 4)
+        self.assertEqual(worker.run_once(), 2)
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(sorted(self.store.rows), list(self.transcripts))
+        self.assertEqual((worker.stats.summaries, worker.stats.llm_calls), (6, 2))
+        row = self.store.rows[1]
+        self.assertEqual(row[1], self.transcripts[1][0])
+        self.assertEqual(json.loads(row[4]), ["鴕鳥龜鹿精", "葉黃素"])
+
+    def test_redelivered_jobs_are_skipped(self):
+        worker = summaries.SummaryWorker(self.queue, self.store, llm())
+        summaries.enqueue(1, queue=self.queue)
+        worker.run_once()
+        summaries.enqueue(1, queue=self.queue)
+        worker.run_once()
+        self.assertEqual((worker.stats.summaries, worker.stats.skipped), (1, 1))
+        self.assertEqual(self.store.writes, 1)
+
+    def test_poison_job_is_dead_lettered(self):
+        self.queue.visibility_timeout = 0
+        self.queue.send({"conversationId": 2})
+        self.queue.send({"conversationId": "not an id"})
+        never = llm(lambda prompt: "{}")
+        worker = summaries.SummaryWorker(self.queue, self.store, never, max_receives=3)
+        while len(self.queue):
+            worker.run_once()
+        self.assertEqual(self.queue.dead, [{"conversationId": "not an id"}, {"conversationId": 2}])
+        self.assertEqual((worker.stats.failed, worker.stats.dead_lettered), (3, 2))
+
+    def test_parse_summaries_tolerates_prose(self):
+        text = '好的，以下是摘要：\n```json\n{"3": {"summary": "客戶購買"}, "4": "壞資料"}\n```'
+        self.assertEqual(summaries.parse_summaries(text), {"3": {"summary": "客戶購買"}})
+        self.assertEqual(summaries.parse_summaries("沒有 JSON"), {})
+
+
+class RunTest(unittest.TestCase):
+
+    def test_empty_queue_sleeps_between_polls(self):
+        queue = EmptyQueue()
+        worker = summaries.SummaryWorker(queue, None, None)
+        sleep = mock.Mock(side_effect=[None, None, Stop])
+        with mock.patch.object(summaries.time, 'sleep', sleep):
+            with self.assertRaises(Stop):
+                worker.run()
+        self.assertEqual(queue.receives, 3)
+        sleep.assert_called_with(summaries.SUMMARY_IDLE_SLEEP)
+
+    def test_idle_exit(self):
+        worker = summaries.SummaryWorker(EmptyQueue(), None, None)
+        with mock.patch.object(summaries.time, 'sleep') as sleep:
+            self.assertIs(worker.run(idle_exit=True), worker.stats)
+        sleep.assert_not_called()
+
+    def test_throttled_batch_backs_off(self):
+        error = Exception("slow down")
+        error.response = {'Error': {'Code': 'ThrottlingException'}}
+        worker = summaries.SummaryWorker(EmptyQueue(), None, None)
+        worker.run_once = mock.Mock(side_effect=[error, error, 0])
+        with mock.patch.object(summaries.time, 'sleep') as sleep, \
+                mock.patch.object(summaries.random, 'uniform', side_effect=lambda a, b: b):
+            worker.run(idle_exit=True)
+        delays = [call.args[0] for call in sleep.call_args_list]
+        self.assertEqual(delays, [summaries.SUMMARY_BACKOFF_BASE,
+                                  summaries.SUMMARY_BACKOFF_BASE * 2])
+        self.assertEqual((worker.stats.errors, worker.stats.throttled), (2, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
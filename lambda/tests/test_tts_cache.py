@@ -0,0 +1,30 @@
+import unittest
+
+import tts_cache
+
+
+class CacheKeyTest(unittest.TestCase):
+
+    def key(self, text="您好，歡迎光臨。", voice_id='Zhiyu', output_format='mp3',
+            sample_rate=16000):
+        return tts_cache.cache_key(text, voice_id, output_format, sample_rate)
+
+    def test_stable_hex_digest(self):
+        self.assertEqual(self.key(), self.key())
+        self.assertRegex(self.key(), r'^[0-9a-f]{64}$')
+
+    def test_spacing_and_width_do_not_matter(self):
+        self.assertEqual(self.key("  您好,歡迎光臨。\n"), self.key())
+        self.assertEqual(self.key("您好，\t\n歡迎光臨。"), self.key("您好, 歡迎光臨。"))
+
+    def test_synthesis_settings_matter(self):
+        keys = {self.key(), self.key(voice_id='Hiujin'), self.key(output_format='ogg_vorbis'),
+                self.key(sample_rate=24000), self.key("您好。")}
+        self.assertEqual(len(keys), 5)
+
+    def test_sample_rate_type_does_not_matter(self):
+        self.assertEqual(self.key(sample_rate='16000'), self.key())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import json
+import threading
+import time
+import unittest
+
+import audio_output
+import replay_fakes
+import tts_stream
+
+
+class SplitSentencesTest(unittest.TestCase):
+
+    def test_keeps_the_unfinished_tail(self):
+        sentences, rest = tts_stream.split_sentences("您好，我是 Luna。請問您想了解哪一項")
+        self.assertEqual(sentences, ["您好，我是 Luna。"])
+        self.assertEqual(rest, "請問您想了解哪一項")
+
+    def test_short_sentences_join_the_next(self):
+        sentences, rest = tts_stream.split_sentences("好的。我們今天有優惠活動！")
+        self.assertEqual(sentences, ["好的。我們今天有優惠活動！"])
+        self.assertEqual(rest, '')
+
+    def test_final_flushes_the_tail(self):
+        sentences, rest = tts_stream.split_sentences("最後一句沒有句號", final=True)
+        self.assertEqual(sentences, ["最後一句沒有句號"])
+        self.assertEqual(rest, '')
+
+    def test_long_clause_is_cut_at_a_comma(self):
+        text = "很長的句子" * 20 + "，" + "後半段" * 20
+        sentences, rest = tts_stream.split_sentences(text)
+        self.assertTrue(sentences)
+        self.assertTrue(all(len(s) <= tts_stream.MAX_SENTENCE_CHARS for s in sentences))
+        self.assertEqual(''.join(sentences) + rest, text)
+
+
+class SentenceSynthesizerTest(unittest.TestCase):
+
+    def test_segments_are_emitted_in_order(self):
+        # The first sentence is the slowest to synthesize
+        delays = {"第一句話比較長一點。": 0.05}
+
+        def synthesize(text):
+            time.sleep(delays.get(text, 0.0))
+            return None if text == "——————" else f"url:{text}"
+
+        emitted = []
+        synthesizer = tts_stream.SentenceSynthesizer(
+            synthesize, on_segment=lambda index, text, url: emitted.append((index, text)))
+        for delta in ("第一句話比較長一點。", "第二句話也很完整。", "——————\n", "最後一句"):
+            synthesizer.feed(delta)
+        urls = synthesizer.finish()
+
+        self.assertEqual(urls, [f"url:{text}" for text in synthesizer.texts])
+        self.assertEqual([text for _, text in emitted], synthesizer.texts)
+        self.assertEqual([index for index, _ in emitted], list(range(len(emitted))))
+        self.assertEqual(synthesizer.texts, ["第一句話比較長一點。", "第二句話也很完整。", "最後一句"])
+        self.assertEqual(synthesizer.fed_chars, len("第一句話比較長一點。第二句話也很完整。——————\n最後一句"))
+
+    def test_segments_reach_the_live_playlist_before_finish(self):
+        s3 = replay_fakes.FakeS3()
+        live = audio_output.LivePlaylist(s3, 'bucket', 'https://cdn', 7, 'turn-1')
+        release = threading.Event()
+
+        def synthesize(text):
+            if text.startswith("第二"):
+                release.wait(1)
+            return f"https://cdn/{len(text)}.mp3"
+
+        def listed():
+            body = s3.objects.get(f"bucket/{live.key}")
+            return json.loads(body) if body is not None else None
+
+        synthesizer = tts_stream.SentenceSynthesizer(synthesize, on_segment=live.add)
+        self.assertIsNone(listed())
+        synthesizer.feed("第一句話已經說完了。第二句話還在合成。")
+        for _ in range(100):
+            if listed() is not None:
+                break
+            time.sleep(0.01)
+        document = listed()
+        self.assertEqual([s['text'] for s in document['segments']], ["第一句話已經說完了。"])
+        self.assertFalse(document['complete'])
+
+        release.set()
+        synthesizer.finish()
+        live.close()
+        document = listed()
+        self.assertEqual(len(document['segments']), 2)
+        self.assertTrue(document['complete'])
+        self.assertEqual(live.url, f"https://cdn/{live.key}")
+
+    def test_live_playlist_rejects_unsafe_turn_ids(self):
+        for turn_id in ("../x", "", "a" * 65):
+            with self.subTest(turn_id=turn_id):
+                with self.assertRaises(ValueError):
+                    audio_output.live_playlist_key(1, turn_id)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+import tts_text
+
+
+class SsmlChunksTest(unittest.TestCase):
+
+    def test_markdown_and_numbers(self):
+        chunks = tts_text.ssml_chunks("# 優惠\n**價格** 1980元。")
+        self.assertEqual(len(chunks), 1)
+        self.assertNotIn('#', chunks[0])
+        self.assertNotIn('*', chunks[0])
+        self.assertIn('一千九百八十元', chunks[0])
+
+    def test_escapes_ssml(self):
+        chunk, = tts_text.ssml_chunks("買一送一 & <優惠>。")
+        self.assertTrue(chunk.startswith('<speak>') and chunk.endswith('</speak>'))
+        self.assertIn('&amp;', chunk)
+        self.assertIn('&lt;優惠&gt;', chunk)
+
+    def test_nothing_to_speak(self):
+        self.assertEqual(tts_text.ssml_chunks(""), [])
+        self.assertEqual(tts_text.ssml_chunks("  \n"), [])
+
+    def test_chunks_are_whole_sentences_within_the_limit(self):
+        text = "一句話。" * 50
+        chunks = tts_text.ssml_chunks(text, max_chars=30)
+        self.assertGreater(len(chunks), 1)
+        spoken = [chunk[len('<speak>'):-len('</speak>')] for chunk in chunks]
+        self.assertEqual(''.join(spoken), text)
+        for part in spoken:
+            self.assertLessEqual(len(part), 30)
+            self.assertTrue(part.endswith('。'))
+
+
+if __name__ == "__main__":
+    unittest.main()
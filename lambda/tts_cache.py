@@ -0,0 +1,162 @@
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+TTS_CACHE_SIZE = int(os.environ.get('TTS_CACHE_SIZE', 512))
+TTS_CACHE_PREFIX = os.environ.get('TTS_CACHE_PREFIX', 'tts/')
+# Polly bills per character, see https://aws.amazon.com/polly/pricing/
+POLLY_COST_PER_CHAR = float(os.environ.get('POLLY_COST_PER_CHAR', 0.000004))
+# prune() deletes objects older than this. Lookups stop handing out objects
+# PRUNE_MARGIN before that, and re-synthesize them instead, so a URL
+# remembered by any warm container never points at a pruned object; the
+# margin must be longer than a container lives.
+TTS_CACHE_MAX_AGE_DAYS = int(os.environ.get('TTS_CACHE_MAX_AGE_DAYS', 30))
+PRUNE_MARGIN = timedelta(hours=int(os.environ.get('TTS_CACHE_PRUNE_MARGIN_HOURS', 24)))
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_text(text: str) -> str:
+    return _WHITESPACE.sub(' ', unicodedata.normalize('NFKC', text)).strip()
+
+
+def cache_key(text: str, voice_id: str, output_format: str, sample_rate) -> str:
+    raw = '\x1f'.join([normalize_text(text), voice_id, output_format, str(sample_rate)])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class AudioCache:
+    """
+    Two-tier cache that maps a synthesis key to an S3 object key.
+
+    The in-process tier is an LRU shared by warm invocations. The persistent tier
+    is the bucket itself: audio is stored under a content-addressed key, so a
+    HEAD request tells whether an earlier container already produced it.
+    """
+
+    def __init__(self, s3_client, bucket: str, extension: str = 'wav',
+                 max_entries: int = TTS_CACHE_SIZE, prefix: str = TTS_CACHE_PREFIX,
+                 max_age_days: int = TTS_CACHE_MAX_AGE_DAYS):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.extension = extension
+        self.max_entries = max_entries
+        self.prefix = prefix
+        self.max_age = timedelta(days=max_age_days)
+        # cache key -> (object key, LastModified of the object)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.chars_saved = 0
+        self.miss_seconds = 0.0
+
+    def object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}.{self.extension}"
+
+    def _servable(self, last_modified) -> bool:
+        # Objects close to their prune age are synthesized again, which
+        # overwrites them with a new LastModified
+        return datetime.now(timezone.utc) - last_modified < self.max_age - PRUNE_MARGIN
+
+    def lookup(self, key: str, text: str = ''):
+        """
+        The object key of cached audio, or None on a miss. S3 errors other
+        than 404 (a 403 without ListBucket, throttling, 5xx) are misses too:
+        the answer is synthesized again rather than failing the turn.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._servable(entry[1]):
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                self.chars_saved += len(text)
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+
+        object_key = self.object_key(key)
+        try:
+            response = self.s3.head_object(Bucket=self.bucket, Key=object_key)
+        except (BotoCoreError, ClientError) as e:
+            code = e.response.get('Error', {}).get('Code') if isinstance(e, ClientError) else None
+            with self._lock:
+                self.misses += 1
+                if code not in ('404', 'NoSuchKey', 'NotFound'):
+                    self.errors += 1
+            if code not in ('404', 'NoSuchKey', 'NotFound'):
+                print(f"TTS cache lookup of {object_key} failed, treated as a miss: {e}")
+            return None
+
+        last_modified = response.get('LastModified') or datetime.now(timezone.utc)
+        if not self._servable(last_modified):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.persistent_hits += 1
+            self.chars_saved += len(text)
+        self._remember(key, object_key, last_modified)
+        return object_key
+
+    def store(self, key: str, object_key: str, elapsed: float = 0.0):
+        # `elapsed` is the time spent on synthesis and upload for this miss
+        with self._lock:
+            self.miss_seconds += elapsed
+        self._remember(key, object_key, datetime.now(timezone.utc))
+
+    def _remember(self, key: str, object_key: str, last_modified):
+        with self._lock:
+            self._entries[key] = (object_key, last_modified)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.persistent_hits + self.misses
+            hits = self.memory_hits + self.persistent_hits
+            avg_miss = self.miss_seconds / self.misses if self.misses else 0.0
+            return {
+                "lookups": lookups,
+                "memoryHits": self.memory_hits,
+                "persistentHits": self.persistent_hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "hitRate": hits / lookups if lookups else 0.0,
+                "charsSaved": self.chars_saved,
+                "pollyCostSaved": self.chars_saved * POLLY_COST_PER_CHAR,
+                "avgMissSeconds": avg_miss,
+                "secondsSaved": hits * avg_miss,
+                "entries": len(self._entries),
+            }
+
+    def prune(self, keep=()):
+        """
+        Deletes cached objects older than the cache's max age from the bucket,
+        except the object keys listed in `keep`. No container hands these out
+        any more (see PRUNE_MARGIN). Returns the number of deleted objects.
+        """
+        cutoff = datetime.now(timezone.utc) - self.max_age
+        keep = set(keep)
+        deleted = set()
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            stale = [obj['Key'] for obj in page.get('Contents', [])
+                     if obj['LastModified'] < cutoff and obj['Key'] not in keep]
+            if stale:
+                self.s3.delete_objects(Bucket=self.bucket,
+                                       Delete={'Objects': [{'Key': k} for k in stale]})
+                deleted.update(stale)
+        with self._lock:
+            for key in [k for k, (v, _) in self._entries.items() if v in deleted]:
+                del self._entries[key]
+        return len(deleted)
@@ -0,0 +1,129 @@
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# Sentence-final punctuation for Chinese (and the ASCII equivalents the model
+# sometimes emits). A newline also ends a sentence, which covers markdown lists.
+SENTENCE_END = re.compile(r'[。！？!?；;…\n]+[」』）)"\']*')
+# Long sentences without a full stop are cut at a comma instead.
+CLAUSE_END = re.compile(r'[，,、：:]')
+MIN_SENTENCE_CHARS = int(os.environ.get('MIN_SENTENCE_CHARS', 6))
+MAX_SENTENCE_CHARS = int(os.environ.get('MAX_SENTENCE_CHARS', 120))
+TTS_WORKERS = int(os.environ.get('TTS_WORKERS', 3))
+
+
+def split_sentences(buffer: str, final: bool = False):
+    """
+    Splits the complete sentences off the front of `buffer`.
+
+    Returns a (sentences, rest) tuple where `rest` is the unfinished tail. With
+    `final=True` the tail is returned as the last sentence.
+    """
+    sentences = []
+    start = 0
+    for match in SENTENCE_END.finditer(buffer):
+        end = match.end()
+        if len(buffer[start:end].strip()) < MIN_SENTENCE_CHARS:
+            continue
+        sentences.append(buffer[start:end])
+        start = end
+    rest = buffer[start:]
+
+    while len(rest) > MAX_SENTENCE_CHARS:
+        cut = None
+        for match in CLAUSE_END.finditer(rest, 0, MAX_SENTENCE_CHARS):
+            cut = match.end()
+        cut = cut or MAX_SENTENCE_CHARS
+        sentences.append(rest[:cut])
+        rest = rest[cut:]
+
+    if final and rest.strip():
+        sentences.append(rest)
+        rest = ''
+    sentences = [s.strip() for s in sentences if s.strip()]
+    return sentences, rest
+
+
+class SentenceSynthesizer:
+    """
+    Receives text deltas from a streaming LLM call and starts speech synthesis
+    for every finished sentence while generation continues.
+
+    `synthesize(text)` is called on a worker thread and returns the segment URL,
+    or None when the sentence has nothing to speak (a markdown rule, emoji);
+    such sentences are left out of the segments.
+    `on_segment(index, text, url)` is called in order as segments become ready.
+    """
+
+    def __init__(self, synthesize, on_segment=None, workers: int = TTS_WORKERS):
+        self._synthesize = synthesize
+        self._on_segment = on_segment
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._buffer = ''
+        self._texts = []
+        self._futures = []
+        self._lock = threading.Lock()
+        self._next_emit = 0
+        self._emitted = 0
+        self.fed_chars = 0
+
+    def feed(self, delta: str):
+        if not delta:
+            return
+        self.fed_chars += len(delta)
+        sentences, self._buffer = split_sentences(self._buffer + delta)
+        for sentence in sentences:
+            self._submit(sentence)
+
+    def _submit(self, sentence: str):
+        future = metrics.submit(self._executor, self._synthesize, sentence)
+        self._texts.append(sentence)
+        self._futures.append(future)
+        future.add_done_callback(self._emit_ready)
+
+    def _emit_ready(self, _):
+        with self._lock:
+            while self._next_emit < len(self._futures):
+                future = self._futures[self._next_emit]
+                if not future.done():
+                    break
+                if self._on_segment is not None and future.exception() is None \
+                        and future.result() is not None:
+                    self._on_segment(self._emitted, self._texts[self._next_emit],
+                                     future.result())
+                    self._emitted += 1
+                self._next_emit += 1
+
+    @property
+    def texts(self):
+        """Sentence texts of the segments, in order."""
+        return list(self._texts)
+
+    def finish(self):
+        """
+        Flushes the unfinished tail and waits for every segment.
+
+        Returns the list of segment URLs in sentence order; `texts` then
+        matches it. `on_segment` has been called for all of them.
+        """
+        sentences, self._buffer = split_sentences(self._buffer, final=True)
+        for sentence in sentences:
+            self._submit(sentence)
+        try:
+            urls = [future.result() for future in self._futures]
+            # A done callback may still be inside on_segment; wait for it, so
+            # every segment has been emitted when this returns
+            self._emit_ready(None)
+            kept = [(url, text) for url, text in zip(urls, self._texts) if url is not None]
+            self._texts = [text for _, text in kept]
+            return [url for url, _ in kept]
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def cancel(self):
+        for future in self._futures:
+            future.cancel()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,157 @@
+"""
+Text front end for speech synthesis.
+
+Answers are written for the screen: markdown headers, bullets and **bold**,
+prices like NT$1,980 and ranges like 3-5. `prepare` turns them into plain
+sentences with the numbers spelled out in Mandarin, and `ssml_chunks` packs the
+sentences into SSML documents small enough to be synthesized in parallel and
+well under Polly's per-request limit.
+"""
+import os
+import re
+from xml.sax.saxutils import escape
+
+from tts_stream import split_sentences
+
+# Polly accepts up to 3000 billed characters per request; smaller chunks are
+# synthesized in parallel, so a long answer is not one long request
+POLLY_MAX_CHARS = 3000
+TTS_CHUNK_CHARS = min(int(os.environ.get('TTS_CHUNK_CHARS', 160)), POLLY_MAX_CHARS)
+
+DIGITS = '零一二三四五六七八九'
+SMALL_UNITS = ('', '十', '百', '千')
+LARGE_UNITS = ('', '萬', '億', '兆')
+
+_CODE_FENCE = re.compile(r'^\s*```.*$', re.M)
+_HEADER = re.compile(r'^\s{0,3}#{1,6}\s*', re.M)
+_RULE = re.compile(r'^\s*([-*_])(\s*\1){2,}\s*$', re.M)
+_TABLE_SEPARATOR = re.compile(r'^\s*\|?[\s:|-]*-[\s:|-]*\|?\s*$', re.M)
+_BULLET = re.compile(r'^\s*(?:[-*+•]|\d+[.)、])\s+', re.M)
+_EMPHASIS = re.compile(r'(\*\*|__|\*|~~|`)(.+?)\1')
+_LINK = re.compile(r'!?\[([^\]]*)\]\([^)]*\)')
+_URL = re.compile(r'https?://\S+')
+_SYMBOLS = re.compile(r'[®™©]')
+_SENTENCE_FINAL = '。！？!?；;…：:，,'
+
+_THOUSANDS = re.compile(r'(?<=\d),(?=\d{3}(?!\d))')
+_CURRENCY = re.compile(r'(?:NT\$|NTD\s?|\$)\s?(\d+(?:\.\d+)?)(?:\s?元)?')
+_PERCENT = re.compile(r'(\d+(?:\.\d+)?)\s?[%％]')
+_RANGE = re.compile(r'(?<![\dA-Za-z.])(\d+)\s?[-~～]\s?(\d+)(?![\dA-Za-z.])')
+_PER_UNIT = re.compile(r'(?<=元)\s?/\s?(?=[^\W\d_])')
+_YEAR = re.compile(r'(?<!\d)(\d{4})(?=\s?年)')
+_NUMBER = re.compile(r'(?<![\dA-Za-z.])(\d+)(?:\.(\d+))?(?![\dA-Za-z])')
+
+
+def strip_markdown(text: str) -> str:
+    """Plain text with one sentence-terminated line per markdown block."""
+    text = _CODE_FENCE.sub('', text)
+    text = _RULE.sub('', text)
+    text = _TABLE_SEPARATOR.sub('', text)
+    text = _HEADER.sub('', text)
+    text = _BULLET.sub('', text)
+    text = _LINK.sub(r'\1', text)
+    text = _URL.sub('', text)
+    # Nested emphasis (***x***) needs a second pass
+    for _ in range(2):
+        text = _EMPHASIS.sub(r'\2', text)
+    text = _SYMBOLS.sub('', text)
+    lines = []
+    for line in text.splitlines():
+        line = line.replace('|', '，').strip(' \t，')
+        if not line:
+            continue
+        # A list item or header without punctuation still ends a sentence
+        if line[-1] not in _SENTENCE_FINAL:
+            line += '。'
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def chinese_number(n: int) -> str:
+    """Reading of a non-negative integer, e.g. 8910 -> 八千九百一十."""
+    if n == 0:
+        return DIGITS[0]
+    groups = []
+    while n:
+        n, group = divmod(n, 10000)
+        groups.append(group)
+    result = ''
+    zero = False
+    for index in range(len(groups) - 1, -1, -1):
+        group = groups[index]
+        if group == 0:
+            zero = bool(result)
+            continue
+        if result and (zero or group < 1000):
+            result += DIGITS[0]
+        result += _group_reading(group) + LARGE_UNITS[index]
+        zero = False
+    # 一十二 is read 十二 at the start of a number
+    if result.startswith('一十'):
+        result = result[1:]
+    return result
+
+
+def _group_reading(group: int) -> str:
+    result = ''
+    zero = False
+    for position in range(3, -1, -1):
+        digit = group // 10 ** position % 10
+        if digit == 0:
+            zero = bool(result)
+            continue
+        if zero:
+            result += DIGITS[0]
+            zero = False
+        result += DIGITS[digit] + SMALL_UNITS[position]
+    return result
+
+
+def digit_reading(digits: str) -> str:
+    return ''.join(DIGITS[int(d)] for d in digits)
+
+
+def _number(match) -> str:
+    whole, fraction = match.group(1), match.group(2)
+    # Phone and order numbers are read digit by digit
+    if len(whole) > 8 or (len(whole) > 1 and whole.startswith('0')):
+        reading = digit_reading(whole)
+    else:
+        reading = chinese_number(int(whole))
+    if fraction:
+        reading += '點' + digit_reading(fraction)
+    return reading
+
+
+def normalize_numbers(text: str) -> str:
+    text = _THOUSANDS.sub('', text)
+    text = _YEAR.sub(lambda m: digit_reading(m.group(1)), text)
+    text = _CURRENCY.sub(r'\1元', text)
+    text = _PER_UNIT.sub('一', text)  # 1980元/盒 is read 一千九百八十元一盒
+    text = _PERCENT.sub(lambda m: '百分之' + _number(_NUMBER.match(m.group(1))), text)
+    text = _RANGE.sub(r'\1到\2', text)
+    return _NUMBER.sub(_number, text)
+
+
+def prepare(text: str) -> str:
+    return normalize_numbers(strip_markdown(text))
+
+
+def ssml_chunks(text: str, max_chars: int = None):
+    """
+    SSML documents of whole sentences, each at most `max_chars` characters of
+    text unless a single sentence is longer. Empty when nothing is left to
+    speak.
+    """
+    max_chars = max_chars or TTS_CHUNK_CHARS
+    sentences, _ = split_sentences(prepare(text), final=True)
+    chunks = []
+    current = ''
+    for sentence in sentences:
+        if current and len(current) + len(sentence) > max_chars:
+            chunks.append(current)
+            current = ''
+        current += sentence
+    if current:
+        chunks.append(current)
+    return [f'<speak>{escape(chunk)}</speak>' for chunk in chunks]